@@ -1,17 +1,30 @@
-
 # Do a relative, rather than absolute, import.
 # To use, do panda.run_panda()
-from .panda_agent import run_panda, restart, py, test_panda, write_report, build_system_prompt
+# The imports are lazy (PEP 562 module __getattr__): "import panda" and "panda --version" stay fast, and the heavy
+# dependencies (litellm, openai, pandas, matplotlib) are only loaded when one of these names is first used.
+_LAZY_IMPORTS = {
+    "run_panda": ".panda_agent", "restart": ".panda_agent", "py": ".panda_agent", "test_panda": ".panda_agent",
+    "write_report": ".panda_agent", "build_system_prompt": ".panda_agent",
 # from .panda_agent import run_superpanda, restart_superpanda
 # from .panda_agent import run_iterpanda
 # from .panda_agent import run_cursor_panda
 #from .researchworld import ideate_tasks_for_topic, ideate_task_from_paper, ideate_tasks_from_papers
-from .utils import call_llm, call_llm_json, jprint, read_file_contents
+    "call_llm": ".utils", "call_llm_json": ".utils", "jprint": ".utils", "read_file_contents": ".utils",
 #from .evaluate import run_evaluation, score_answer, run_astabench_tasks, run_astabench_task
-
-
-
-
-
-
-
+}
+__all__ = list(_LAZY_IMPORTS)
+
+def __getattr__(name):
+    import importlib, importlib.util
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name in _LAZY_IMPORTS:
+        value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value			# next time, no __getattr__ needed
+        return value
+    if importlib.util.find_spec("." + name, __name__):		# e.g., panda.utils, panda.panda_agent
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
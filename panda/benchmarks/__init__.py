@@ -0,0 +1,14 @@
+"""
+Benchmarks of Panda's own overhead, run offline (no API keys, no tokens spent).
+
+agent_bench.py	End-to-end: representative tasks through run_panda(), driven by the mock LLM (utils/mock_llm.py), the local
+		mock server (utils/mock_server.py) or a recorded trace (panda_agent/replay.py). Reports the agent loop's
+		time by phase separately from the LLM's wall time, peak RSS, and how the overhead scales with the number
+		of iterations, as JSON.
+micro.py	Micro-benchmarks of the hot panda.utils functions (truncate_prompt, extract_json_from_string, parse_code, ...)
+		on realistic inputs, with a stored baseline (micro_baseline.json) to compare against.
+
+USAGE:
+python -m panda.benchmarks.agent_bench --json agent-bench.json
+python -m panda.benchmarks.micro --compare
+"""
@@ -0,0 +1,259 @@
+"""
+End-to-end benchmark of the agent loop: representative tasks through run_panda(), with the LLM mocked (or replayed), so
+what's measured is Panda's own per-iteration overhead - prompt building, truncation, JSON extraction, code execution
+and output capture, save_dialog(), write_report() - reported separately from the LLM's wall time (see utils/timing.py).
+
+For each task and iteration count we report:
+ - wall_seconds, llm_seconds (inside call_llm()), overhead_seconds (wall - llm) and overhead_per_iteration_ms
+ - phases: the exclusive seconds in each timed phase; "controller" is the rest of the agent loop (untimed bookkeeping)
+ - peak_rss_mb (the process's high-water mark so far; the cases run in increasing size) and rss_growth_mb
+and per task, the scaling of the overhead with the iteration count (the slope, and per-iteration overhead at the largest
+size / at the smallest: ~1.0 = linear, > 1 means each iteration gets slower as the dialog grows).
+Plus the CLI's startup time (panda --version) and the time to import the agent.
+
+Drivers (--driver):
+    mock	model="mock", in-process (default: no HTTP, so the least noise)
+    server	model="gpt-4.1" against a local utils/mock_server.py, so the real request building (truncation, messages),
+                HTTP transport and response parsing are included
+    replay	re-run a recorded experiment (--replay <experiment-trace-long.txt>); the tasks and sizes are the trace's
+
+The mock agent's plan has (iterations - 3) / 2 steps (config.MOCK_PLAN_STEPS), each running the task's code (MOCK_ACTION).
+
+USAGE:
+python -m panda.benchmarks.agent_bench
+python -m panda.benchmarks.agent_bench --iterations 9,33,65 --repeat 3 --json agent-bench.json
+python -m panda.benchmarks.agent_bench --driver server --latency '{"dist": "fixed", "seconds": 0.05}'
+python -m panda.benchmarks.agent_bench --replay output/experiment-20260210-143138/experiment-trace-long.txt
+python -m panda.benchmarks.agent_bench --max-overhead-ms 100 --max-startup 2.0	# exit status 1 if over budget (e.g., for CI)
+python -m panda.benchmarks.agent_bench --compact-after 1500 --no-startup	# with the dialog compacted: exit status 1 if a run is cut short
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from contextlib import redirect_stdout, redirect_stderr
+
+from panda.utils import config
+from panda.utils.logger import logger
+from panda.utils.timing import get_timings, reset_timings, peak_rss, current_rss
+
+# The code the mock agent runs at each step ({step} = the step number, {model} = the benchmark's model)
+TASKS = {
+    "print": {
+        "task": "Benchmark: a plan whose steps each print one line.",
+        "action": 'print("Mock step {step} done")'},
+    "dataframe": {
+        "task": "Benchmark: a plan whose steps each build and describe a 2000-row DataFrame.",
+        "action": "import numpy as np\nimport pandas as pd\n"
+                  "df_{step} = pd.DataFrame({'x': np.arange(2000), 'y': np.sin(np.arange(2000) / 10), 'label': ['item ' + str(i % 7) for i in range(2000)]})\n"
+                  "print(df_{step}.describe())\nprint(df_{step}.head(20))\nprint(df_{step}.groupby('label')['y'].mean())"},
+    "llm_calls": {
+        "task": "Benchmark: a plan whose steps each make 10 LLM calls from the generated code.",
+        "action": "answers_{step} = [call_llm(f'What is {i} + {step}?', model='{model}') for i in range(10)]\nprint(answers_{step})"},
+}
+
+DEFAULT_ITERATIONS = [9, 17, 33]
+MB = 1024 * 1024
+
+### ======================================================================
+###		ONE RUN
+### ======================================================================
+
+def run_case(task_name, model, iterations, replay_from=None):
+    from panda.panda_agent import run_panda, my_globals
+    from panda.panda_agent import config as agent_config
+    if not replay_from:
+        task = TASKS[task_name]
+        config.MOCK_PLAN_STEPS = max(1, (iterations - 3) // 2)
+        config.MOCK_ACTION = task["action"].replace("{model}", model)
+    agent_config.REPORT_WRITER_LLM = agent_config.REPORT_TRANSLATOR_LLM = model	# the report writer mustn't call a real LLM
+
+    outputs_dir = tempfile.mkdtemp(prefix="panda-bench-")
+    reset_timings()
+    rss_before = current_rss()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):		# the agent's (and the generated code's) printing
+            result = run_panda(task=None if replay_from else task["task"], model=model, force_report=True, outputs_dir=outputs_dir,
+                               replay_from=replay_from)
+    finally:
+        wall = time.perf_counter() - start
+        shutil.rmtree(outputs_dir, ignore_errors=True)
+    rss_after, peak = current_rss(), peak_rss()
+
+    phases = {phase: totals['seconds'] for phase, totals in get_timings().items()}
+    llm_seconds = phases.pop('llm', 0.0)
+    phases['controller'] = max(0.0, wall - llm_seconds - sum(phases.values()))
+    iterations_run = my_globals.state['state'].iteration if getattr(my_globals, 'state', None) else 0
+    overhead = wall - llm_seconds
+    return {'task': task_name, 'iterations_requested': iterations, 'iterations': iterations_run, 'result_flag': result['result_flag'],
+            'compaction_folds': my_globals.compaction.folds if my_globals.compaction else 0,
+            'wall_seconds': round(wall, 4), 'llm_seconds': round(llm_seconds, 4), 'overhead_seconds': round(overhead, 4),
+            'overhead_per_iteration_ms': round(1000 * overhead / max(1, iterations_run), 3),
+            'phases': {phase: round(seconds, 4) for phase, seconds in sorted(phases.items())},
+            'llm_calls': result['llm_usage']['calls'],
+            'peak_rss_mb': round(peak / MB, 1) if peak else None,
+            'rss_growth_mb': round((rss_after - rss_before) / MB, 1) if rss_before and rss_after else None}
+
+# Run a case repeat times, and keep the run with the median overhead
+def run_repeated(task_name, model, iterations, repeat=1, replay_from=None):
+    runs = [run_case(task_name, model, iterations, replay_from=replay_from) for _ in range(repeat)]
+    runs.sort(key=lambda run: run['overhead_seconds'])
+    median = runs[len(runs) // 2]
+    median['repeats'] = repeat
+    median['overhead_seconds_all'] = [run['overhead_seconds'] for run in runs]
+    return median
+
+### ======================================================================
+###		SCALING, STARTUP, BUDGETS
+### ======================================================================
+
+# Least-squares slope of overhead vs. iterations, and how much slower an iteration is at the largest size than the smallest
+def scaling(cases):
+    points = [(case['iterations'], case['overhead_seconds']) for case in cases if case['iterations']]
+    if len(points) < 2:
+        return None
+    mean_x, mean_y = statistics.mean(x for x, _ in points), statistics.mean(y for _, y in points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / variance if variance else None
+    smallest, largest = min(points), max(points)
+    growth = (largest[1] / largest[0]) / (smallest[1] / smallest[0]) if smallest[1] else None
+    return {'points': [{'iterations': x, 'overhead_seconds': y} for x, y in sorted(points)],
+            'slope_ms_per_iteration': round(1000 * slope, 3) if slope is not None else None,
+            'growth': round(growth, 3) if growth else None}
+
+# Median seconds to run a fresh Python process (3 runs)
+def time_command(args, runs=3):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times), 4)
+
+def measure_startup():
+    return {'python_seconds': time_command(["-c", "pass"]),
+            'cli_version_seconds': time_command(["-m", "panda.run_panda", "--version"]),
+            'import_agent_seconds': time_command(["-c", "import panda; panda.run_panda"])}
+
+# (Also a correctness check: a mock run must run its whole plan, e.g., even when its dialog is compacted)
+def check_budgets(results, max_overhead_ms=None, max_startup=None):
+    failures = []
+    for case in results['cases']:
+        if case['iterations_requested'] and (case['result_flag'] != "done" or case['iterations'] != case['iterations_requested']):
+            failures.append(f"{case['task']} x{case['iterations_requested']}: the run stopped after {case['iterations']} iterations ({case['result_flag']})")
+        if max_overhead_ms is not None and case['overhead_per_iteration_ms'] > max_overhead_ms:
+            failures.append(f"{case['task']} x{case['iterations']}: {case['overhead_per_iteration_ms']}ms overhead per iteration > {max_overhead_ms}ms")
+    startup = results.get('startup') or {}
+    if max_startup is not None and startup.get('cli_version_seconds', 0) > max_startup:
+        failures.append(f"panda --version took {startup['cli_version_seconds']}s > {max_startup}s")
+    return failures
+
+def environment():
+    from panda.panda_agent import config as agent_config
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'panda_version': agent_config.VERSION, 'git_commit': commit, 'python': platform.python_version(),
+            'platform': platform.platform(), 'processor': platform.processor() or platform.machine()}
+
+### ======================================================================
+###		THE BENCHMARK
+### ======================================================================
+
+def run_benchmark(tasks=None, iterations=None, repeat=1, driver="mock", replay_from=None, latency=None, startup=True, compact_after=None):
+    from panda.panda_agent import config as agent_config
+    tasks = tasks or list(TASKS)
+    iterations = sorted(iterations or DEFAULT_ITERATIONS)
+    config.LLM_CACHE_ENABLED = False			# every run must do the same work
+    if latency is not None:
+        config.MOCK_LATENCY = latency
+    config.MOCK_ERRORS = {}
+    if compact_after is not None:			# compact the dialog early (see panda_agent/compaction.py), to include it at these sizes
+        agent_config.COMPACT_DIALOG, agent_config.COMPACT_AFTER_WORDS = True, compact_after
+    server = None
+    if driver == "server":
+        from panda.utils.mock_server import start_mock_server
+        server, config.OAI_ENDPOINT = start_mock_server(latency=latency)
+        model = "gpt-4.1"
+    else:
+        model = "mock"
+
+    log_level = logger.level
+    logger.setLevel(logging.ERROR)
+    results = {'benchmark': 'agent', 'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'driver': driver, 'model': model,
+               'environment': environment(), 'cases': [], 'scaling': {}}
+    try:
+        if replay_from:
+            results['cases'].append(run_repeated("replay", model, None, repeat=repeat, replay_from=replay_from))
+        else:
+            for task_name in tasks:
+                cases = [run_repeated(task_name, model, n, repeat=repeat) for n in iterations]
+                results['cases'] += cases
+                results['scaling'][task_name] = scaling(cases)
+    finally:
+        logger.setLevel(log_level)
+        if server:
+            server.shutdown()
+    if startup:
+        results['startup'] = measure_startup()
+    return results
+
+def print_results(results):
+    print(f"\nPanda agent benchmark ({results['driver']}, {results['model']})")
+    phases = sorted({phase for case in results['cases'] for phase in case['phases']})
+    print(f"{'task':<12}{'iters':>6}{'wall s':>9}{'llm s':>8}{'ms/iter':>9}{'peak MB':>9}  " + "  ".join(f"{phase:>12}" for phase in phases))
+    for case in results['cases']:
+        print(f"{case['task']:<12}{case['iterations']:>6}{case['wall_seconds']:>9.3f}{case['llm_seconds']:>8.3f}{case['overhead_per_iteration_ms']:>9.1f}"
+              f"{case['peak_rss_mb'] or 0:>9.1f}  " + "  ".join(f"{case['phases'].get(phase, 0):>12.4f}" for phase in phases))
+    for task_name, scale in results['scaling'].items():
+        if scale:
+            print(f"scaling {task_name}: {scale['slope_ms_per_iteration']} ms per extra iteration, per-iteration growth x{scale['growth']}")
+    if results.get('startup'):
+        print("startup:", ", ".join(f"{key} {value}" for key, value in results['startup'].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of Panda's agent loop overhead (offline, mocked LLM).")
+    parser.add_argument("--tasks", default=",".join(TASKS), help=f"Comma-separated tasks, from {list(TASKS)}.")
+    parser.add_argument("--iterations", default=",".join(map(str, DEFAULT_ITERATIONS)), help="Comma-separated agent iteration counts (the scaling curve).")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case (the median is reported).")
+    parser.add_argument("--driver", choices=["mock", "server", "replay"], default="mock")
+    parser.add_argument("--replay", default=None, help="An experiment-trace-long.txt to replay (implies --driver replay).")
+    parser.add_argument("--latency", type=json.loads, default=None, help='Mock LLM latency (JSON), e.g., \'{"dist": "fixed", "seconds": 0.05}\'')
+    parser.add_argument("--compact-after", type=int, default=None, help="Compact the dialog once the prompt passes this many words (default: config.COMPACT_AFTER_WORDS).")
+    parser.add_argument("--no-startup", action="store_true", help="Skip measuring the startup time.")
+    parser.add_argument("--json", default=None, help="Write the results to this file as JSON ('-' for stdout).")
+    parser.add_argument("--max-overhead-ms", type=float, default=None, help="Fail if any case's overhead per iteration exceeds this.")
+    parser.add_argument("--max-startup", type=float, default=None, help="Fail if 'panda --version' takes longer than this (seconds).")
+    args = parser.parse_args()
+    if args.driver == "replay" and not args.replay:
+        parser.error("--driver replay needs --replay <experiment-trace-long.txt>")
+
+    results = run_benchmark(tasks=args.tasks.split(","), iterations=[int(n) for n in args.iterations.split(",")], repeat=args.repeat,
+                            driver="replay" if args.replay else args.driver, replay_from=args.replay, latency=args.latency,
+                            startup=not args.no_startup, compact_after=args.compact_after)
+    results['budget_failures'] = check_budgets(results, args.max_overhead_ms, args.max_startup)
+    if args.json == "-":
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as file:
+                json.dump(results, file, indent=2)
+    for failure in results['budget_failures']:
+        print("FAILED:", failure, file=sys.stderr)
+    sys.exit(1 if results['budget_failures'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+"""
+Micro-benchmarks of the panda.utils functions on the per-iteration or per-row path, on realistic inputs: an 80k-word
+agent dialog, a 500-line generated code block, a long agent response, 10k-row DataFrames. Results can be saved as a
+baseline and later runs compared against it, so an optimization can be measured (and a regression caught).
+
+Each benchmark is timed call by call (any per-call setup, e.g., a fresh DataFrame to mutate, isn't timed) until it has
+run for --min-time seconds (at least 3 calls); we report the min, median and mean (microseconds). Comparisons use the median.
+
+The baseline (micro_baseline.json, next to this file) is machine-specific: re-save it on the machine you compare on.
+
+USAGE:
+python -m panda.benchmarks.micro				# run all, print a table
+python -m panda.benchmarks.micro --filter truncate		# just the matching benchmarks
+python -m panda.benchmarks.micro --save-baseline		# store this run as the baseline
+python -m panda.benchmarks.micro --compare			# compare with the baseline (exit status 1 if anything got > --tolerance slower)
+python -m panda.benchmarks.micro --compare --json micro.json	# also write the results (and comparison) as JSON
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+DEFAULT_MIN_TIME = 0.5		# seconds per benchmark
+DEFAULT_TOLERANCE = 0.15	# slower than the baseline by more than this fraction = a regression
+MAX_CALLS = 10000
+
+### ======================================================================
+###		REALISTIC INPUTS (deterministic)
+### ======================================================================
+
+# A generated code block of about n_lines lines, in the style of the agent's actions
+def make_code(n_lines=500, seed=0):
+    rng = random.Random(seed)
+    blocks = []
+    i = 0
+    while sum(block.count("\n") + 1 for block in blocks) < n_lines:
+        i += 1
+        kind = rng.choice(["function", "loop", "dataframe", "llm", "dict"])
+        if kind == "function":
+            blocks.append(f'def score_answer_{i}(answer, correct):\n    """Score one answer (1 if correct, else 0)."""\n'
+                          f'    answer = str(answer).strip().lower()\n    if answer == str(correct).strip().lower():\n        return 1\n'
+                          f'    return 0')
+        elif kind == "loop":
+            blocks.append(f'results_{i} = []\nfor index, row in dataset.iterrows():\n    response = row["response"]\n'
+                          f'    score = score_answer_{max(1, i-1)}(response, row["correct_answer"]) if "score_answer_{max(1, i-1)}" in globals() else 0\n'
+                          f'    results_{i}.append({{"id": index, "score": score}})\n    print(f"Item {{index}}: {{response}} -> {{score}}")')
+        elif kind == "dataframe":
+            blocks.append(f'summary_{i} = dataset.groupby("category").agg(mean_score=("score", "mean"), n=("score", "count"))\n'
+                          f'summary_{i} = summary_{i}.sort_values("mean_score", ascending=False)\nprint(summary_{i}.to_string())')
+        elif kind == "llm":
+            blocks.append(f'prompt_{i} = f"""Answer the following question concisely.\nQuestion: {{question}}\nAnswer:"""\n'
+                          f'answer_{i} = call_llm(prompt_{i}, model="gpt-4.1")\nprint(answer_{i})')
+        else:
+            blocks.append(f'config_{i} = {{\n    "model": "gpt-4.1",\n    "temperature": 0,\n    "n_examples": {rng.randint(5, 100)},\n'
+                          f'    "categories": ["math", "reasoning", "coding"],\n}}\nprint(config_{i})')
+    return "\n\n".join(blocks)
+
+# A DataFrame-like printout, as appears in the agent's observations
+def make_table(n_rows, seed=0):
+    rng = random.Random(seed)
+    lines = ["    problem_id            question  correct_answer  model_answer  score"]
+    for i in range(n_rows):
+        a, b = rng.randint(10, 99), rng.randint(10, 99)
+        lines.append(f"{i:>4}  {i+1:>8}  What is {a} + {b}?  {a+b:>14}  {a+b if rng.random() < 0.8 else a+b+1:>12}  {rng.choice([0, 1]):>5}")
+    return "\n".join(lines)
+
+# An agent response: {"thought":.., "action":..} with a code block
+def make_response(n_lines=40, seed=0):
+    code = make_code(n_lines, seed)
+    return "```json\n" + json.dumps({"thought": "I'll now score each answer and summarize the results by category. " * 3, "action": code}, indent=2) + "\n```"
+
+# An agent dialog of about n_words words: the real system prompt, then observations (code echo + tables) and responses
+def make_dialog(n_words=80000, seed=0):
+    prompt_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "panda_agent", "panda_agent_prompt.txt")
+    with open(prompt_file, encoding="utf-8") as file:
+        dialog = [file.read() + "\nNOW: Here is your top-level research task:\nHow good is Claude at 2-digit addition?\n"]
+    rng = random.Random(seed)
+    words = len(dialog[0].split())
+    turn = 0
+    while words < n_words:
+        turn += 1
+        observation = ("I'll now execute the actions (code) you suggested...\n\n----------- START PYTHON ENVIRONMENT -----------\n" +
+                       make_code(rng.randint(10, 40), seed + turn) + "\n" + make_table(rng.randint(10, 60), seed + turn) +
+                       "\n----------- END PYTHON ENVIRONMENT -----------\n\n#" + str(turn) + ". Reflect on Step 1\n" + "Please reflect. " * 20)
+        response = make_response(rng.randint(10, 40), seed + turn)
+        dialog += [observation, response]
+        words += len(observation.split()) + len(response.split())
+    return dialog
+
+# About n_chars of text in the style of an LLM-written report, with the typical non-ASCII characters (or none)
+def make_text(n_chars=100000, unicode=True, seed=0):
+    rng = random.Random(seed)
+    sentences = ["The model answered 93% of the questions correctly.", "Results were consistent across the five categories.",
+                 "Accuracy on multi-step problems was lower.", "We used a dataset of 30 examples, generated by GPT-4.1."]
+    if unicode:
+        sentences += ["Claude’s answers were “mostly” right — with a few exceptions…",
+                      "Performance dropped on naïve résumé-style prompts (≈ 12%).", "Scores: μ = 0.82, σ = 0.07 – see Table 1."]
+    parts, length = [], 0
+    while length < n_chars:
+        sentence = rng.choice(sentences)
+        parts.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(parts)
+
+# A nested JSON object, e.g., a json_schema response_format or a parsed agent response
+def make_nested(n_items=200, seed=0):
+    rng = random.Random(seed)
+    return {"type": "json_schema", "json_schema": {"name": "results", "strict": True, "schema": {"type": "object", "properties": {
+        "items": [{"id": i, "question": f"What is {rng.randint(10, 99)} + {rng.randint(10, 99)}?", "tags": ["math", "addition"],
+                   "scores": {"correct": rng.choice([0, 1]), "confidence": round(rng.random(), 3)}} for i in range(n_items)]}}}}
+
+### ======================================================================
+###		THE BENCHMARKS
+### ======================================================================
+
+BENCHMARKS = {}			# name -> function returning (fn, setup): each timed call is fn(*setup())
+
+def benchmark(name):
+    def register(make):
+        BENCHMARKS[name] = make
+        return make
+    return register
+
+no_setup = lambda: ()
+
+@benchmark("truncate_prompt/80k_words_fits")
+def bench_truncate_fits():
+    from panda.utils.ask_llm import truncate_prompt
+    dialog = make_dialog(80000)
+    return (lambda: truncate_prompt(dialog, max_words=100000)), no_setup
+
+@benchmark("truncate_prompt/80k_words_to_40k")
+def bench_truncate_to_40k():
+    from panda.utils.ask_llm import truncate_prompt
+    dialog = make_dialog(80000)
+    return (lambda: truncate_prompt(dialog, max_words=40000)), no_setup
+
+@benchmark("truncate_prompt/80k_words_to_40k_cold")	# the first call on a dialog (no memoized word counts)
+def bench_truncate_cold():
+    from panda.utils.ask_llm import truncate_prompt
+    from panda.utils.dialog import word_count, join_words
+    dialog = make_dialog(80000)
+    def setup():
+        word_count.cache_clear()
+        join_words.cache_clear()
+        return ()
+    return (lambda: truncate_prompt(dialog, max_words=40000)), setup
+
+@benchmark("extract_json_from_string/agent_response")
+def bench_extract_json():
+    from panda.utils.utils import extract_json_from_string
+    response = make_response(150)
+    return (lambda: extract_json_from_string(response)), no_setup
+
+@benchmark("extract_json_from_string/needs_repair")
+def bench_extract_json_repair():
+    from panda.utils.utils import extract_json_from_string
+    response = make_response(150).rstrip("`\n").rstrip("}") + ',\n'		# truncated, with a trailing comma
+    return (lambda: extract_json_from_string(response)), no_setup
+
+@benchmark("replace_special_chars_with_ascii/100k_ascii")
+def bench_ascii_plain():
+    from panda.utils.utils import replace_special_chars_with_ascii
+    text = make_text(100000, unicode=False)
+    return (lambda: replace_special_chars_with_ascii(text)), no_setup
+
+@benchmark("replace_special_chars_with_ascii/100k_unicode")
+def bench_ascii_unicode():
+    from panda.utils.utils import replace_special_chars_with_ascii
+    text = make_text(100000, unicode=True)
+    return (lambda: replace_special_chars_with_ascii(text)), no_setup
+
+@benchmark("transliterate/agent_response_one_accent")	# call_llm()'s normalization of every response
+def bench_transliterate():
+    from panda.utils.normalize import transliterate
+    response = make_response(150).replace("answer", "answér", 1)
+    return (lambda: transliterate(response)), no_setup
+
+@benchmark("convert_to_hashable/200_items")
+def bench_to_hashable():
+    from panda.utils.ask_llm import convert_to_hashable
+    nested = make_nested(200)
+    return (lambda: convert_to_hashable(nested)), no_setup
+
+@benchmark("convert_from_hashable/200_items")
+def bench_from_hashable():
+    from panda.utils.ask_llm import convert_to_hashable, convert_from_hashable
+    hashable = convert_to_hashable(make_nested(200))
+    return (lambda: convert_from_hashable(hashable)), no_setup
+
+@benchmark("parse_code/500_lines")
+def bench_parse_code():
+    from panda.utils.pyparser import parse_code
+    code = make_code(500)
+    return (lambda: parse_code(code)), no_setup
+
+@benchmark("code_asks_for_user_input/500_lines")
+def bench_user_input():
+    from panda.utils.pyparser import code_asks_for_user_input
+    code = make_code(500)
+    return (lambda: code_asks_for_user_input(code)), no_setup
+
+@benchmark("add_list_of_dicts_to_df/10k_rows")
+def bench_add_dicts():
+    import pandas as pd
+    from panda.utils.mapping import add_list_of_dicts_to_df
+    rng = random.Random(0)
+    df = pd.DataFrame({"question": [f"What is {i} + {i+1}?" for i in range(10000)], "correct_answer": [2*i + 1 for i in range(10000)]})
+    responses = [{"answer": str(2*i + 1 if rng.random() < 0.9 else 2*i), "confidence": round(rng.random(), 3), "explanation": "Adding the digits."}
+                 for i in range(10000)]
+    return add_list_of_dicts_to_df, (lambda: (df.copy(), responses))	# it adds columns to df, so each call gets a fresh copy
+
+### ======================================================================
+###		TIMING, BASELINES
+### ======================================================================
+
+def time_benchmark(name, min_time=DEFAULT_MIN_TIME):
+    fn, setup = BENCHMARKS[name]()
+    fn(*setup())					# warm up (imports, memos, caches)
+    times = []
+    total = 0.0
+    while (total < min_time or len(times) < 3) and len(times) < MAX_CALLS:
+        args = setup()
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+    micro = [1e6 * t for t in times]
+    return {'calls': len(times), 'min_us': round(min(micro), 2), 'median_us': round(statistics.median(micro), 2),
+            'mean_us': round(statistics.mean(micro), 2), 'stdev_us': round(statistics.stdev(micro), 2) if len(micro) > 1 else 0.0}
+
+def run_micro(names=None, min_time=DEFAULT_MIN_TIME, verbose=True):
+    from .agent_bench import environment
+    names = names or list(BENCHMARKS)
+    results = {'benchmark': 'micro', 'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'environment': environment(), 'results': {}}
+    for name in names:
+        results['results'][name] = time_benchmark(name, min_time)
+        if verbose:
+            print(f"  {name:<48}{results['results'][name]['median_us']:>14,.1f} us", file=sys.stderr)
+    return results
+
+def load_baseline(path=BASELINE_FILE):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+def save_baseline(results, path=BASELINE_FILE):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+        file.write("\n")
+
+# {name: {'baseline_us', 'current_us', 'ratio', 'verdict'}}, ratio = current / baseline median (< 1 = faster)
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    comparison = {}
+    for name, result in results['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            comparison[name] = {'baseline_us': None, 'current_us': result['median_us'], 'ratio': None, 'verdict': "new"}
+            continue
+        ratio = result['median_us'] / old['median_us'] if old['median_us'] else None
+        verdict = ("slower" if ratio > 1 + tolerance else "faster" if ratio < 1 / (1 + tolerance) else "same") if ratio else "same"
+        comparison[name] = {'baseline_us': old['median_us'], 'current_us': result['median_us'], 'ratio': round(ratio, 3) if ratio else None, 'verdict': verdict}
+    return comparison
+
+def print_results(results, comparison=None):
+    print(f"\n{'benchmark':<48}{'median us':>14}{'min us':>14}{'calls':>8}" + (f"{'baseline us':>14}{'ratio':>8}  verdict" if comparison else ""))
+    for name, result in results['results'].items():
+        line = f"{name:<48}{result['median_us']:>14,.1f}{result['min_us']:>14,.1f}{result['calls']:>8}"
+        if comparison:
+            entry = comparison[name]
+            line += f"{entry['baseline_us'] or 0:>14,.1f}{entry['ratio'] or 0:>8.2f}  {entry['verdict']}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of Panda's hot utility functions, with stored baselines.")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks whose name contains this.")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit.")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="Seconds to spend timing each benchmark.")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="The baseline file.")
+    parser.add_argument("--save-baseline", action="store_true", help="Save this run as the baseline (merged into any existing one).")
+    parser.add_argument("--compare", action="store_true", help="Compare with the baseline.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Fraction slower than the baseline that counts as a regression.")
+    parser.add_argument("--json", default=None, help="Write the results (and comparison) to this file as JSON ('-' for stdout).")
+    args = parser.parse_args()
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return
+
+    names = [name for name in BENCHMARKS if not args.filter or args.filter in name]
+    results = run_micro(names, min_time=args.min_time)
+    comparison = compare(results, load_baseline(args.baseline), args.tolerance) if args.compare else None
+    if comparison:
+        results['comparison'] = comparison
+    if args.json == "-":
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results, comparison)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as file:
+                json.dump(results, file, indent=2)
+    if args.save_baseline:
+        if os.path.exists(args.baseline):		# keep the baselines of benchmarks we didn't run this time
+            merged = load_baseline(args.baseline)
+            merged['results'].update(results['results'])
+            results = {**results, 'results': merged['results']}
+        results.pop('comparison', None)
+        save_baseline(results, args.baseline)
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+    regressions = [name for name, entry in (comparison or {}).items() if entry['verdict'] == "slower"]
+    for name in regressions:
+        print(f"REGRESSION: {name} is {comparison[name]['ratio']}x the baseline", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
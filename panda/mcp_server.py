@@ -64,9 +64,31 @@ GPT says:
 import contextlib, io
 import os
 
+# sys.stdout is process-wide, so with several jobs running at once (each in a thread), a plain redirect_stdout() per job
+# would restore the wrong stream when the jobs finish out of order. Instead, the first job in silences stdout, and the
+# last one out restores it.
+_quiet_jobs = 0
+_quiet_lock = threading.Lock()
+_saved_stdout = None
+
+@contextlib.contextmanager
+def _quiet_stdout():
+    global _quiet_jobs, _saved_stdout
+    with _quiet_lock:
+        if _quiet_jobs == 0:
+            _saved_stdout, sys.stdout = sys.stdout, io.StringIO()
+        _quiet_jobs += 1
+    try:
+        yield
+    finally:
+        with _quiet_lock:
+            _quiet_jobs -= 1
+            if _quiet_jobs == 0:
+                sys.stdout = _saved_stdout
+
 def _worker(job_id, task, folder=CURSOR_EXPT_FOLDER):
     try:
-        with contextlib.redirect_stdout(io.StringIO()):
+        with _quiet_stdout():
             result = panda.run_panda(task=task, force_report=True, outputs_dir=folder)
         _jobs[job_id] = {"status": "done", "result": result, "error": None}
     except Exception as e:
@@ -83,7 +105,7 @@ def start_research(task: str, folder:str=CURSOR_EXPT_FOLDER) -> dict:
 
 def _worker2(job_id, workspace_folder):
     try:
-        with contextlib.redirect_stdout(io.StringIO()):
+        with _quiet_stdout():
             result = panda.run_cursor_panda(workspace_folder=workspace_folder)
         _jobs[job_id] = {"status": "done", "result": result, "error": None}
     except Exception as e:
@@ -1,6 +1,28 @@
 
-from .panda_agent import run_panda, py, restart, test_panda, build_system_prompt
+# Lazy imports (see panda/__init__.py): panda_agent.py pulls in pandas, matplotlib and the LLM clients
+_LAZY_IMPORTS = {
+    "run_panda": ".panda_agent", "py": ".panda_agent", "restart": ".panda_agent", "test_panda": ".panda_agent", "build_system_prompt": ".panda_agent",
+    "cancel_run": ".panda_agent", "add_step_hook": ".panda_agent", "remove_step_hook": ".panda_agent",
+    "RunContext": ".run_context", "current_run": ".run_context",
 # from .superpanda import run_superpanda, restart_superpanda
 # from .iterpanda import run_iterpanda
 # from .cursor_panda import run_cursor_panda
-from .report_writer import write_report, save_dialog, get_dataframes
+    "write_report": ".report_writer", "save_dialog": ".report_writer", "get_dataframes": ".report_writer",
+}
+
+__all__ = list(_LAZY_IMPORTS)
+
+def __getattr__(name):
+    import importlib, importlib.util
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name in _LAZY_IMPORTS:
+        value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    if importlib.util.find_spec("." + name, __name__):		# a submodule, e.g., panda.panda_agent.my_globals
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,97 @@
+"""
+Dialog compaction: keep the agent's prompt a roughly constant size, however long the run.
+
+The agent sends its whole dialog (my_globals.dialog_so_far) on every step. Once that passed the model's budget,
+truncate_prompt() chopped words off the *start*, i.e., the system prompt and the task went first, while every call
+still re-sent up to the whole budget. Instead, once the prompt passes config.COMPACT_AFTER_WORDS, compact_dialog()
+replaces the older iterations with a summary:
+
+   [system prompt + task,  <summary of turns 1..n> + prompt n+1,  response n+1,  ...,  current prompt]
+
+ - The system prompt and task (dialog[0]) and the last config.COMPACT_KEEP_TURNS (prompt, response) turns are kept
+   verbatim. The current plan is in the last act/plan prompt (see format_task_hierarchy()), which is one of those turns.
+ - The summary is rolling: when the prompt grows past the limit again, the turns since the last summary are folded into
+   it with one LLM call, whose prompt is the compacted dialog itself (so it's cheap, and shares the cached prefix).
+   Between folds the compacted prefix doesn't change, so the provider's prompt cache and our LLM cache still hit.
+ - Only the prompt sent is compacted: dialog_so_far keeps everything (for the trace, the report, and replay).
+ - truncate_prompt() is still there as a backstop, e.g., if a single turn is enormous.
+
+The summary belongs to the run (my_globals.compaction), and is checked against the dialog's prefix hash before use,
+so a reset or replaced dialog just starts afresh.
+
+USAGE (in panda_step0()):
+response_json, response_str = call_llm_json(compact_dialog(my_globals.dialog_so_far, model), model=model)
+"""
+
+from . import my_globals
+from . import config as agent_config
+from .panda_agent_subprompts import COMPACTION_SUBPROMPT, COMPACTION_PREVIOUS_SUMMARY, COMPACTION_HEADER
+from panda.utils import call_llm, logger
+from panda.utils.dialog import Dialog, word_count
+from panda.utils.ledger import llm_caller
+from panda.utils.timing import timed
+
+class Compaction:
+    """The compaction of one dialog: turns [1, upto) are replaced by summary, i.e., head = [dialog[0], <summary> + dialog[upto]]"""
+
+    def __init__(self, dialog):
+        self.upto = 1
+        self.summary = None
+        self.head = None
+        self.prefix_hash = dialog.prefix_hash(1)
+        self.folds = 0
+        self.retry_from = 0			# after a failed fold, wait for a few more turns before trying again
+
+    # The dialog is still the one we summarized (same turns [0, upto))
+    def valid_for(self, dialog):
+        return len(dialog) > self.upto and dialog.prefix_hash(self.upto) == self.prefix_hash
+
+    def words(self, dialog):
+        if self.head is None:
+            return dialog.total_words()
+        return sum(word_count(turn) for turn in self.head) + sum(dialog.word_counts()[self.upto+1:])
+
+    # The dialog to send: dialog, with turns [1, upto) replaced by the summary
+    def apply(self, dialog):
+        if self.head is None:
+            return dialog
+        compacted = self.head + dialog[self.upto+1:]		# (reuses head's prefix hashes)
+        compacted.full_dialog = dialog				# for replay.py, which recognizes the agent's calls by their dialog
+        return compacted
+
+    # Fold turns [self.upto, upto) into the summary
+    def fold(self, dialog, upto, model):
+        previous_summary = COMPACTION_PREVIOUS_SUMMARY if self.summary else ""
+        instruction = COMPACTION_SUBPROMPT.format(max_words=agent_config.COMPACT_SUMMARY_WORDS, previous_summary=previous_summary)
+        prompt = self.apply(dialog[:upto]) + [instruction]
+        words_before = self.words(dialog)
+        try:
+            with llm_caller("compact"), timed("compact"):
+                summary = call_llm(prompt, model=model)
+        except Exception as e:
+            summary = None
+            logger.warning(f"Couldn't summarize the dialog ({e}), so sending it in full")
+        if not summary:
+            self.retry_from = upto + 2 * agent_config.COMPACT_KEEP_TURNS
+            return
+        header = COMPACTION_HEADER.format(iterations=(upto - 1) // 2, summary=summary.strip())
+        self.summary = summary
+        self.upto = upto
+        self.head = Dialog([dialog[0], header + dialog[upto]])
+        self.prefix_hash = dialog.prefix_hash(upto)
+        self.folds += 1
+        logger.info(f"Compacted the dialog: the first {(upto - 1) // 2} iterations are now a summary ({words_before} -> {self.words(dialog)} words)")
+
+# The dialog to send for the agent's next call (see module docstring), e.g., dialog_so_far ending with the new prompt
+def compact_dialog(dialog, model):
+    if not agent_config.COMPACT_DIALOG or not isinstance(dialog, Dialog):
+        return dialog
+    compaction = my_globals.compaction
+    if compaction is None or not compaction.valid_for(dialog):
+        compaction = my_globals.compaction = Compaction(dialog)
+    if compaction.words(dialog) > agent_config.COMPACT_AFTER_WORDS:
+        upto = len(dialog) - 2 * agent_config.COMPACT_KEEP_TURNS + 1	# the first prompt kept verbatim (prompts are at odd indices)
+        upto -= 1 - upto % 2
+        if upto > compaction.upto and upto >= compaction.retry_from:
+            compaction.fold(dialog, upto, model)
+    return compaction.apply(dialog)
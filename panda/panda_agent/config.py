@@ -2,7 +2,7 @@
 import os
 
 #PANDA_LLM = "claude-sonnet-4-5-20250929"
-PANDA_LLM = "claude-sonnet-4-6"
+PANDA_LLM = os.environ.get("PANDA_LLM", "claude-sonnet-4-6")	# e.g., PANDA_LLM=mock to run offline (see utils/mock_llm.py)
 REPORT_WRITER_LLM = PANDA_LLM
 REPORT_TRANSLATOR_LLM = PANDA_LLM	# convert HTML to text (not used now I think)
 
@@ -35,15 +35,44 @@ ADVICE_FILE = os.path.join(MODULE_DIR, "advice.txt")
 
 # ----------
 
-from importlib.metadata import version
-VERSION = version('panda')
+# VERSION is looked up on first use (see __getattr__ below), as importlib.metadata is slow-ish to scan at startup
+
+def __getattr__(name):
+    global VERSION
+    if name == "VERSION":
+        from importlib.metadata import version
+        VERSION = version('panda')
+        return VERSION
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ----------
 
 doc = {}		 # Place to put docstring for write_report.write_report()
+STREAM_LLM_OUTPUT = False	 # True: show the LLM's responses live (on stderr) as they are generated, rather than waiting for the whole response
 MAX_RETRIES = 2
 MAX_EARLIER_STEP_RETRIES = 2
 MAX_ITERATIONS = 200     # prevent runaway system!
+
+# Dialog compaction (see compaction.py): once the agent's prompt passes COMPACT_AFTER_WORDS, the iterations before the last
+# COMPACT_KEEP_TURNS are replaced with a rolling summary (of at most about COMPACT_SUMMARY_WORDS), rather than being chopped
+COMPACT_DIALOG = os.environ.get("PANDA_COMPACT", "1") != "0"		# PANDA_COMPACT=0 to always send the whole dialog
+COMPACT_AFTER_WORDS = 30000
+COMPACT_KEEP_TURNS = 4		# (prompt, response) turns kept verbatim, including the current prompt
+COMPACT_SUMMARY_WORDS = 1500
+
+# The most of each command's printed output kept in the observations: the first OUTPUT_HEAD_CHARS and the last
+# OUTPUT_TAIL_CHARS characters. Anything longer is spilled in full to experiment-out-<n>.txt (see output_capture.py)
+OUTPUT_HEAD_CHARS = 8000
+OUTPUT_TAIL_CHARS = 8000
+
+# Where the generated code runs (see exec_worker.py): "inprocess" (exec() in the agent's process), or "worker" (a forked
+# child process per run, with the per-command limits below, and restarted from the last checkpoint if it dies)
+EXEC_BACKEND = os.environ.get("PANDA_EXEC_BACKEND", "inprocess")
+EXEC_TIMEOUT = 3600		# wall clock seconds per command, then it's interrupted (worker only)
+EXEC_CPU_TIMEOUT = None		# CPU seconds per command, e.g., 600 (worker only)
+EXEC_MEMORY_LIMIT_MB = None	# the memory the code can use, on top of the agent's size when forked, e.g., 16000 (worker only)
+EXEC_INTERRUPT_GRACE = 10	# seconds for an interrupted command to stop, before the worker is killed and restarted
+EXEC_CHECKPOINT = True		# pickle the worker's variables after each action, to restore if it dies
 #EXEC_TIMEOUT = 3600	 # 60 min max for executing a function, otherwise give up. This better be long enough!
 #EXPERIMENT_TIMEOUT = 7200	 # 2 hr max for an experiment
 #EXPERIMENT_TIMEOUT = 10800	 # 3 hr max for an experiment
@@ -0,0 +1,523 @@
+"""
+Process-isolated execution of the generated code: config.EXEC_BACKEND = "worker" (env PANDA_EXEC_BACKEND=worker).
+
+By default ("inprocess") the agent's code runs with exec(command, namespace) in the agent's own process, so a command
+that hangs blocks the run forever (the func_timeout() wrapper is long gone), a segfault in a C extension kills the whole
+run, and heavy code competes with the agent (and with other runs) for the GIL. With the "worker" backend, each run's
+namespace lives in a long-lived child process instead, forked (Linux) from the agent when the first command runs, so it
+starts with everything the in-process namespace has (Panda's functions, the imports, the run's state). Over a pipe:
+ - each command is sent to the worker, its output streamed back as it's printed (into execute_action()'s capture),
+   and its result (or the exception's message and traceback) returned
+ - wall clock timeout (config.EXEC_TIMEOUT seconds): the command is interrupted (SIGINT -> KeyboardInterrupt in the
+   worker), and the run carries on with the worker's namespace as it was. If the worker doesn't respond to the interrupt
+   within EXEC_INTERRUPT_GRACE seconds, it's killed, and restarted as below
+ - CPU timeout (config.EXEC_CPU_TIMEOUT seconds per command, via RLIMIT_CPU): the command is interrupted likewise
+ - memory cap (config.EXEC_MEMORY_LIMIT_MB, via RLIMIT_AS): allocations beyond it raise MemoryError in the command.
+   The cap is on top of the worker's size when forked (the agent's address space, imports included), i.e., it's what
+   the code itself can use
+ - checkpoints: after each action, the worker pickles the variables the code created or changed into
+   experiment-checkpoint.pkl. If the worker dies (a segfault, the OOM killer, a kill after a timeout), a new worker is
+   forked and restores them, and the command's observation says what happened and what was restored. (Variables that
+   can't be pickled, e.g., functions defined by the code, open files, clients, aren't restored.)
+ - state.namespace is a WorkerNamespace, a dict-like proxy: reading a variable (e.g., report_writer.get_dataframes())
+   fetches a pickled copy from the worker. In the worker itself, it's the namespace.
+ - before each command, the run's state (the dialog, trace, code, ...) is synced to the worker (only what changed),
+   so write_report() and save_dialog() called from the code see the current run. The LLM calls the code makes are
+   added to the run's usage ledger and token counts when the command returns.
+ - the worker runs in the run's output directory, so the agent doesn't chdir (and lock) for its commands (see
+   command_dir()): concurrent runs' actions don't wait for each other, as they do in-process
+Where fork isn't available (Windows, macOS's default), Panda falls back to "inprocess" with a warning.
+The worker doesn't share the agent's connections: after a fork, the LLM cache's SQLite connection, the pooled HTTP
+sessions and clients, the calls in flight (single-flight) and the hedging executor are dropped in the child (each
+module registers an os.register_at_fork() hook), so the code's call_llm()s open their own.
+
+Caveats: forking a process with other threads running (e.g., concurrent runs) is only safe if none of them holds a lock
+the worker needs; the worker's timings (utils/timing.py) aren't added to the run's.
+
+USAGE:
+PANDA_EXEC_BACKEND=worker panda --task "..."
+exec_command("x = 1", state.namespace)		# exec(), in-process or in the worker (see execute_action())
+"""
+
+import os
+import sys
+import time
+import pickle
+import signal
+import atexit
+import weakref
+import threading
+import traceback
+import multiprocessing
+from contextlib import nullcontext
+from collections.abc import MutableMapping
+
+from . import config as agent_config
+from .run_context import current_run, in_run_dir
+from panda.utils import logger
+from panda.utils.dialog import Dialog
+from panda.utils.ledger import current_calls, add_calls
+from panda.utils.ask_llm import current_token_counts, merge_token_counts
+
+# The run state synced to the worker before each command (the dialog is synced separately, by its prefix hash)
+SYNCED_FIELDS = ["print_so_far", "code_so_far", "plotfiles_so_far", "py_counter", "start_time", "state", "report_pathstem",
+                 "output_dir", "model", "report_writer_model", "report_translator_model", "system_prompt", "allow_shortcuts"]
+OUTPUT_CHUNK = 4096			# the worker sends its output in chunks of about this many characters...
+OUTPUT_INTERVAL = 0.2			# ...or at the end of a line, if this many seconds have passed since the last send
+REQUEST_TIMEOUT = 120			# seconds to wait for anything other than a command (e.g., fetching a variable)
+
+_in_worker = False			# True in the worker process
+_workers = weakref.WeakSet()		# (to stop them at exit)
+_fallback_warned = False
+
+class CommandError(Exception):
+    """A command failed in the worker (or the worker died): str(e) is the message, child_traceback the worker's traceback"""
+    def __init__(self, message, child_traceback=""):
+        super().__init__(message)
+        self.child_traceback = child_traceback
+
+class WorkerDied(Exception):
+    pass
+
+class CpuTimeExceeded(BaseException):		# (a BaseException, like KeyboardInterrupt, so "except Exception:" in the code doesn't swallow it)
+    pass
+
+### ======================================================================
+###		THE NAMESPACE
+### ======================================================================
+
+def worker_available():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+# A new namespace for the configured backend: the dict itself ("inprocess"), or a WorkerNamespace over it ("worker")
+def new_namespace(namespace):
+    global _fallback_warned
+    if agent_config.EXEC_BACKEND != "worker" or _in_worker:
+        return namespace
+    if not worker_available():
+        if not _fallback_warned:
+            logger.warning("The 'worker' execution backend needs fork(), which isn't available here: running the code in-process")
+            _fallback_warned = True
+        return namespace
+    return WorkerNamespace(namespace)
+
+class WorkerNamespace(MutableMapping):
+    """The namespace in the worker process, as a dict-like proxy (values are pickled copies). In the worker, it's the namespace."""
+
+    def __init__(self, namespace):
+        self.worker = ExecWorker(namespace)
+        weakref.finalize(self, self.worker.close)
+
+    def __getitem__(self, name):
+        if _in_worker:
+            return self.worker.namespace[name]
+        kind, value = self.worker.request("get", name)
+        if kind == "missing":
+            raise KeyError(name)
+        return pickle.loads(value) if kind == "value" else value		# (the repr of a value that can't be pickled)
+
+    def __setitem__(self, name, value):
+        if _in_worker:
+            self.worker.namespace[name] = value
+        else:
+            self.worker.request("set", name, pickle.dumps(value))
+
+    def __delitem__(self, name):
+        if _in_worker:
+            del self.worker.namespace[name]
+        elif not self.worker.request("del", name):
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in self.worker.namespace if _in_worker else self.worker.request("has", name)
+
+    def __iter__(self):
+        return iter(list(self.worker.namespace) if _in_worker else self.worker.request("keys"))
+
+    def __len__(self):
+        return len(self.worker.namespace) if _in_worker else len(self.worker.request("keys"))
+
+    def __repr__(self):
+        return f"<WorkerNamespace ({self.worker.describe()})>"
+
+# exec(command, namespace), in-process or in the worker. A failure in the worker raises CommandError.
+def exec_command(command, namespace):
+    if isinstance(namespace, WorkerNamespace) and not _in_worker:
+        namespace.worker.execute(command)
+    else:
+        exec(command, namespace)
+
+# The working directory for namespace's commands: the worker is already in the run's output directory (see serve()), so
+# only in-process code needs in_run_dir(), whose process-wide chdir makes other runs' actions wait
+def command_dir(namespace):
+    if isinstance(namespace, WorkerNamespace) and not _in_worker:
+        return nullcontext()
+    return in_run_dir()
+
+# After each action: save the worker's variables, to restore if it dies
+def checkpoint_namespace(namespace):
+    if isinstance(namespace, WorkerNamespace) and not _in_worker and agent_config.EXEC_CHECKPOINT:
+        namespace.worker.checkpoint()
+
+### ======================================================================
+###		THE WORKER (agent side)
+### ======================================================================
+
+class ExecWorker:
+    def __init__(self, namespace):
+        self.namespace = namespace		# the namespace the worker is forked with (in the worker: the live namespace)
+        self.process = None
+        self.conn = None
+        self.next_id = 0
+        self.lock = threading.RLock()		# one request at a time
+        self.checkpoint_path = None
+        self.checkpointed = []			# the variables in the last checkpoint
+        self.sent = {}				# the run state the worker has (see state_changes())
+        self.sent_dialog = (0, None)		# (length, prefix hash) of the dialog the worker has
+        self.restarts = 0
+
+    def describe(self):
+        pid = self.process.pid if self.process else None
+        return f"pid {pid}, {self.restarts} restarts" if pid else "not started"
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def start(self):
+        run = current_run()
+        ctx = multiprocessing.get_context("fork")
+        parent_conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=serve, args=(child_conn, self.namespace, run.output_dir), daemon=True, name="panda-exec-worker")
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.sent = {name: snapshot(getattr(run, name)) for name in SYNCED_FIELDS}	# (it has the run state as of now)
+        self.sent_dialog = dialog_mark(run.dialog_so_far)
+        self.checkpoint_path = (run.report_pathstem + "-checkpoint.pkl") if run.report_pathstem else None
+        _workers.add(self)
+        logger.debug("DEBUG: Started the execution worker (pid %s)", self.process.pid)
+
+    def close(self):
+        with self.lock:
+            if self.alive():
+                try:
+                    self.conn.send((None, "close", ()))
+                    self.process.join(2)
+                except (OSError, ValueError):
+                    pass
+            if self.alive():
+                self.process.kill()
+            self.process = None
+
+    # ---------- requests ----------
+
+    # Send a request and wait for its reply, writing any output it streams to sys.stdout (execute_action()'s capture).
+    # timeout: interrupt the request (SIGINT) after this many seconds. Raises WorkerDied if the worker dies.
+    def request(self, op, *args, timeout=REQUEST_TIMEOUT, interrupt=False):
+        with self.lock:
+            if not self.alive():
+                self.start()
+            self.next_id += 1
+            request_id = self.next_id
+            try:
+                self.conn.send((request_id, op, args))
+            except (OSError, ValueError) as e:
+                raise WorkerDied(f"The Python worker couldn't be reached ({e}).")
+            deadline = time.monotonic() + timeout if timeout else None
+            interrupted = False
+            while True:
+                wait = 1.0 if deadline is None else max(0.0, min(1.0, deadline - time.monotonic()))
+                if self.conn.poll(wait):
+                    try:
+                        kind, reply_id, payload = self.conn.recv()
+                    except (EOFError, OSError):
+                        raise WorkerDied(self.death_message())
+                    if reply_id != request_id:		# (e.g., the reply to a request we gave up on)
+                        continue
+                    if kind == "out":
+                        sys.stdout.write(payload)
+                        continue
+                    return (payload, interrupted) if interrupt else payload
+                if not self.process.is_alive():
+                    raise WorkerDied(self.death_message())
+                if deadline is not None and time.monotonic() >= deadline:
+                    if interrupt and not interrupted:
+                        os.kill(self.process.pid, signal.SIGINT)
+                        interrupted = True
+                        deadline = time.monotonic() + agent_config.EXEC_INTERRUPT_GRACE
+                    else:
+                        self.process.kill()
+                        self.process.join(5)
+                        raise WorkerDied(f"The command was still running after {timeout} seconds and didn't respond to an interrupt, so its Python worker was stopped." if interrupted
+                                         else f"The Python worker didn't respond within {timeout} seconds, so it was stopped.")
+
+    def death_message(self):
+        self.process.join(5)
+        code = self.process.exitcode
+        if code is not None and code < 0:
+            try:
+                how = f"killed by {signal.Signals(-code).name}"
+            except ValueError:
+                how = f"killed by signal {-code}"
+            if -code == signal.SIGKILL:
+                how += ", e.g., by the out-of-memory killer"
+        else:
+            how = f"exit code {code}"
+        return f"The Python worker running the code died ({how})."
+
+    # ---------- commands ----------
+
+    def execute(self, command):
+        with self.lock:
+            if self.process is not None and not self.process.is_alive():	# died between commands
+                self.restart()
+            try:
+                (reply, interrupted) = self.request("exec", command, self.state_changes(), agent_config.EXEC_CPU_TIMEOUT,
+                                                    timeout=agent_config.EXEC_TIMEOUT, interrupt=True)
+            except WorkerDied as e:
+                raise CommandError(f"{e} {self.restart()}")
+            if reply is None:				# (interrupted outside the command itself)
+                raise CommandError("The command was interrupted")
+            add_calls(reply['calls'])			# the LLM calls the code made, for the run's ledger and token counts
+            merge_token_counts(reply['token_counts'])
+            if not reply['ok']:
+                message = reply['error']
+                if interrupted and reply['type'] == "KeyboardInterrupt":
+                    message = f"Timeout: the command was still running after {agent_config.EXEC_TIMEOUT} seconds, so it was interrupted"
+                elif reply['type'] == "CpuTimeExceeded":
+                    message = f"Timeout: the command used more than {agent_config.EXEC_CPU_TIMEOUT} seconds of CPU time, so it was interrupted"
+                raise CommandError(message, reply['traceback'])
+
+    # A new worker, with the last checkpoint's variables. Returns a note for the observations.
+    def restart(self):
+        self.close()
+        self.restarts += 1
+        self.start()
+        if not (self.checkpointed and self.checkpoint_path and os.path.exists(self.checkpoint_path)):
+            return "It has been restarted, with a fresh namespace (nothing had been checkpointed), so any variables created earlier are gone."
+        try:
+            restored, failed = self.request("restore", self.checkpoint_path)
+        except WorkerDied as e:
+            return f"It was restarted, but restoring the checkpoint failed too ({e}): the namespace is fresh, so any variables created earlier are gone."
+        note = f"It has been restarted, and the variables as of the end of the previous action have been restored: {', '.join(restored) or 'none'}."
+        if failed:
+            note += f" (Not restored: {', '.join(failed)}.)"
+        return note + " Anything created or changed since then is gone."
+
+    def checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        with self.lock:
+            if not self.alive():
+                return
+            try:
+                saved, skipped = self.request("checkpoint", self.checkpoint_path)
+            except WorkerDied:
+                return					# (dealt with by the next command)
+            self.checkpointed = saved
+            if skipped:
+                logger.debug("DEBUG: Not checkpointed (can't be pickled): %s", skipped)
+
+    # ---------- syncing the run state ----------
+
+    # What changed in the run state since the worker last saw it: {field: ("set", value) or ("append", text) or ("extend", turns)}
+    def state_changes(self):
+        run = current_run()
+        changes = {}
+        for name in SYNCED_FIELDS:
+            value, sent = getattr(run, name), self.sent.get(name)
+            if value is sent or (not isinstance(value, (str, dict)) and value == sent):
+                continue
+            if isinstance(value, str) and isinstance(sent, str) and value.startswith(sent):
+                changes[name] = ("append", value[len(sent):])
+            elif name == "state":
+                changes[name] = ("state", value and {key: value[key] for key in value if key != "state"})	# (the worker has its own State)
+            else:
+                changes[name] = ("set", value)
+            self.sent[name] = snapshot(value)
+        dialog = run.dialog_so_far
+        n, prefix_hash = self.sent_dialog
+        if isinstance(dialog, Dialog) and 0 < n <= len(dialog) and dialog.prefix_hash(n) == prefix_hash:
+            if len(dialog) > n:
+                changes['dialog_so_far'] = ("extend", list(dialog[n:]))
+        else:
+            changes['dialog_so_far'] = ("set", list(dialog))
+        self.sent_dialog = dialog_mark(dialog)
+        return changes
+
+def snapshot(value):
+    return list(value) if isinstance(value, list) else value
+
+def dialog_mark(dialog):
+    return (len(dialog), dialog.prefix_hash()) if isinstance(dialog, Dialog) else (0, None)
+
+@atexit.register
+def stop_workers():
+    for worker in list(_workers):
+        worker.close()
+
+### ======================================================================
+###		THE WORKER (worker side)
+### ======================================================================
+
+class PipeWriter:
+    """sys.stdout/stderr in the worker: sends the output of the current request to the agent, in chunks"""
+    def __init__(self, conn):
+        self.conn = conn
+        self.request_id = None
+        self.buffer = []
+        self.size = 0
+        self.last_send = time.monotonic()
+
+    def write(self, data):
+        if data and self.request_id is not None:
+            self.buffer.append(data)
+            self.size += len(data)
+            if self.size >= OUTPUT_CHUNK or (data.endswith("\n") and time.monotonic() - self.last_send >= OUTPUT_INTERVAL):
+                self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.conn.send(("out", self.request_id, "".join(self.buffer)))
+            self.buffer, self.size = [], 0
+            self.last_send = time.monotonic()
+
+    def isatty(self):
+        return False
+
+def raise_cpu_time_exceeded(signum, frame):
+    raise CpuTimeExceeded("CPU time limit exceeded")
+
+# The worker's main loop (in the forked process)
+def serve(conn, namespace, output_dir):
+    global _in_worker
+    _in_worker = True
+    import resource
+    if output_dir:
+        os.chdir(output_dir)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGXCPU, raise_cpu_time_exceeded)
+    if agent_config.EXEC_MEMORY_LIMIT_MB:		# on top of what the worker inherited from the agent (pandas, litellm, ...)
+        limit = address_space_size() + agent_config.EXEC_MEMORY_LIMIT_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+    writer = PipeWriter(conn)
+    sys.stdout = sys.stderr = writer
+    forked = {name: id(value) for name, value in namespace.items()}	# what the code didn't create (for checkpoints)
+    handlers = {"exec": do_exec, "get": do_get, "set": do_set, "del": do_del, "has": lambda ns, name: name in ns,
+                "keys": lambda ns: list(ns), "checkpoint": lambda ns, path: do_checkpoint(ns, path, forked), "restore": do_restore}
+    while True:
+        try:
+            request_id, op, args = conn.recv()
+        except KeyboardInterrupt:			# (e.g., a Ctrl-C while idle)
+            continue
+        except (EOFError, OSError):
+            break
+        if op == "close":
+            break
+        writer.request_id = request_id
+        try:
+            reply = handlers[op](namespace, *args)
+        except KeyboardInterrupt:			# (an interrupt that arrived just after the command finished)
+            reply = None
+        writer.flush()
+        writer.request_id = None
+        conn.send(("done", request_id, reply))
+    conn.close()
+
+# The process's virtual memory size in bytes (what RLIMIT_AS limits), or 0 if we can't tell (no /proc)
+def address_space_size():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def do_exec(namespace, command, changes, cpu_seconds):
+    import resource
+    apply_changes(changes)
+    n_calls = len(current_calls())
+    token_counts = {model: dict(entry) for model, entry in current_token_counts().items()}
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    try:
+        if cpu_seconds:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            limit = int(usage.ru_utime + usage.ru_stime + cpu_seconds) + 1
+            resource.setrlimit(resource.RLIMIT_CPU, (limit if hard == resource.RLIM_INFINITY else min(limit, hard), hard))
+        exec(command, namespace)
+        reply = {'ok': True}
+    except BaseException as e:			# (including SystemExit, KeyboardInterrupt and CpuTimeExceeded)
+        lines = traceback.format_exception(type(e), e, e.__traceback__.tb_next)	# (without this function's frame)
+        reply = {'ok': False, 'error': str(e) or type(e).__name__, 'type': type(e).__name__, 'traceback': "".join(lines)}
+    finally:
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    reply['calls'] = [dict(row) for row in current_calls()[n_calls:]]
+    reply['token_counts'] = token_count_changes(token_counts, current_token_counts())
+    return reply
+
+def apply_changes(changes):
+    run = current_run()
+    for name, (how, value) in changes.items():
+        if how == "append":
+            setattr(run, name, getattr(run, name) + value)
+        elif how == "extend":
+            run.dialog_so_far.extend(value)
+        elif how == "state":				# the controller's planinfo/planstack, with the worker's own State
+            own_state = run.state['state'] if run.state else None
+            run.state = value and {**value, 'state': own_state}
+        elif name == "dialog_so_far":
+            run.dialog_so_far = Dialog(value)
+        else:
+            setattr(run, name, value)
+
+def token_count_changes(before, after):
+    changes = []
+    for model, entry in after.items():
+        old = before.get(model, {})
+        change = {key: entry[key] - old.get(key, 0) for key in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'cached_tokens')}
+        if any(change.values()):
+            changes.append({'model': model, **change})
+    return changes
+
+def do_get(namespace, name):
+    if name not in namespace:
+        return ("missing", None)
+    value = namespace[name]
+    try:
+        return ("value", pickle.dumps(value))
+    except Exception:
+        return ("repr", repr(value)[:2000])
+
+def do_set(namespace, name, value):
+    namespace[name] = pickle.loads(value)
+
+def do_del(namespace, name):
+    return namespace.pop(name, KeyError) is not KeyError
+
+# Pickle the variables the code created or changed (by assignment) to path. Returns (saved, skipped) names.
+def do_checkpoint(namespace, path, forked):
+    saved, skipped = {}, []
+    for name, value in list(namespace.items()):
+        if name.startswith("__") or forked.get(name) == id(value) or type(value).__name__ == "module":
+            continue
+        try:
+            saved[name] = pickle.dumps(value)
+        except Exception:
+            skipped.append(name)
+    with open(path + ".tmp", "wb") as file:
+        pickle.dump(saved, file)
+    os.replace(path + ".tmp", path)
+    return list(saved), skipped
+
+def do_restore(namespace, path):
+    with open(path, "rb") as file:
+        saved = pickle.load(file)
+    restored, failed = [], []
+    for name, value in saved.items():
+        try:
+            namespace[name] = pickle.loads(value)
+            restored.append(name)
+        except Exception:
+            failed.append(name)
+    return restored, failed
@@ -1,17 +1,29 @@
 
-# import time
+# The run state, e.g., my_globals.dialog_so_far, is now kept per run (see run_context.py): reading or setting
+# my_globals.<name> reads or sets the current run's <name>, so concurrent runs (in different threads) each see their own.
+#   dialog_so_far = Dialog()	# a list of strings, that also caches word counts and hashes (see utils/dialog.py)
+#   print_so_far = ""
+#   code_so_far = ""
+#   plotfiles_so_far = []
+#   py_counter = 1
+#   start_time = 0
+#   state, report_pathstem, ... (see RunContext)
 
-#def reset_counters ():
-#    global py_counter, start_time
-#    py_counter = 1
-#    start_time = time.time()
+import sys
+import types
 
-# Strictly don't need to initialize, but may as well for clarity so we know it's an expected my_globals var
-dialog_so_far = []
-print_so_far = ""
-code_so_far = ""
-plotfiles_so_far = []
-py_counter = 1
-start_time = 0
+from .run_context import current_run
 
+class RunGlobals(types.ModuleType):
+    def __getattr__(self, name):			# (only called for names that aren't module attributes)
+        if name.startswith("__"):
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+        return getattr(current_run(), name)
 
+    def __setattr__(self, name, value):
+        if name.startswith("__"):
+            super().__setattr__(name, value)
+        else:
+            setattr(current_run(), name, value)
+
+sys.modules[__name__].__class__ = RunGlobals
@@ -0,0 +1,111 @@
+"""
+Bounded capture of what the generated code prints, for the agent's observations.
+
+execute_action() used to capture each command's stdout/stderr in an io.StringIO and put all of it in the observations,
+and so in dialog_so_far, which is re-sent on every later call: one print(df) in a loop could add megabytes. Now each
+command's output goes to an OutputCapture, which keeps at most:
+ - the first config.OUTPUT_HEAD_CHARS characters (the head), and
+ - the last config.OUTPUT_TAIL_CHARS characters (the tail, a ring buffer of the chunks written)
+If the output is longer, the full output is spilled to a file, experiment-out-<n>.txt (n = the command's In [n] number)
+next to the trace, and the observation is the head, a marker saying how much was left out and where it is, and the tail.
+So the memory used and the size of the observation are bounded, whatever the code prints.
+
+The budgets are in characters (i.e., bytes, for ASCII output).
+
+USAGE:
+capture = OutputCapture(spill_path="/home/me/experiments/experiment-20260210-143138/experiment-out-7.txt")
+capture.write(text) ...
+capture.close()
+capture.getvalue()    -> 'line 1\\n...\\n[... 2,391,006 characters (48,820 lines) left out: the full output is in experiment-out-7.txt ...]\\n...\\nline 50000\\n'
+"""
+
+import os
+from collections import deque
+
+from . import config as agent_config
+from panda.utils import logger
+
+ELISION_MARKER = "\n[... {chars:,} characters ({lines:,} lines) left out: the full output is in {filename} ...]\n"
+ELISION_MARKER_NO_FILE = "\n[... {chars:,} characters ({lines:,} lines) left out ...]\n"
+
+class OutputCapture:
+    def __init__(self, spill_path=None, head_chars=None, tail_chars=None):
+        self.spill_path = spill_path
+        self.head_chars = agent_config.OUTPUT_HEAD_CHARS if head_chars is None else head_chars
+        self.tail_chars = agent_config.OUTPUT_TAIL_CHARS if tail_chars is None else tail_chars
+        self.head = []
+        self.head_size = 0
+        self.tail = deque()			# the chunks written after the head, trimmed from the left to tail_chars
+        self.tail_size = 0
+        self.total = 0				# characters written
+        self.lines = 0				# newlines written
+        self.spill = None			# the spill file, once the output doesn't fit
+        self.spill_failed = False
+
+    def write(self, data):
+        if not data:
+            return 0
+        self.total += len(data)
+        self.lines += data.count("\n")
+        if self.spill:
+            self.spill.write(data)
+        rest = data
+        if self.head_size < self.head_chars:
+            rest = data[self.head_chars - self.head_size:]
+            chunk = data[:self.head_chars - self.head_size]
+            self.head.append(chunk)
+            self.head_size += len(chunk)
+        if rest:
+            self.tail.append(rest)
+            self.tail_size += len(rest)
+            if self.tail_size > self.tail_chars:
+                if not self.spill and not self.spill_failed:
+                    self.start_spill()
+                self.trim_tail()
+        return len(data)
+
+    # The output is about to outgrow the buffers: until now head + tail hold all of it, so that's the start of the file
+    def start_spill(self):
+        if not self.spill_path:
+            self.spill_failed = True
+            return
+        try:
+            self.spill = open(self.spill_path, "w", encoding="utf-8", errors="replace")
+            self.spill.write("".join(self.head) + "".join(self.tail))
+        except OSError as e:
+            logger.warning(f"Couldn't write the output to {self.spill_path}: {e}")
+            self.spill, self.spill_failed = None, True
+
+    def trim_tail(self):
+        while self.tail_size - len(self.tail[0]) >= self.tail_chars:
+            self.tail_size -= len(self.tail.popleft())
+        excess = self.tail_size - self.tail_chars
+        if excess > 0:
+            self.tail[0] = self.tail[0][excess:]
+            self.tail_size -= excess
+
+    def flush(self):				# (called after every write: the spill file is buffered, and flushed by close())
+        pass
+
+    def close(self):
+        if self.spill:
+            self.spill.close()
+
+    @property
+    def truncated(self):
+        return self.total > self.head_size + self.tail_size
+
+    # The head, the elision marker, and the tail (with the cuts moved to line boundaries, if there are any nearby)
+    def getvalue(self):
+        head, tail = "".join(self.head), "".join(self.tail)
+        if not self.truncated:
+            return head + tail
+        if "\n" in head[len(head)//2:]:
+            head = head[:head.rindex("\n") + 1]
+        if "\n" in tail[:len(tail)//2]:
+            tail = tail[tail.index("\n") + 1:]
+        left_out = self.total - len(head) - len(tail)
+        lines = self.lines - head.count("\n") - tail.count("\n")
+        if self.spill_path and not self.spill_failed:
+            return head + ELISION_MARKER.format(chars=left_out, lines=lines, filename=os.path.basename(self.spill_path)) + tail
+        return head + ELISION_MARKER_NO_FILE.format(chars=left_out, lines=lines) + tail
@@ -32,6 +32,7 @@ NEW: run_panda() creates a subdairectory "output/experiment-<timestamp>/" and pu
    experiment-artifacts.py	# artifacts (vars and dataframes)
    experiment-trace.txt		# short trace (what user sees)
    experiment-trace-long.txt	# full dialog with GPT
+   experiment-llm-calls.jsonl	# one line per LLM call: caller (mode), model, tokens, seconds, attempts, cache hit, cost
 Occasionally Panda will output additional files (.csv, plots) to this directory also during code execution.   
 The stem "experiment" is currently hardwired.
 """
@@ -44,6 +45,7 @@ import logging
 import os
 import traceback
 import requests
+from collections import namedtuple
 from func_timeout import func_timeout, FunctionTimedOut
 from string import Template		# for build_system_prompt()
 
@@ -82,7 +84,17 @@ from .report_writer import write_report, REPORT_DIR
 
 ### Additional functions used by the Panda agent implementation itself (but not required to do research)
 from panda.utils import call_llm, call_llm_json, parse_code, multiline_input, similar_strings, reset_token_counts
+from panda.utils.ask_llm import print_token
+from panda.utils.dialog import Dialog
+from panda.utils.ledger import llm_caller, save_calls, summarize_calls
 from .report_writer import save_dialog
+from panda.utils.transport import prewarm_for_model
+from .replay import Replay, ReplayExhausted, start_replay, stop_replay
+from panda.utils.timing import timed
+from .compaction import compact_dialog
+from .output_capture import OutputCapture
+from .exec_worker import new_namespace, exec_command, checkpoint_namespace, command_dir
+from .run_context import RunContext, current_run, start_run, finish_run, get_active_runs
 
 #from panda.researchworld.lit_search import *	# lit tasks - not yet included
 #from panda.researchworld.lit_ideation import *
@@ -103,7 +115,8 @@ dangerous_patterns = [
 ]
 
 # Cosmetic preferences:
-sys.stdout.reconfigure(encoding='utf-8')                # occasionally GPT can return a non-standard character, which raises an exception when I attempt to print it (stdout) 
+if hasattr(sys.stdout, 'reconfigure'):                  # (not when imported under a redirect_stdout(), e.g., by the MCP server's workers)
+    sys.stdout.reconfigure(encoding='utf-8')             # occasionally GPT can return a non-standard character, which raises an exception when I attempt to print it (stdout) 
 pd.set_option('display.float_format', '{:.6f}'.format)  # avoid printing in exponent format
 pd.set_option('display.width', 200)
 
@@ -112,16 +125,9 @@ pd.set_option('display.max_rows', 10)
 pd.set_option('display.max_columns', 10)
 pd.set_option('display.max_colwidth', 500)
 
-# Globals - also see others in my_globals.py that are shared across multiple files
-retry_counter = 0
-retry_earlier_step_counter = 0
+# Globals. The run state (the retry counters, the system prompt, interactive, ...) is kept per run, as my_globals.<name>
+# (see my_globals.py and run_context.py), so several runs can go on at once in one process
 plot_counter = 0
-interactive = False
-nora_thread_id = None		# for use with the NORA UI
-nora_system_output = ""         # for use with the NORA UI
-
-SYSTEM_PROMPT = None		# built at runtime with build_system_prompt()
-ADVICE = None
 #USE_ADVICE = True
 USE_ADVICE = False
 
@@ -171,9 +177,14 @@ If a report wasn't generated, and you want one, call write_report() which return
 
 NOTE: outputs_dir = "experiments", relative to the current working directory
 
+replay_from = an experiment-trace-long.txt: re-run that experiment with the agent's LLM responses served from the trace (the code is
+re-executed), reporting the first point of divergence in result['replay']. The task defaults to the trace's. Other LLM calls are
+answered from the cache or the offline mock, unless replay_live=True. See replay.py.
+
 """
 def run_panda(task=None, background_knowledge=None, plan=None, force_report=False, thread_id=None, reset_namespace=True, allow_shortcuts=False, model=agent_config.PANDA_LLM, reset_dialog=True, \
-              outputs_dir="experiments", experiment_subdir=None, task_file=None, background_knowledge_file=None, result_file=None):
+              outputs_dir="experiments", experiment_subdir=None, task_file=None, background_knowledge_file=None, result_file=None, \
+              replay_from=None, replay_live=False, step_hooks=None):
 
     # Let's switch to a new directory for a new run:
     if experiment_subdir is None:
@@ -183,23 +194,35 @@ def run_panda(task=None, background_knowledge=None, plan=None, force_report=Fals
     # if files provided, read info from them        
     task = get_item_from_var_or_file(item=task, item_file=task_file, type="task")
     background_knowledge = get_item_from_var_or_file(item=background_knowledge, item_file=background_knowledge_file, type="background knowledge")
+    replay = Replay(replay_from, live=replay_live) if replay_from else None
+    if replay and not task:
+        task, background_knowledge = replay.task, background_knowledge or replay.background_knowledge
     if not task:
         print_to_user("No task or task_file specified: Starting Panda in interactive mode...")
 #        logger.error(message)
 #        raise ValueError(message)            
 
-    current_working_directory = os.getcwd()    				  # make a note, to return to it afterwards
-    output_dir = os.path.join(outputs_dir, experiment_subdir)
+    output_dir = os.path.abspath(os.path.join(outputs_dir, experiment_subdir))
     os.makedirs(output_dir, exist_ok=True)
-    os.chdir(output_dir)
 
-    report_pathstem = os.path.abspath("experiment").replace("\\", "/")    # Use "/" for standardized (POSIX) path format
-    my_globals.report_pathstem = report_pathstem			  # store this in a global for use by report_writer.py
+    # A new run (see run_context.py), carrying on from this thread's last run's dialog and/or Python state if asked.
+    # The generated code runs in output_dir (see in_run_dir()), but we no longer chdir for the whole run.
+    run = RunContext(model=model, output_dir=output_dir, thread_id=thread_id)
+    run.step_hooks = list(step_hooks or [])		# this run's own (see add_step_hook())
+    run.continue_from(current_run(), dialog=not reset_dialog, state=not reset_namespace)
+    start_run(run)
+    if replay:
+        start_replay(replay)			# (answers this run's LLM calls only)
+    report_pathstem = run.report_pathstem			  # Use "/" for standardized (POSIX) path format
 
     # Redirect stderr to a log file...
-    global interactive, nora_thread_id, nora_system_output
     print_to_user(agent_config.VERSION, " (running using ", model, ")", sep="")
-    agent_config.PANDA_LLM = model
+    if model == "mock" or model.startswith("mock:"):		# an offline run (see utils/mock_llm.py): the report writer mustn't call a real LLM either
+        run.report_writer_model = run.report_translator_model = model
+    if replay:
+        print_to_user(f"Replaying {replay.turns_recorded} agent turns ({replay.model}) from {replay.path}")
+    if not (replay and not replay_live):
+        prewarm_for_model(model)		# open the LLM connection in the background while we set up
 
 #    workspacefolder = os.getenv("WORKSPACEFOLDER")
 #    print_to_user("Workspace folder:", workspacefolder)
@@ -210,14 +233,12 @@ def run_panda(task=None, background_knowledge=None, plan=None, force_report=Fals
         state = my_globals.state['state']    	# continue from last time
         state.iteration = 0			# BUT: Still must reset iteration counter!
 
-    if reset_dialog or not SYSTEM_PROMPT:
+    if reset_dialog or not my_globals.system_prompt:
         reset_the_dialog(task=task, background_knowledge=background_knowledge, allow_shortcuts=allow_shortcuts)
 
     reset_panda_session()		# always do this - reset all counters        
-    nora_thread_id = thread_id		# for use with the NORA UI
-    nora_system_output = ""		# for use with the NORA UI
     summary = ""
-    interactive = False if task else True
+    my_globals.interactive = False if task else True
 
     try:
         if plan:	# e.g., ["eat","drink"].   Can optionally specify task too
@@ -265,10 +286,10 @@ def run_panda(task=None, background_knowledge=None, plan=None, force_report=Fals
         print_to_user(message)
         my_globals.dialog_so_far[-1] += message            
     
-        if not interactive:        
+        if not my_globals.interactive:        
             save_dialog()
 
-    except Exception as e:
+    except (Exception, ReplayExhausted) as e:		# ReplayExhausted is a BaseException (see replay.py)
         tb = traceback.format_exc()                                     
         message = f"Yikes! Top-level run_panda() failed!! Error: {e}\nTraceback:\n{tb}\n"
         print_to_user(message)
@@ -280,15 +301,27 @@ def run_panda(task=None, background_knowledge=None, plan=None, force_report=Fals
                 file.write(message)
         summary = message
         result_flag = "abort_python_error"
-
-    token_counts = get_token_counts()		# in utils/ask-llm.py  eg [{"model":"gpt-4.1","prompt_tokens":100,"completion_tokens":310,"total_tokens":410}]
+    finally:
+        if replay:
+            stop_replay()
+        finish_run(run)
+    if replay and replay.exhausted:		# (even if the exception was caught on its way up)
+        result_flag = "abort_replay_exhausted"
+
+    token_counts = get_token_counts()		# in utils/ask-llm.py  eg [{"model":"gpt-4.1","prompt_tokens":100,"completion_tokens":310,"total_tokens":410,"cached_tokens":0}]
+    save_calls(report_pathstem + "-llm-calls.jsonl")	# one row per LLM call: caller (mode), latency, attempts, cache hit, cost (see utils/ledger.py)
+    llm_usage = summarize_calls()
     with open(report_pathstem + "-done.txt", "w", encoding="utf-8") as file:
         file.write(result_flag+"\n")
-    
-    os.chdir(current_working_directory)		# make sure you're back where you were
 
     # Note we should *always* return report_pathstem, even if there's no report, so we can at least see the artifacts, traces, etc.
-    result = {"result_flag":result_flag, "report_pathstem":report_pathstem, "summary":summary, "token_counts":token_counts}    
+    result = {"result_flag":result_flag, "report_pathstem":report_pathstem, "summary":summary, "token_counts":token_counts, "llm_usage":llm_usage}    
+    if replay:
+        result["replay"] = replay.report()
+        divergence = result["replay"]["first_divergence"]
+        print_to_user(f"Replay: {replay.turns_replayed} of {replay.turns_recorded} recorded turns replayed. " +
+                      (f"First divergence at turn {divergence['turn']} ({divergence['mode']}):\n  expected: ...{divergence['expected']}...\n  actual:   ...{divergence['actual']}..."
+                       if divergence else "No divergence."))
     logger.debug(f"DEBUG: run_panda(): result = {result}")
     if result_file is not None:
         with open(result_file, "w", encoding="utf-8") as f:
@@ -315,25 +348,26 @@ def get_item_from_var_or_file(item=None, item_file=None, type="file"):
 # Summarize the research trajectory (used only for NORA UI).
 # (Note the outcome could be an abort).
 # I need to add the prompt as a NEW element (+[prompt]) otherwise it potentially gets concatenated (and hence confused with) to the earlier instructions.
+@llm_caller("summary")
 def get_summary(result_flag):
     if result_flag == "done":
         prompt = "Generate one or two sentences that briefly summarize the conclusions of this research."
     else:
         prompt = f"The research failed due to an error ({result_flag}). Generate one or two sentences summarizing the research so far, and the reason for the failure."
         
-    summary = call_llm(my_globals.dialog_so_far + [prompt], model=agent_config.PANDA_LLM)
+    prompts = compact_dialog(my_globals.dialog_so_far + [prompt], my_globals.panda_llm)	# a Dialog + list is a Dialog, reusing its cached hashes
+    summary = call_llm(prompts, model=my_globals.panda_llm)
     logger.debug("DEBUG: Final summary: %s", summary)
     return summary
 
 # ----------
 
 def reset_the_dialog(task=None, background_knowledge=None, allow_shortcuts=False):
-    global SYSTEM_PROMPT, ADVICE    
-    SYSTEM_PROMPT = build_system_prompt(allow_shortcuts=allow_shortcuts)
+    system_prompt = build_system_prompt(allow_shortcuts=allow_shortcuts)
     if task:
-            my_globals.dialog_so_far = [SYSTEM_PROMPT + task_intro(task,background_knowledge)]
+            my_globals.dialog_so_far = Dialog([system_prompt + task_intro(task,background_knowledge)])
     else:
-        my_globals.dialog_so_far = [SYSTEM_PROMPT]
+        my_globals.dialog_so_far = Dialog([system_prompt])
 
 def reset_the_namespace():
     namespace = initialize_namespace()
@@ -359,7 +393,6 @@ def reset_panda_state(task=None, background_knowledge=None, allow_shortcuts=Fals
 """
 
 def reset_panda_session():
-    global ADVICE
     my_globals.print_so_far = ""            # What the user sees, used for the NORA UI and also save_dialog() for saving the short version
     my_globals.code_so_far = ""
     my_globals.plotfiles_so_far = []	    # Note we *don't* reset plot_counter to avoid collisions between different experiments (for now...later should move them)
@@ -368,26 +401,21 @@ def reset_panda_session():
     my_globals.py_counter = 1    
     my_globals.start_time = time.time()    
     reset_token_counts()
-    global retry_counter, retry_earlier_step_counter
-    retry_counter = 0
-    retry_earlier_step_counter = 0
+    my_globals.retry_counter = 0
+    my_globals.retry_earlier_step_counter = 0
     if USE_ADVICE:        
         logger.debug("DEBUG: Reading advice file...")        
-        ADVICE = read_advice_file(agent_config.ADVICE_FILE)
+        my_globals.advice = read_advice_file(agent_config.ADVICE_FILE)
 
 # ----------
 
 # Build system prompt dynamically, to accomodate changing researchworld function documenntation and example workflows
 def build_system_prompt(allow_shortcuts=False):
-    global SYSTEM_PROMPT, REFLECTION_SUBPROMPT, PLAN_REFLECTION_SUBPROMPT
-
-    if allow_shortcuts:
-        REFLECTION_SUBPROMPT = REFLECTION_SUBPROMPT_ALLOW_SHORTCUTS
-        PLAN_REFLECTION_SUBPROMPT = PLAN_REFLECTION_SUBPROMPT_ALLOW_SHORTCUTS
+    my_globals.allow_shortcuts = allow_shortcuts		# use the *_ALLOW_SHORTCUTS reflection prompts (see generate_header_and_prompt())
 
     with open(agent_config.SYSTEM_PROMPT_FILE, 'r') as f:
-        SYSTEM_PROMPT = f.read()        
-    return SYSTEM_PROMPT        
+        my_globals.system_prompt = f.read()        
+    return my_globals.system_prompt        
 
 """ 
 ### NO LONGER NEED RESEARCHWORLD FUNCTIONS    
@@ -418,18 +446,20 @@ def build_system_prompt(allow_shortcuts=False):
 
 # Restart after an abort. Unlike panda(), this preserves the current state and namespace so we can continue with follow-on queries
 def restart():
-    global interactive
     mode = "done"
     planinfo = my_globals.state['planinfo']
     state = my_globals.state['state']
     planstack = my_globals.state['planstack']
-    interactive = True
-    panda_step(mode, planinfo, state, planstack, model=agent_config.PANDA_LLM)
+    my_globals.interactive = True
+    my_globals.cancelled.clear()
+    panda_step(mode, planinfo, state, planstack, model=my_globals.panda_llm)
 
 # Execute a Python command in the Panda execution environment
 def py(cmd):
     if isinstance(cmd, str):
-        exec(cmd, my_globals.state['state'].namespace)
+        namespace = my_globals.state['state'].namespace
+        with command_dir(namespace):
+            exec_command(cmd, namespace)
     else:
         print_to_user("ERROR! Please provide a string as an argument to py()!")
 
@@ -438,7 +468,7 @@ def py(cmd):
 # Your existing function
 def timebounded_panda_step(mode, planinfo, state, planstack=[], model=agent_config.PANDA_LLM):
     try:
-        result_flag = panda_step(mode, planinfo, state, planstack, agent_config.PANDA_LLM)
+        result_flag = panda_step(mode, planinfo, state, planstack, my_globals.panda_llm)
 # timebounded Version. NOTE: CTRL-C doesn't work within this though :(, so replace with timestamp check in top-level step() loop
 #        result_flag = func_timeout(
 #            agent_config.EXPERIMENT_TIMEOUT,   
@@ -460,8 +490,62 @@ planstack = LIST of planinfo, if doing recursive plans (currently disabled, so w
 
 The arguments to panda_step encode the plan tree, but we don't store the outcome of completed steps (but we could). 
 for reviewing the execution.
+
+panda_step() is a loop over transitions (mode, planinfo, planstack): each step (control_step(), which calls panda_step0() for
+the LLM work) returns the next Transition, or the final result_flag. (It used to recurse, one stack frame per transition.)
+Between steps, the loop stops if cancel_run() was called, and calls any step hooks (see add_step_hook()). An exception
+anywhere in a step (including a hook) aborts the current (sub)plan with "abort_python_error", as the recursion did.
 """
+Transition = namedtuple("Transition", ["mode", "planinfo", "planstack"])
+
+# Called before every step with (mode, planinfo, planstack, state), e.g., to log progress or save a checkpoint.
+# A hook can stop the run by returning a result_flag (e.g., "abort_took_too_long"); otherwise it should return None.
+# A hook is for one run (run=<RunContext>, or run_panda(step_hooks=[...])), or else for every run, including concurrent ones.
+step_hooks = []
+
+def add_step_hook(hook, run=None):
+    (run.step_hooks if run else step_hooks).append(hook)
+
+def remove_step_hook(hook, run=None):
+    hooks = run.step_hooks if run else step_hooks
+    if hook in hooks:
+        hooks.remove(hook)
+
+def call_step_hooks(transition, state):
+    for hook in step_hooks + my_globals.step_hooks:
+        stop_flag = hook(transition.mode, transition.planinfo, transition.planstack, state)
+        if stop_flag:
+            return stop_flag
+    return None
+
+# Stop the research at the end of the step in progress, with result_flag "abort_cancelled": the given RunContext
+# (e.g., from another thread), else every run in progress
+def cancel_run(run=None):
+    for run in ([run] if run else get_active_runs()):
+        run.cancel()
+
 def panda_step(mode, planinfo, state, planstack=[], model=agent_config.PANDA_LLM):
+    transition = Transition(mode, planinfo, planstack)
+    while True:
+        try:
+            stop_flag = "abort_cancelled" if my_globals.cancelled.is_set() else call_step_hooks(transition, state)
+            if stop_flag:
+                print_to_user(f"Stopping the research ({stop_flag})...")
+                my_globals.dialog_so_far.append(state.observations)
+                return stop_flag
+            outcome = control_step(transition.mode, transition.planinfo, state, transition.planstack, model)
+        except Exception as e:			# anywhere in the step (a hook, the plan bookkeeping, the LLM work): abort this (sub)plan
+            if transition.mode == "abort_python_error":
+                raise				# failed again while aborting (e.g., a hook that always raises), so give up on the run
+            tb = traceback.format_exc()
+            logger.debug(f"Yikes! Unexpected exception: {e}.\nTraceback:\n{tb}\nAborting...")
+            outcome = Transition("abort_python_error", transition.planinfo, transition.planstack)
+        if not isinstance(outcome, Transition):
+            return outcome				# the final result_flag
+        transition = outcome
+
+# One step of the main loop: returns the next Transition, or the final result_flag
+def control_step(mode, planinfo, state, planstack=[], model=agent_config.PANDA_LLM):
     plan = planinfo['plan']
     step_description = planinfo['step']
     step_number = planinfo['step_number']
@@ -487,7 +571,7 @@ def panda_step(mode, planinfo, state, planstack=[], model=agent_config.PANDA_LLM
     # ----------------------------------------
     if mode in ["start", "done", "abort_iterations", "abort_shortcuts", "abort_impossible", "abort_beyond_capabilities", 
                 "abort_python_error", "abort_took_too_long"]:
-        if interactive and (mode != "done" or planstack == []):		# planstack == [] means main task done, not just a subtask done. mode !=  "done" means the main task was aborted.
+        if my_globals.interactive and (mode != "done" or planstack == []):		# planstack == [] means main task done, not just a subtask done. mode !=  "done" means the main task was aborted.
             if mode != "start":
                 save_dialog()				# make a note of previous research
             reset_token_counts()                
@@ -510,7 +594,7 @@ def panda_step(mode, planinfo, state, planstack=[], model=agent_config.PANDA_LLM
                 observation = "----------------------------------------\n     STARTING THE NEXT RESEARCH TASK\n----------------------------------------\n" 
                 state.observations += observation
                 new_planinfo = {'plan':plan, 'step_number':1, 'step':new_task}
-                return panda_step(new_mode, new_planinfo, state, [], model)
+                return Transition(new_mode, new_planinfo, [])
 
         elif planstack == []:		# completion of top-level plan (with either success or failure)
             my_globals.dialog_so_far.append(state.observations)
@@ -518,11 +602,11 @@ def panda_step(mode, planinfo, state, planstack=[], model=agent_config.PANDA_LLM
 
         elif mode == "done":		# completion of subplan, so pop and go to the next step of the super-plan.
             superplan = planstack[0]
-            return panda_step("next_step", superplan, state, planstack[1:], model)
+            return Transition("next_step", superplan, planstack[1:])
 
         else: # mode in ["abort_beyond_capabilities","abort_shortcuts","abort_impossible", "abort_python_error"] # failure of subplan, so (for now) pop and pass the failure back up to the super-plan.
             superplan = planstack[0]
-            return panda_step(mode, superplan, state, planstack[1:], model)
+            return Transition(mode, superplan, planstack[1:])
 
     # ----------------------------------------
     # 3. completed a step! so go to the next step (if there is one) and strategize OR declare victory ("done")
@@ -534,12 +618,12 @@ def panda_step(mode, planinfo, state, planstack=[], model=agent_config.PANDA_LLM
         if step_number == len(plan):
             observation = "\nThat was the last step! Plan execution is complete.\n"
             state.observations += observation            
-            return panda_step("done", planinfo, state, planstack, model)
+            return Transition("done", planinfo, planstack)
         elif step_number < len(plan):
             planinfo['step_number'] = step_number + 1
             planinfo['step'] = plan_step(plan, step_number + 1)
-#           return panda_step("strategize", planinfo, state, planstack, model)   # this includes considering recursively creating a subplan, but that's a bit overkill for now.
-            return panda_step("act", planinfo, state, planstack, model) # simpler: Just go and do the next step! (don't overthink things...)
+#           return Transition("strategize", planinfo, planstack)   # this includes considering recursively creating a subplan, but that's a bit overkill for now.
+            return Transition("act", planinfo, planstack) # simpler: Just go and do the next step! (don't overthink things...)
         else:
             raise ValueError("DEBUG: step_number >= len(plan)! This should be impossible!! (reflect() should not return new_mode='next_step' in this situation)")
         
@@ -547,12 +631,7 @@ def panda_step(mode, planinfo, state, planstack=[], model=agent_config.PANDA_LLM
     # 4. The above handles bookkeeping about steps and plans. The below panda_step0 now switches to actually using GPT to do the actual work (act/reflect)
     # ----------------------------------------    
     else:
-        try:
-            return panda_step0(mode, planinfo, state, planstack, model)
-        except Exception as e:
-            tb = traceback.format_exc()             
-            logger.debug(f"Yikes! Unexpected exception: {e}.\nTraceback:\n{tb}\nAborting...")
-            return panda_step("abort_python_error", planinfo, state, planstack, model)
+        return panda_step0(mode, planinfo, state, planstack, model)		# (an exception is turned into "abort_python_error" by panda_step())
 
 
 # ----------
@@ -567,6 +646,7 @@ def plan_step(plan, step_number):
 # separate out this main control section, which executes the main act/reflect steps, for code simplicity
 # ======================================================================
 
+# Returns the next Transition (see panda_step())
 def panda_step0(mode, planinfo, state, planstack, model=agent_config.PANDA_LLM):
 
     state.iteration += 1		# update counter
@@ -575,9 +655,10 @@ def panda_step0(mode, planinfo, state, planstack, model=agent_config.PANDA_LLM):
     step_number = planinfo['step_number']
     
     # Create prompt for the next step, depending on the mode
-    formatted_task_hierarchy = "\n" + format_task_hierarchy(planinfo, planstack) if mode != "reflect" else ""
-    header, mode_prompt, comment = generate_header_and_prompt(mode, planinfo, state.iteration, model)	# what question (prompt) to ask GPT, depending on the current mode
-    prompt = state.observations + formatted_task_hierarchy + header + mode_prompt		# pre-pend the observations from previous iteration to the prompt
+    with timed("prompt"):
+        formatted_task_hierarchy = "\n" + format_task_hierarchy(planinfo, planstack) if mode != "reflect" else ""
+        header, mode_prompt, comment = generate_header_and_prompt(mode, planinfo, state.iteration, model)	# what question (prompt) to ask GPT, depending on the current mode
+        prompt = state.observations + formatted_task_hierarchy + header + mode_prompt		# pre-pend the observations from previous iteration to the prompt
     if len(plan) > 1:
         print_to_user(f"Step {step_number}: {step_description}")
     print_to_user(comment)
@@ -591,21 +672,24 @@ def panda_step0(mode, planinfo, state, planstack, model=agent_config.PANDA_LLM):
     # ========================================
     #     THE MAIN AGENT CALL TO THE LLM
     # ========================================
-    response_json, response_str = call_llm_json(my_globals.dialog_so_far, temperature=temperature, model=model) # <- ask GPT for its reply...
+    on_token = print_token if agent_config.STREAM_LLM_OUTPUT else None
+    with llm_caller(mode):								# label the call with the mode in the usage ledger
+        prompts = compact_dialog(my_globals.dialog_so_far, model)			# the older iterations summarized, if it's getting long (see compaction.py)
+        response_json, response_str = call_llm_json(prompts, temperature=temperature, model=model, stream=bool(on_token), on_token=on_token) # <- ask GPT for its reply...
     my_globals.dialog_so_far.append(response_str)    					# <- add GPT's reply to the dialog so far...
     clear_screen()
 
     # Process based on the mode								# Now, process the reply appropriately, depending on what the question (mode) was...
     if mode == "strategize":			# stategize = for current step, should I plan, just do it, or generate a partial plan?
         new_mode, state.observations = strategize(response_json)
-        return panda_step(new_mode, planinfo, state, planstack, model)
+        return Transition(new_mode, planinfo, planstack)
 
     # experimental - do design decisions before an actual plan
     # This option not currently used (uncomment plan_design_decisions later to use it)
     elif mode in ["plan_design_decisions"]:
         # actually the design decisions are rhetorical so not used further
         design_decisions, state.observations = create_plan_design_decisions(response_json, mode=mode)
-        return panda_step("plan", planinfo, state, planstack, model)
+        return Transition("plan", planinfo, planstack)
         
     elif mode in ["plan", "partial_plan", "replan", "continue_plan"]:
         subplan, state.observations = create_plan(response_json, mode=mode)
@@ -617,27 +701,28 @@ def panda_step0(mode, planinfo, state, planstack, model=agent_config.PANDA_LLM):
             first_substep = plan_step(subplan, 1)
             subplaninfo = {'plan':subplan, 'step_number':1, 'step':first_substep}
             if mode in ["plan", "partial_plan"]:
-                return panda_step("reflect_on_plan", subplaninfo, state, [planinfo] + planstack, model) # push planinfo onto stack ([...,subplan,plan,task]) for "plan" or "partial_plan"
+                return Transition("reflect_on_plan", subplaninfo, [planinfo] + planstack) # push planinfo onto stack ([...,subplan,plan,task]) for "plan" or "partial_plan"
             else:
-                return panda_step("reflect_on_plan", subplaninfo, state, planstack, model)		# discard planinfo for "replan" or "continue_plan"
+                return Transition("reflect_on_plan", subplaninfo, planstack)		# discard planinfo for "replan" or "continue_plan"
 
     elif mode == "reflect_on_plan":
         new_mode, state.observations = reflect_on_plan(response_json)
-        return panda_step(new_mode, planinfo, state, planstack, model)
+        return Transition(new_mode, planinfo, planstack)
 
 # partial_plan option not currently used        
 #   elif mode == "act" and step_description == LAST_PARTIAL_PLAN_STEP:		# Special case: A partial plan ends with LAST_PARTIAL_PLAN_STEP = "Plan what to do next"
-#       return panda_step("continue_plan", planinfo, state, planstack, model)
+#       return Transition("continue_plan", planinfo, planstack)
 
     elif mode in ["act", "continue", "debug", "retry", "retry_earlier_step"]:
         action, think_observations = generate_action(response_json)		# i.e., write code...
-        act_observations = execute_action(action, state.namespace)		# then execute it...
+        with command_dir(state.namespace):
+            act_observations = execute_action(action, state.namespace)		# then execute it... (in the run's output directory)
         state.observations = think_observations + act_observations
-        return panda_step("reflect", planinfo, state, planstack, model)
+        return Transition("reflect", planinfo, planstack)
 
     elif mode == "reflect":
         new_mode, state.observations, new_planinfo = reflect(response_json, planinfo)	# mode updated in reflect() based on the reflection result. plan might change too
-        return panda_step(new_mode, new_planinfo, state, planstack, model)
+        return Transition(new_mode, new_planinfo, planstack)
 
     else:
         raise ValueError(f"Unrecognized mode '{mode}'")
@@ -675,10 +760,10 @@ def format_task_hierarchy(planinfo, planstack):
 # ----------
 
 def initialize_namespace():
-    """Initialize a clean execution namespace."""
+    """Initialize a clean execution namespace (in a worker process, if agent_config.EXEC_BACKEND = "worker")."""
     namespace = globals().copy()
     namespace["__builtins__"] = __builtins__
-    return namespace
+    return new_namespace(namespace)
 
 # ----------
 
@@ -731,7 +816,7 @@ def generate_header_and_prompt(mode, planinfo, iteration, model):
         comment = "Planning..."
     elif mode == "reflect_on_plan":
         header += f"#{iteration}. Reflecting on the Plan\n"
-        prompt = PLAN_REFLECTION_SUBPROMPT
+        prompt = PLAN_REFLECTION_SUBPROMPT_ALLOW_SHORTCUTS if my_globals.allow_shortcuts else PLAN_REFLECTION_SUBPROMPT
         comment = "Reflecting..."
     elif mode == "replan":
         header += f"#{iteration}. Replan Task\n"
@@ -752,16 +837,16 @@ def generate_header_and_prompt(mode, planinfo, iteration, model):
         prompt = CONTINUE_SUBPROMPT
         comment = "Coding..."                                
     elif mode in ["debug", "retry"]:
-        header += f"#{iteration}. An error occurred doing step {step_number}. Let's try and debug the problem and retry (retry number {retry_counter}).\n"
+        header += f"#{iteration}. An error occurred doing step {step_number}. Let's try and debug the problem and retry (retry number {my_globals.retry_counter}).\n"
         prompt = DEBUG_SUBPROMPT
         comment = "Coding..."
     elif mode == "retry_earlier_step":
-        header += f"#{iteration}. Step {step_number} failed, indicating a problem at an earlier step in the plan. Returning to retry that earlier step (earlier retry number {retry_earlier_step_counter}).\n"
+        header += f"#{iteration}. Step {step_number} failed, indicating a problem at an earlier step in the plan. Returning to retry that earlier step (earlier retry number {my_globals.retry_earlier_step_counter}).\n"
         prompt = DEBUG_SUBPROMPT
         comment = "Coding..."                                                
     elif mode == "reflect":
         header += f"#{iteration}. Reflect on Step {step_number}\n"
-        prompt = REFLECTION_SUBPROMPT
+        prompt = REFLECTION_SUBPROMPT_ALLOW_SHORTCUTS if my_globals.allow_shortcuts else REFLECTION_SUBPROMPT
 #       comment = f"(Using {model} for Panda)\nReflecting..."        
         comment = "Reflecting..."
     else:
@@ -872,6 +957,7 @@ Side effects:
    Namespace is destructively updated as a result of the code execution
    Also will pretty-print to the terminal, but this is purely cosmetic for the user's benefit
 """
+@timed("exec")
 def execute_action(action:str, namespace):
     global plot_counter
     observations = "I'll now execute the actions (code) you suggested...\n\n" + agent_config.PYTHON_START + "\n"
@@ -904,6 +990,7 @@ def execute_action(action:str, namespace):
     # do the commands
     for command in commands:
 #       command = command.replace("plt.show()", "plt.show(block=False)")		    # Stop plt.show() blocking execution
+        plotfile = None
         if "plt.show()" in command:
             plot_counter += 1
             plotfile = f"plot{plot_counter}.png"
@@ -918,9 +1005,10 @@ def execute_action(action:str, namespace):
         command_line = f"In [{my_globals.py_counter}]: {command}"
         observations += command_line + "\n"         # note for dialog
         print_to_user(command_line)	   	    # print to user [1]
+        spill_path = f"{my_globals.report_pathstem}-out-{my_globals.py_counter}.txt" if my_globals.report_pathstem else None
         my_globals.py_counter += 1                
                 
-        f = io.StringIO()
+        f = OutputCapture(spill_path=spill_path)	# keeps the head and tail of the output, spilling the full output to spill_path if it's long
 #        original_stdout = sys.stdout
 #        original_stderr = sys.stderr
 #        tee_stdout = LoggerTee(original_stdout, f)  # Capture both stdout and stderr
@@ -930,30 +1018,39 @@ def execute_action(action:str, namespace):
         try:
             with redirect_stdout(tee_stdout), redirect_stderr(tee_stderr):
                 # NEW: Timeout handled higher up (see timebounded_panda_step())
-                exec(command, namespace)                # timeout is so long (60 mins) hardly need to use it
+                exec_command(in_output_dir(command, plotfile), namespace)        # exec(), or in the worker process, with its timeouts (see exec_worker.py)
                 code_to_record += command + "\n"	# new: record all successful commands
         except (Exception, SystemExit) as e:      # catch either Exception of SystemExit. SystemExit is a subtype of BaseException, not of Exception (itself a BaseException subtype)
             # Write the error message to the same buffer		# SystemExit might by synthesized and executed in command itself, hence the addition here
             with redirect_stdout(tee_stdout), redirect_stderr(tee_stderr):
-                tb = traceback.format_exc()
+                tb = getattr(e, 'child_traceback', None) or traceback.format_exc()	# (a CommandError from the worker has the worker's traceback)
                 observation = f"Error: {e}\nTraceback:\n{tb}"      # Add traceback for more debugging info
                 print_to_user(observation)
                 observations += observation + "\n"
                 code_to_record = f"# The below command failed to execute (raised a {e} exception)\n" + add_hash_prefixes(command) + "\n"
                 break						# New: if there's an error, give up immediately rather than continuing...
         finally:
+            f.close()
             observation = f.getvalue()
             my_globals.print_so_far += observation     # Normally this var is set via print_to_user(), but in this case the observation was already printed to TTY by exec() earlier, so don't reprint it
-            if nora_thread_id:		   	   # for integration into Nora
+            if my_globals.nora_thread_id:		   	   # for integration into Nora
                 print_to_nora(observation)
             print_to_user()
             observations += observation + "\n"
+    checkpoint_namespace(namespace)			# (worker only) save the variables, in case the worker dies later
     observation = agent_config.CODING_END
     my_globals.code_so_far += "\n# ----------\n" + code_to_record + "\n# ----------\n"
     print_to_user(remove_trailing_newline(observation))
     observations += observation
     return observations
 
+# The command to execute: the plot we inject is saved by its full path in the run's output directory, so it doesn't depend
+# on the process-wide working directory (the dialog and the code file keep the short, relative, form)
+def in_output_dir(command, plotfile):
+    if not plotfile or not my_globals.output_dir:
+        return command
+    return command.replace(f'plt.savefig("{plotfile}")', f"plt.savefig({os.path.join(my_globals.output_dir, plotfile)!r})")
+
 # add_hash_prefixes("a\nb") -> "# a\n# b"
 def add_hash_prefixes(string):
     return '\n'.join('# ' + line for line in string.splitlines())
@@ -980,7 +1077,6 @@ def reflect_on_plan(response_json):
 # return new_mode, new_step_number, observations
 def reflect(response_json, planinfo):
     
-    global retry_counter, retry_earlier_step_counter
     step_number = planinfo['step_number']
     plan = planinfo['plan']
 
@@ -1062,36 +1158,36 @@ def reflect(response_json, planinfo):
     elif new_mode == "next_step":
         if step_number < len(plan):        
             observation = f"Step {step_number} complete. Moving onto the next step in the plan..."
-            retry_counter = 0
+            my_globals.retry_counter = 0
         else:
             observation = "All the steps are finished, but the overall task isn't complete! I better replan..."
-            retry_counter = 0
+            my_globals.retry_counter = 0
             new_mode = "replan"
 
     elif new_mode == "retry_earlier_step":
-        retry_counter = 0        
-        if retry_earlier_step_counter >= agent_config.MAX_EARLIER_STEP_RETRIES:
+        my_globals.retry_counter = 0        
+        if my_globals.retry_earlier_step_counter >= agent_config.MAX_EARLIER_STEP_RETRIES:
             observation = f"Too many retries from an earlier step! Giving up!"
             new_mode = "abort_iterations"
         else:
             observation = f"Step {step_number} failed, indicating a problem at an earlier step in the plan. Returning to retry that earlier step."
-            retry_earlier_step_counter += 1
+            my_globals.retry_earlier_step_counter += 1
 
     elif new_mode == "continue":
         observation = f"Step {step_number} not yet complete. Let's continue to work on it..."
-        retry_counter = 0
+        my_globals.retry_counter = 0
 
     elif new_mode == "replan":
         observation = "The current plan doesn't seem to be going anywhere. I'll replan..."
-        retry_counter = 0
+        my_globals.retry_counter = 0
         
     elif new_mode in ["debug","retry"]:
-        if retry_counter >= agent_config.MAX_RETRIES:
+        if my_globals.retry_counter >= agent_config.MAX_RETRIES:
             observation = f"Too many retries! I seem to be stuck on step {step_number}. Let's abandon this effort and replan."
             new_mode = "replan"
         else:
-            retry_counter += 1
-            observation = f"An error occurred doing step {step_number}. Let's try and debug the problem and retry (retry number {retry_counter})."
+            my_globals.retry_counter += 1
+            observation = f"An error occurred doing step {step_number}. Let's try and debug the problem and retry (retry number {my_globals.retry_counter})."
     else:
             print_to_user(f"ERROR! Unrecognized new_mode '{new_mode}'! Yikes!!")
             raise ValueError("new_mode should be one of 'done|abort_shortcuts|next_step|continue|debug|retry'")
@@ -1170,7 +1266,7 @@ def print_to_user(*args, **kwargs):
 
     my_globals.print_so_far += output_text        
     logger.info(remove_trailing_newline(output_text))	# logger's emit() function adds an extra newline
-    if nora_thread_id:
+    if my_globals.nora_thread_id:
         print_to_nora(output_text)
 
 # ----------
@@ -1179,27 +1275,25 @@ MAX_NORA_SYSTEM_OUTPUT_LENGTH = 30 # lines in the Report Widget
 
 def print_to_nora(output_text):
     
-    global nora_system_output
-
     # 2. Send to the report widget in NORA
     WIDGET_SERVICE_DEV_API_URL = "https://nora-widget-service-dev.apps.allenai.org"
     BOT_USER_UUID = "6a62855f-16f1-4c09-ab76-2b9cbf815b72"
     title = "Panda"
     output_text_length = output_text.count('\n') + 1
-    nora_system_output_length = nora_system_output.count('\n') + 1
+    nora_system_output_length = my_globals.nora_system_output.count('\n') + 1
 
-    # truncate nora_system_output if necessary:
+    # truncate my_globals.nora_system_output if necessary:
     n_to_keep = 0
     if (nora_system_output_length + output_text_length) > MAX_NORA_SYSTEM_OUTPUT_LENGTH and nora_system_output_length > n_to_keep:
         if n_to_keep == 0:
-            nora_system_output = ""
+            my_globals.nora_system_output = ""
         else:
-            nora_system_output = "\n".join(nora_system_output.splitlines()[-n_to_keep:])           # remove all but last n_to_keep lines
+            my_globals.nora_system_output = "\n".join(my_globals.nora_system_output.splitlines()[-n_to_keep:])           # remove all but last n_to_keep lines
         time.sleep(3) 								       # pause for effect...        
 
-    nora_system_output += output_text    		# global record of output
-    sections = [{"id":"123", "title":title, "tldr":nora_system_output, "text":"Working...", "citations":[]}]
-    datas = json.dumps({"actor_id":BOT_USER_UUID, "thread_id":nora_thread_id, "query":title, "sections":sections})
+    my_globals.nora_system_output += output_text    		# global record of output
+    sections = [{"id":"123", "title":title, "tldr":my_globals.nora_system_output, "text":"Working...", "citations":[]}]
+    datas = json.dumps({"actor_id":BOT_USER_UUID, "thread_id":my_globals.nora_thread_id, "query":title, "sections":sections})
     requests.post(f"{WIDGET_SERVICE_DEV_API_URL}/report", data=datas, timeout=30)
 
 ### ======================================================================
@@ -1219,7 +1313,7 @@ def read_advice_file(filepath=agent_config.ADVICE_FILE):
     
 # e.g., get_advice("Review existing architectures and techniques used in LLMs and agents for navigation tasks.")
 def get_advice(step):
-    if ADVICE is None:
+    if my_globals.advice is None:
         return ""
     else:
         prompt = f"""I'm working on the following TASK: {step}
@@ -1228,8 +1322,8 @@ In other words: For each rule where the condition matches the task, list out the
 Return each item of advice on a separate line, starting with a hyphen " - "
 If NO advice applies, return just the empty string "". 
 ONLY describe advice from the IF/THEN rules that is applicable, do NOT generate additional advice.
-DO NOT return any additional text, or description of reasoning. Only return the applicable advice, if any.""" + ADVICE
-        advice = call_llm(prompt, model=agent_config.PANDA_LLM)
+DO NOT return any additional text, or description of reasoning. Only return the applicable advice, if any.""" + my_globals.advice
+        advice = call_llm(prompt, model=my_globals.panda_llm)
         return advice
 
 def clear_screen():
@@ -236,3 +236,31 @@ Return your answer as a JSON object with the following structure:
 Note the value of "doable" should ALWAYS be "yes", with EXPLANATION providing details of how to make the plan doable.
 """
 
+
+#======================================================================
+#	COMPACTION SUBPROMPT (see compaction.py)
+#======================================================================
+
+COMPACTION_SUBPROMPT = """
+YOUR NEXT INSTRUCTION: The conversation above is the earlier part of a research run, which is too long to keep sending in full.
+Write a summary of it that will REPLACE those earlier iterations in the conversation, so include everything the research still needs:
+ - what has been done so far, step by step (briefly), and the outcome of each step
+ - the key results, including the actual numbers, scores, and example data items printed so far
+ - the Python variables, functions, DataFrames (with their columns), and files created, as the later code may use them
+ - errors that occurred and how they were fixed (or not), so they aren't repeated
+Don't include anything not in the conversation. Keep the summary under {max_words} words.
+{previous_summary}
+Return just the summary (plain text, not JSON).
+"""
+
+COMPACTION_PREVIOUS_SUMMARY = """
+Note: The first part of the conversation above is itself a summary of even earlier iterations. Carry its content forward into your summary.
+"""
+
+COMPACTION_HEADER = """======================================================================
+SUMMARY OF THE FIRST {iterations} ITERATIONS, which have been removed from the conversation to save space:
+{summary}
+======================================================================
+The more recent iterations follow, verbatim.
+
+"""
@@ -0,0 +1,209 @@
+"""
+Deterministic replay of a recorded run, from its experiment-trace-long.txt (as written by report_writer.save_dialog()).
+
+run_panda(replay_from=<trace>) re-runs the experiment with the agent's LLM calls answered from the trace, in order,
+while the generated code is really re-executed locally. So a two-hour experiment re-runs in seconds (a regression check
+of the agent loop and the code execution), the non-LLM part of a real run can be profiled, and a bug can be reproduced
+without spending tokens.
+
+ - The agent's calls (on my_globals.dialog_so_far) get the recorded response for that turn of the dialog.
+ - Each prompt is compared with the recorded one (ignoring whitespace and volatile text: timestamps, object addresses, ...).
+   The first difference is the point of divergence: from there on the run is no longer the recorded one (e.g., the code
+   printed something different), although the recorded responses are still served in order.
+ - Other calls (e.g., from the executed code, the report writer, the final summary) are answered from the LLM cache
+   (utils/llm_cache.py) if possible, else by the offline mock (utils/mock_llm.py). With replay_live=True they call the
+   real model instead.
+ - If the run needs more agent turns than the trace has, it stops with result_flag "abort_replay_exhausted".
+
+run_panda() puts replay.report() in its result, e.g.,
+    result['replay'] -> {'trace': '.../experiment-trace-long.txt', 'recorded_model': 'claude-sonnet-4-5-20250929',
+                         'turns_recorded': 11, 'turns_replayed': 11, 'exhausted': False,
+                         'first_divergence': {'turn': 7, 'iteration': 4, 'mode': 'reflect', 'offset': 312,
+                                              'expected': '...', 'actual': '...'},
+                         'divergences': 1, 'divergence_details': [...]}
+
+USAGE:
+panda.run_panda(replay_from="output/experiment-20260210-143138/experiment-trace-long.txt")
+panda --replay_from output/experiment-20260210-143138/experiment-trace-long.txt
+"""
+
+import os
+import re
+import threading
+
+from . import my_globals
+from . import config as agent_config
+from panda.utils import ask_llm
+from panda.utils.logger import logger
+from panda.utils.dialog import join_words
+from panda.utils.ledger import get_caller
+from panda.utils.llm_cache import get_cache, make_cache_key
+
+DIFF_CONTEXT = 200			# characters of context shown either side of a divergence
+MAX_DIVERGENCES = 20			# divergences kept in the report (after the first, the rest are mostly knock-on effects)
+
+TASK_MARKER = "NOW: Here is your top-level research task:\n"			# see panda_agent.task_intro()
+BACKGROUND_MARKER = "Here is some background_knowledge for the research you are about to do:\n"
+
+# Text that legitimately changes from run to run, so isn't a divergence
+VOLATILE_PATTERNS = [
+    (re.compile(r"\d{8}-\d{6}"), "<TIMESTAMP>"),					# experiment-20260210-143138
+    (re.compile(r"\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d+)?"), "<DATETIME>"),
+    (re.compile(r"\b0x[0-9a-fA-F]{6,}\b"), "<ADDRESS>"),			# <object at 0x7f3a...>
+    (re.compile(r"\b\d+\.\d+ ?(seconds|secs|sec|s)\b"), "<DURATION>"),
+]
+
+# A BaseException (like KeyboardInterrupt), so the agent's "except Exception" handlers (call_llm_json()'s retries, the
+# step loop's abort_python_error) don't swallow it: it ends the whole run, with result_flag "abort_replay_exhausted"
+class ReplayExhausted(BaseException):
+    """Raised when the run needs more agent turns than the recorded trace has."""
+    pass
+
+### ======================================================================
+###		PARSE THE TRACE
+### ======================================================================
+
+# Returns {'dialog': [system prompt, prompt, response, ...], 'observations': extra final text (or None), 'model': recorded model,
+#          'task': ..., 'background_knowledge': ...}. The system prompt is None if the trace was saved without it.
+def parse_trace(path):
+    with open(path, encoding="utf-8", errors="replace") as file:
+        text = file.read()
+    gpt_header = re.escape(agent_config.GPT_HEADER).replace(re.escape("{PANDA_LLM}"), "(.+?)")
+    headers = list(re.finditer(f"^(?:{re.escape(agent_config.PANDA_HEADER)}|{gpt_header})\n", text, re.M))
+    if not text.startswith(agent_config.SYSTEM_PROMPT_HEADER) or not headers:
+        raise ValueError(f"{path} doesn't look like an experiment-trace-long.txt file (see report_writer.save_dialog())")
+
+    # save_dialog() writes each item followed by "\n" (and a blank line either side of the system prompt)
+    system_text = strip_suffix(text[len(agent_config.SYSTEM_PROMPT_HEADER)+2:headers[0].start()], "\n\n")
+    dialog, observations, model = [system_text], None, None
+    for i, header in enumerate(headers):
+        end = headers[i+1].start() if i + 1 < len(headers) else len(text)
+        item = strip_suffix(text[header.end():end], "\n")
+        is_response = header.group(1) is not None
+        if model is None and is_response:
+            model = header.group(1)
+        if is_response == (len(dialog) % 2 == 0):		# prompts are at odd positions, responses at even ones
+            dialog.append(item)
+        elif not is_response and i == len(headers) - 1:
+            observations = item				# the extra last output that didn't make it into the dialog
+        else:
+            raise ValueError(f"{path}: unexpected {'response' if is_response else 'prompt'} at turn {len(dialog)} of the trace")
+
+    task, background_knowledge = parse_task(system_text)
+    recorded_system = None if system_text.startswith("...<system prompt") else system_text
+    return {'dialog': [recorded_system] + dialog[1:], 'observations': observations, 'model': model,
+            'task': task, 'background_knowledge': background_knowledge}
+
+def strip_suffix(text, suffix):
+    return text[:-len(suffix)] if text.endswith(suffix) else text
+
+# The task and background knowledge, from the end of the system prompt (see panda_agent.task_intro())
+def parse_task(system_text):
+    start = system_text.rfind(TASK_MARKER)
+    if start == -1:
+        return None, None
+    task = re.sub(r"\n\n=+\n=+\n*$", "", system_text[start+len(TASK_MARKER):])
+    background_start = system_text.rfind(BACKGROUND_MARKER, 0, start)
+    background_knowledge = strip_suffix(system_text[background_start+len(BACKGROUND_MARKER):start], "\n\n") if background_start != -1 else None
+    return task, background_knowledge
+
+### ======================================================================
+###		COMPARING PROMPTS
+### ======================================================================
+
+def normalize(text):
+    text = join_words(text)
+    for pattern, replacement in VOLATILE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+# Where (in the normalized texts) expected and actual first differ, with some context either side. None if they match.
+def first_difference(expected, actual):
+    expected, actual = normalize(expected), normalize(actual)
+    if expected == actual:
+        return None
+    offset = len(os.path.commonprefix([expected, actual]))
+    start = max(0, offset - DIFF_CONTEXT)
+    return {'offset': offset, 'expected': expected[start:offset+DIFF_CONTEXT], 'actual': actual[start:offset+DIFF_CONTEXT]}
+
+### ======================================================================
+###		THE REPLAY
+### ======================================================================
+
+class Replay:
+    """Answers LLM calls from a recorded trace (installed as the run's llm_override by start_replay())"""
+
+    def __init__(self, path, live=False):
+        self.path = os.path.abspath(path)
+        trace = parse_trace(self.path)
+        self.dialog = trace['dialog']
+        self.model = trace['model']
+        self.task = trace['task']
+        self.background_knowledge = trace['background_knowledge']
+        self.live = live
+        self.turns_replayed = 0
+        self.divergences = []
+        self.n_divergences = 0
+        self.compared = set()
+        self.exhausted = False
+        self.lock = threading.Lock()
+
+    @property
+    def turns_recorded(self):
+        return (len(self.dialog) - 1) // 2
+
+    # The run's llm_override hook (see ask_llm.get_llm_override()): returns (answer, answered_by), or None to call the real model
+    def answer(self, prompt, model=None, response_format=None, temperature=0):
+        if prompt is my_globals.dialog_so_far or getattr(prompt, 'full_dialog', None) is my_globals.dialog_so_far:	# (compacted, see compaction.py)
+            return self.agent_response(my_globals.dialog_so_far), "replay"
+        return self.other_response(prompt, model, response_format, temperature)
+
+    def agent_response(self, dialog):
+        index = len(dialog) - 1			# the position of the prompt just added by panda_step0()
+        with self.lock:
+            if index + 1 >= len(self.dialog):
+                self.exhausted = True
+                raise ReplayExhausted(f"Replay exhausted: the run needs more than the {self.turns_recorded} agent turns recorded in {self.path}")
+            for turn in [0, index]:		# also check the system prompt (+ task) on the first call
+                if turn not in self.compared and self.dialog[turn] is not None:
+                    self.compared.add(turn)
+                    self.compare(turn, self.dialog[turn], dialog[turn])
+            self.turns_replayed = max(self.turns_replayed, (index + 1) // 2)
+            return self.dialog[index + 1]
+
+    def compare(self, turn, expected, actual):
+        difference = first_difference(expected, actual)
+        if difference is None:
+            return
+        self.n_divergences += 1
+        divergence = {'turn': turn, 'iteration': (turn + 1) // 2, 'mode': get_caller() if turn else "system_prompt", **difference}
+        if len(self.divergences) < MAX_DIVERGENCES:
+            self.divergences.append(divergence)
+        if self.n_divergences == 1:
+            logger.warning(f"Replay diverged from {self.path} at turn {turn} ({divergence['mode']}):\n"
+                           f"  expected: ...{difference['expected']}...\n  actual:   ...{difference['actual']}...")
+
+    def other_response(self, prompt, model, response_format, temperature):
+        llm_cache = get_cache()
+        if llm_cache and temperature == 0:
+            answer = llm_cache.get(make_cache_key(prompt, model, temperature, response_format))
+            if answer is not None:
+                return answer, "replay:cache"
+        if self.live:
+            return None
+        from panda.utils.mock_llm import mock_response
+        return mock_response(prompt, "mock", response_format), "replay:mock"
+
+    def report(self):
+        with self.lock:
+            return {'trace': self.path, 'recorded_model': self.model, 'turns_recorded': self.turns_recorded,
+                    'turns_replayed': self.turns_replayed, 'exhausted': self.exhausted,
+                    'first_divergence': self.divergences[0] if self.divergences else None,
+                    'divergences': self.n_divergences, 'divergence_details': list(self.divergences)}
+
+# Answer the current run's LLM calls from replay (only that run's: concurrent runs still call their models)
+def start_replay(replay):
+    ask_llm.set_llm_override(replay.answer)
+
+def stop_replay():
+    ask_llm.set_llm_override(None)
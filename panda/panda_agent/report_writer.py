@@ -12,6 +12,10 @@ from .format_dataset import dataset_table_only, dataset_table_legend
 from .format_categories import categories_table_only, categories_table_legend
 from panda.utils import replace_special_chars_with_ascii, call_llm, call_llm_json, get_token_counts, remove_html_markup, extract_html_from_string, logger
 from . import config as agent_config
+from panda.utils.ask_llm import print_token
+from panda.utils.dialog import Dialog
+from panda.utils.ledger import llm_caller
+from panda.utils.timing import timed
 # Below purely to get researchworld.tools.created_datasets and researchworld.tools.created_categories vars (rather than a COPY of those vars at import time, voa from ... import ..)
 #import panda.researchworld.tools as tools
 #import panda.researchworld.tools as tools
@@ -120,11 +124,14 @@ Example:
     - c:/Users/peter/Desktop/panda/output/experiment-20250705-213812/experiment.txt
     # and returns the stem "c:/Users/peter/Desktop/panda/output/experiment-20250705-213812/experiment"
 """
-def write_report(filename="report", report_dir=REPORT_DIR, timestamp=True, input_dialog=None, model=agent_config.REPORT_WRITER_LLM):
+@llm_caller("report")			# label its LLM calls in the usage ledger
+@timed("write_report")
+def write_report(filename="report", report_dir=REPORT_DIR, timestamp=True, input_dialog=None, model=None):
 
+    model = model or my_globals.report_writer_llm		# looked up at call time: the current run's (see run_context.py)
     if not input_dialog:
         input_dialog = my_globals.dialog_so_far		# the last item in dialog_so_far will be a GPT response
-    report_dialog = input_dialog.copy()        
+    report_dialog = input_dialog.copy() if isinstance(input_dialog, Dialog) else Dialog(input_dialog)	# copy, keeping the cached prefix hashes
             
     html_report_template = Template(REPORT_HTML_TEMPLATE)
     txt_report_template = Template(REPORT_TXT_TEMPLATE)    
@@ -145,7 +152,7 @@ def write_report(filename="report", report_dir=REPORT_DIR, timestamp=True, input
         logger.info("------------ Query -----------------------")
         logger.info(prompt)
         logger.info(f"---------- {model} Reponse  ------------------")
-        response0 = call_llm(report_dialog, model=model)
+        response0 = call_llm(report_dialog, model=model, stream=agent_config.STREAM_LLM_OUTPUT, on_token=print_token)
         response = replace_special_chars_with_ascii(response0)		# get rid of non-ASCII characters that mess up the display
         report_dialog += [response]
         logger.info("%s...", response[:70])
@@ -201,8 +208,8 @@ def make_report_prequeries(report_dialog):
     logger.info("------------ Query -----------------------")
     logger.info(GATHER_RESULTS_PROMPT)
     report_dialog.append(GATHER_RESULTS_PROMPT)
-    logger.info(f"---------- {agent_config.PANDA_LLM} Reponse  ------------------")    
-    response_str = call_llm(report_dialog, model=agent_config.PANDA_LLM)
+    logger.info(f"---------- {my_globals.panda_llm} Reponse  ------------------")    
+    response_str = call_llm(report_dialog, model=my_globals.panda_llm)
     report_dialog.append(response_str)
     logger.info(response_str)
 
@@ -210,8 +217,8 @@ def make_report_prequeries(report_dialog):
     logger.info("------------ Query -----------------------")
     logger.info(GATHER_EXAMPLES_PROMPT)
     report_dialog.append(GATHER_EXAMPLES_PROMPT)
-    logger.info(f"---------- {agent_config.PANDA_LLM} Reponse  ------------------")    
-    response_str = call_llm(report_dialog, model=agent_config.PANDA_LLM)
+    logger.info(f"---------- {my_globals.panda_llm} Reponse  ------------------")    
+    response_str = call_llm(report_dialog, model=my_globals.panda_llm)
     report_dialog.append(response_str)
     logger.info(response_str)    
 
@@ -242,21 +249,21 @@ def save_report(html_report, txt_report, filename="report", report_dir=REPORT_DI
 # ------------------------------
 
 def convert_html2txt(html_report):
-    logger.info(f"Converting report from HTML to TXT using {agent_config.REPORT_TRANSLATOR_LLM}...")
+    logger.info(f"Converting report from HTML to TXT using {my_globals.report_translator_llm}...")
     txt_report = call_llm(f"""Convert the following HTML file into plain text. Return just the text, without any commentary before or after.
 ```html
 {html_report}
 ```
-""", model=agent_config.REPORT_TRANSLATOR_LLM)
+""", model=my_globals.report_translator_llm)
     return extract_txt_from_string(txt_report)
 
 def convert_txt2html (txt_report):
-    logger.info(f"Converting report from TXT to HTML using {agent_config.REPORT_TRANSLATOR_LLM}...")
+    logger.info(f"Converting report from TXT to HTML using {my_globals.report_translator_llm}...")
     html_report = call_llm(f"""Format the following text file into HTML. Return just the HTML, without any commentary before or after.
 ```text
 {txt_report}
 ```
-""", model=agent_config.REPORT_TRANSLATOR_LLM)
+""", model=my_globals.report_translator_llm)
     return extract_html_from_string(html_report)
 
 # ------------------------------
@@ -271,7 +278,7 @@ def footnotes():
 
 def get_token_summary(token_counts):
     parts = [
-        f'{entry["model"]}: {entry["total_tokens"]} tokens'
+        f'{entry["model"]}: {entry["total_tokens"]} tokens' + (f' ({entry["cached_tokens"]} cached)' if entry.get("cached_tokens") else '')
         for entry in token_counts
     ]
     summary = "; ".join(parts)
@@ -344,6 +351,7 @@ def format_nice_dataframes(dataset_named_dataframes, categories_named_dataframes
 ### save_dialog(["You are a smart assistant.","What is 1+1?","2","What is 2+3?"])
 ### save_dialog(output_filestem="report-trace")
 ### Note: "-trace.txt", "-trace-long.txt", and ".py" will be concatenated to output_filestem
+@timed("save_dialog")
 def save_dialog(dialog=None, show_system_prompt=True, output_dir=REPORT_DIR, output_filestem=None, observations=None):
     if dialog is None:
         if my_globals.dialog_so_far:
@@ -392,7 +400,7 @@ def save_dialog(dialog=None, show_system_prompt=True, output_dir=REPORT_DIR, out
             write_output(dialog[i])
 
             if i + 1 < len(dialog):  # Check if the next item exists
-                write_output(agent_config.GPT_HEADER.format(PANDA_LLM=agent_config.PANDA_LLM))
+                write_output(agent_config.GPT_HEADER.format(PANDA_LLM=my_globals.panda_llm))
                 write_output(dialog[i + 1])
 
         if observations:   # extra last output that didn't make it into dialog
@@ -445,7 +453,7 @@ Now return a list of all the dataframes created in it (if any).
 Return your answer as a JSON structure of the form:
     {"dataframes":[dataframe1,...,dataframeN]}
 listing the variable name of each data frame."""
-    dataframes_json, dataframes_str = call_llm_json(prompt, model=agent_config.PANDA_LLM)
+    dataframes_json, dataframes_str = call_llm_json(prompt, model=my_globals.panda_llm)
     dataframe_names = dataframes_json['dataframes']
 
     nspace = my_globals.state['state'].namespace    # This is where I squirrel away the exec() namespace
@@ -472,7 +480,7 @@ Now return a list of all the key variables created in it (if any).
 Return your answer as a JSON structure of the form:
     {"variables":[var1,...,varN]}
 """
-    vars_json, vars_str = call_llm_json(prompt, model=agent_config.PANDA_LLM)
+    vars_json, vars_str = call_llm_json(prompt, model=my_globals.panda_llm)
     var_names = vars_json['variables']
 
     nspace = my_globals.state['state'].namespace    # This is where I squirrel away the exec() namespace
@@ -0,0 +1,153 @@
+"""
+Run-scoped state, so several experiments can run at once in one process (e.g., the MCP server's jobs, each in a thread)
+and share its warm caches, connection pools and rate limiters.
+
+A RunContext holds everything one run_panda() changes as it goes: the dialog, the printed trace, the code, the Python
+state, the retry counters, the system prompt, the model, the output directory, and its own LLM usage ledger and token
+counts. run_panda() makes a new one and makes it current (a contextvars.ContextVar, so each thread - and each asyncio
+task - sees its own run). my_globals.<name> reads and writes the current run's <name>, so the code using my_globals is
+unchanged. Outside of any run (e.g., before the first run_panda()), there's a default process-wide RunContext.
+
+The current run stays current after run_panda() returns (as the old module globals did), so restart(), py() and
+save_dialog() carry on with the last run in that thread.
+
+The generated code is run with the run's output directory as the working directory (for its plots and CSV files), but
+the working directory is process-wide: in_run_dir() changes it for the duration of each action, one action at a time.
+(The plots Panda saves for plt.show() use the full path, see execute_action(), but the code's own relative paths
+can't be rewritten reliably.) To execute concurrent runs' actions concurrently, use the "worker" execution backend
+(PANDA_EXEC_BACKEND=worker, see exec_worker.py): each run's code then runs in its own process, in its own directory.
+
+USAGE:
+from panda.panda_agent.run_context import current_run
+current_run().report_pathstem		-> '/home/me/experiments/experiment-20260210-143138/experiment'
+"""
+
+import os
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from . import config as agent_config
+from panda.utils.dialog import Dialog
+from panda.utils.logger import logger
+from panda.utils.ledger import use_run_usage
+
+class RunContext:
+    def __init__(self, model=None, output_dir=None, thread_id=None):
+        self.model = model			# None = agent_config.PANDA_LLM (see the properties below)
+        self.report_writer_model = None
+        self.report_translator_model = None
+        self.output_dir = output_dir		# absolute, or None (the current directory)
+        self.report_pathstem = os.path.join(output_dir, "experiment").replace("\\", "/") if output_dir else None
+
+        # the trace, code, and Python state (were my_globals' module variables)
+        self.dialog_so_far = Dialog()		# a list of strings, that also caches word counts and hashes (see utils/dialog.py)
+        self.print_so_far = ""
+        self.code_so_far = ""
+        self.plotfiles_so_far = []
+        self.py_counter = 1
+        self.start_time = 0
+        self.state = None			# {'planinfo':..., 'state':..., 'planstack':...}, for restart()
+
+        # the agent's bookkeeping (were panda_agent's module globals)
+        self.system_prompt = None
+        self.allow_shortcuts = False
+        self.advice = None
+        self.interactive = False
+        self.retry_counter = 0
+        self.retry_earlier_step_counter = 0
+        self.nora_thread_id = thread_id		# for use with the NORA UI
+        self.nora_system_output = ""
+        self.compaction = None			# the dialog's rolling summary, if it's been compacted (see compaction.py)
+        self.step_hooks = []			# called before each of this run's steps (see panda_agent.add_step_hook())
+        self.llm_override = None		# answers this run's LLM calls instead of the model, e.g., a replay (see replay.py)
+
+        # this run's LLM usage (see utils/ledger.py)
+        self.calls = []
+        self.token_counts = {}
+        self.cancelled = threading.Event()	# set by cancel(): stop before the next step
+
+    @property
+    def panda_llm(self):
+        return self.model or agent_config.PANDA_LLM
+
+    @property
+    def report_writer_llm(self):
+        return self.report_writer_model or agent_config.REPORT_WRITER_LLM
+
+    @property
+    def report_translator_llm(self):
+        return self.report_translator_model or agent_config.REPORT_TRANSLATOR_LLM
+
+    def cancel(self):
+        self.cancelled.set()
+
+    # Carry on from an earlier run: its dialog (reset_dialog=False) and/or its Python state (reset_namespace=False)
+    def continue_from(self, previous, dialog=True, state=True):
+        if dialog:
+            self.dialog_so_far = previous.dialog_so_far
+            self.system_prompt = previous.system_prompt
+            self.allow_shortcuts = previous.allow_shortcuts
+            self.compaction = previous.compaction
+        if state:
+            self.state = previous.state
+
+### ======================================================================
+###		THE CURRENT RUN
+### ======================================================================
+
+_default_run = RunContext()
+_current_run = contextvars.ContextVar("panda_run", default=None)
+_active_runs = set()			# runs in progress, in any thread (for cancel_run())
+_active_runs_lock = threading.Lock()
+
+def current_run():
+    return _current_run.get() or _default_run
+
+# Make run the current run (in this thread/task, and in any threads that copy its context), including its usage ledger
+def set_current_run(run):
+    _current_run.set(run)
+    use_run_usage(run.calls, run.token_counts)
+
+# A run in progress (between run_panda()'s start_run() and finish_run()), in any thread - for cancel_run()
+def start_run(run):
+    set_current_run(run)
+    with _active_runs_lock:
+        _active_runs.add(run)
+
+def finish_run(run):
+    with _active_runs_lock:
+        _active_runs.discard(run)
+
+def get_active_runs():
+    with _active_runs_lock:
+        return list(_active_runs)
+
+### ======================================================================
+###		THE WORKING DIRECTORY
+### ======================================================================
+
+_cwd_lock = threading.RLock()
+_cwd_wait_noted = False
+
+# Run a block (the generated code) in the current run's output directory. The working directory is process-wide, so this
+# holds a lock: concurrent runs execute their actions one at a time (their LLM calls, the bulk of a run, still overlap).
+@contextmanager
+def in_run_dir():
+    global _cwd_wait_noted
+    output_dir = current_run().output_dir
+    if not _cwd_lock.acquire(blocking=False):
+        if not _cwd_wait_noted:
+            logger.info("Waiting for another run's code to finish: in-process, runs execute their code one action at a time (set PANDA_EXEC_BACKEND=worker to run it concurrently)")
+            _cwd_wait_noted = True
+        _cwd_lock.acquire()
+    try:
+        cwd = os.getcwd()
+        if output_dir:
+            os.chdir(output_dir)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+    finally:
+        _cwd_lock.release()
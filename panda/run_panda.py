@@ -10,6 +10,8 @@ Usage:
 Optional arguments:
   --force_report     - force Panda to *always* write a report on its work
   --outputs_dir      - directory for the experimental results directory (containing report and other artifacts). Default is output/
+  --stream           - show the LLM's responses live (on stderr) as they are generated
+  --replay_from      - re-run a recorded experiment from its experiment-trace-long.txt, with the LLM's responses served from the trace
 
 Or install as a tool:
 % uv tool install git+https://github.com/allenai/panda --force
@@ -20,12 +22,12 @@ Or install as a tool:
 
 import argparse
 #import panda
-from .panda_agent import run_panda	# import the function (not this file!)
-from .panda_agent.config import VERSION, PANDA_LLM
+from .panda_agent import config as agent_config		# cheap: the agent itself (and litellm, pandas, ...) is only imported in main()
+from .panda_agent.config import PANDA_LLM
 
 def main():
     parser = argparse.ArgumentParser(description="Run Panda tasks from the command line.")
-    parser.add_argument("--version", action="version", version=f"%(prog)s {VERSION}")
+    parser.add_argument("--version", action="version", version=f"%(prog)s {agent_config.VERSION}")
     parser.add_argument("--task", help="The research or analysis question to run.")
     parser.add_argument("--task_file", default=None, help="A text file containing the research or analysis question to run.")
     parser.add_argument("--background_knowledge", default=None, help="Additional context for the task.")
@@ -35,9 +37,14 @@ def main():
     parser.add_argument("--experiment_subdir", default=None, help="Where to place this specific experiment's artifacts, relative to the Panda directory.")
     parser.add_argument("--result_file", default=None, help="Where to place the JSON result.")
     parser.add_argument("--model", default=PANDA_LLM, help="The underlying LLM to use for Panda.")    
+    parser.add_argument("--stream", action="store_true", help="Show the LLM's responses live (on stderr) as they are generated.")
+    parser.add_argument("--replay_from", default=None, help="Re-run a recorded experiment from its experiment-trace-long.txt, without calling the LLM (see panda_agent/replay.py).")
     args = parser.parse_args()
+    if args.stream:
+        agent_config.STREAM_LLM_OUTPUT = True
 
     # Call into your package
+    from .panda_agent import run_panda	# import the function (not this file!)
     run_panda(
         task=args.task,
         task_file=args.task_file,
@@ -47,7 +54,8 @@ def main():
         outputs_dir=args.outputs_dir,
         experiment_subdir=args.experiment_subdir,
         result_file=args.result_file,
-        model=args.model
+        model=args.model,
+        replay_from=args.replay_from
     )
 
 if __name__ == "__main__":
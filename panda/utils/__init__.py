@@ -1,23 +1,48 @@
-
-from .file_utils import read_file_contents, file_exists, delete_file, download_file, copy_file
-from .file_utils import clear_directory, add_to_end_of_file
-
-from .utils import remove_html_markup, multiline_input
-from .utils import extract_html_from_string, extract_json_from_string
-from .utils import replace_special_chars_with_ascii, similar_strings, jprint, remove_trailing_newline, strip_trailing_question
-
-from .mapping import llm_list, llm_list_json, map_dataframe, map_dataframe_json, map_dataframe_multiple_choice
-
-from .pyparser import parse_code, code_asks_for_user_input
-
-from .ask_llm import call_llm, call_llm_json, call_llm_multiple_choice, reset_token_counts, get_token_counts, build_gpt_response_format
+# Lazy imports (see panda/__init__.py): ask_llm and mapping pull in litellm/openai and pandas, so they are only
+# loaded when one of their functions is first used.
+_LAZY_IMPORTS = {}
+def _lazy(module, *names):
+    for name in names:
+        _LAZY_IMPORTS[name] = module
+
+_lazy(".file_utils", "read_file_contents", "file_exists", "delete_file", "download_file", "copy_file")
+_lazy(".file_utils", "clear_directory", "add_to_end_of_file")
+
+_lazy(".utils", "remove_html_markup", "multiline_input")
+_lazy(".utils", "extract_html_from_string", "extract_json_from_string")
+_lazy(".utils", "replace_special_chars_with_ascii", "similar_strings", "jprint", "remove_trailing_newline", "strip_trailing_question")
+
+_lazy(".mapping", "llm_list", "llm_list_json", "map_dataframe", "map_dataframe_json", "map_dataframe_multiple_choice")
+
+_lazy(".pyparser", "parse_code", "code_asks_for_user_input")
+
+_lazy(".ask_llm", "call_llm", "call_llm_json", "call_llm_multiple_choice", "reset_token_counts", "get_token_counts", "build_gpt_response_format")
+_lazy(".ask_llm_async", "acall_llm", "acall_llm_json", "acall_llm_multiple_choice")
+_lazy(".llm_cache", "get_cache_stats", "clear_cache")
+_lazy(".resilience", "get_resilience_stats")
+_lazy(".key_pool", "get_key_stats")
+_lazy(".json_repair", "get_json_stats")
+_lazy(".dialog", "Dialog")
+_lazy(".models", "get_model_info", "get_token_ratios")
+_lazy(".ledger", "llm_caller", "get_calls", "summarize_calls")
 
 from .logger import logger
 
 from . import config
 
-
-
-
-
-
+__all__ = list(_LAZY_IMPORTS) + ["logger", "config"]
+
+def __getattr__(name):
+    import importlib, importlib.util
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if name in _LAZY_IMPORTS:
+        value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    if importlib.util.find_spec("." + name, __name__):		# a submodule, e.g., panda.utils.ask_llm
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
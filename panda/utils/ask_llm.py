@@ -1,6 +1,7 @@
 """
-Clear cache:
-panda.utils.ask_llm.cached_call_gpt.cache_clear()
+Clear cache (persistent, on disk - see utils/llm_cache.py):
+panda.utils.llm_cache.clear_cache()
+panda.utils.llm_cache.get_cache_stats()   -> hit/miss counters
 
 TEST CASES:
 panda.utils.call_llm("What is 1 + 1?", "llama")
@@ -10,43 +11,103 @@ Out[24]: '{\n  "answer": 2\n}'     - note you then have to subsequently parse th
 
 panda.utils.call_llm("What is 1 + 1?")
 Out[21]: '1 + 1 equals 2.'
+
+STREAMING: tokens are passed to on_token as they arrive (the full answer is still returned at the end):
+panda.utils.call_llm("Write a haiku about pandas.", stream=True, on_token=panda.utils.ask_llm.print_token)
+If a stream fails partway (or call_llm_json() re-queries), the answer starts again from the beginning: on_token is first passed
+STREAM_RESET, meaning "discard the text so far". (It is a str, a short notice, so a consumer that just prints tokens still works.)
 """
 
-import requests
+import os
+import sys
 import json
+import hashlib
 import time
-import math	# for math.ceil in _truncate_string_middle_by_words()
+import math	# for math.ceil in _truncate_string_middle_by_words(), math.exp in answer_probability()
 
-from unidecode import unidecode
-from functools import lru_cache
-from litellm import completion
+import threading
+from .normalize import transliterate		# = unidecode(), with a fast path for ASCII text
 
-# Use of Pydantic classes for Structured Output in GPT
-from pydantic import BaseModel
-from openai import OpenAI
+# Note: litellm and openai are slow to import (seconds), so they are imported on first use - see get_litellm(), get_openai_client()
+# (Pydantic classes for Structured Output in GPT are passed straight through to the OpenAI client)
 
 from . import config			# import entire file
-from .utils import extract_json_from_string	# import function
+from .json_repair import extract_json, count_json	# import functions
+from .llm_cache import get_cache, make_cache_key, single_flight
+from .dialog import word_count, join_words, make_message
+from .models import max_prompt_words, count_words, record_prompt_tokens, is_context_overflow, note_context_overflow
+from . import transport
+from .rate_limit import wait_for_quota, backoff, estimate_tokens, raise_for_retryable_status
+from .resilience import hedged_call, get_breaker, provider_of, get_fallback_chain
+from .ledger import llm_call, record_usage, reset_ledger, current_token_counts
+from .key_pool import use_key
+from .timing import timed
 from .logger import logger, with_quiet_logging
 from panda.panda_agent import config as agent_config
+from panda.panda_agent.run_context import current_run
 
-# e.g., [{ "model":"gpt-4.1","prompt_tokens": 85932,"completion_tokens": 18386,"total_tokens": 104318}, ...]
-token_counts = []
+# Per-model totals, e.g., {"gpt-4.1": {"model":"gpt-4.1","prompt_tokens": 85932,"completion_tokens": 18386,"total_tokens": 104318,"cached_tokens": 71680}, ...}
+# cached_tokens = the part of prompt_tokens that was read from the provider's prompt cache (cheaper and faster)
+# The per-call details (latency, retries, cache hits, cost) are in the ledger (utils/ledger.py). Both are kept per run (see
+# ledger.use_run_usage()), so current_token_counts() is the current run's totals.
+token_counts_lock = threading.Lock()
 
+# Also clears the per-call ledger. (Not the per-key usage in utils/key_pool.py, which is for the whole process, as the keys are shared by all runs)
 def reset_token_counts():
-    global token_counts
-    token_counts = []
+    with token_counts_lock:
+        current_token_counts().clear()
+    reset_ledger()
 
 # we'll ignore the GPT versioning for now
+# Returns a list, e.g., [{"model":"gpt-4.1","prompt_tokens":100,"completion_tokens":310,"total_tokens":410,"cached_tokens":0}, ...]
 def get_token_counts():
-    return token_counts
+    with token_counts_lock:
+        return [dict(entry) for entry in current_token_counts().values()]
 
 class MaxRetriesExceeded(Exception):  # Custom exception
     """Raised when the maximum number of retries is reached."""
     pass  # No additional attributes needed in this case
 
-# Define the OAI client for GPT. This appears to use a bunch of system variables (e.g., OPENAI_API_KEY)
-client = OpenAI()
+# The OAI client for GPT. This appears to use a bunch of system variables (e.g., OPENAI_API_KEY)
+# Built on first use rather than at import, so "import panda" (and "panda --version") stays fast.
+# One client per API key, for a pool of keys (see utils/key_pool.py); api_key=None uses the environment's key.
+clients = {}
+_client_lock = threading.Lock()
+
+def get_openai_client(api_key=None):
+    client = clients.get(api_key)
+    if client is None:
+        with _client_lock:
+            client = clients.get(api_key)
+            if client is None:
+                from openai import OpenAI
+                client = clients[api_key] = OpenAI(api_key=api_key) if api_key else OpenAI()
+    return client
+
+# LiteLLM, imported on first use. By default LiteLLM fetches its model cost map over the network when imported; Panda
+# doesn't use it, so we use the copy bundled with LiteLLM instead (set LITELLM_LOCAL_MODEL_COST_MAP=False to fetch it).
+def get_litellm():
+    os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+    import litellm
+    return litellm
+
+# In a forked child (e.g., the execution worker, see panda_agent/exec_worker.py), don't share the parent's keep-alive
+# connections: drop the OpenAI clients, and LiteLLM's cached HTTP clients, so the child opens its own on first use
+def _reset_clients_after_fork():
+    global _client_lock
+    clients.clear()
+    _client_lock = threading.Lock()
+    litellm = sys.modules.get("litellm")
+    if litellm is not None:
+        try:
+            litellm.in_memory_llm_clients_cache.flush_cache()
+            for name in ("module_level_client", "module_level_aclient"):	# (re-created on first use)
+                litellm.__dict__.pop(name, None)
+        except Exception as e:
+            logger.debug("DEBUG: Couldn't reset LiteLLM's clients after a fork: %s", e)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients_after_fork)
 
 """ 
 ======================================================================
@@ -63,43 +124,131 @@ Args:
     prompt (str): The question/instruction to give to the LLM.
     model (str): One of {config.MODEL_NAMES}
     temperature (int): The temperature to use during LLM generation (default 0)
+    stream (bool): (optional) stream the response, calling on_token(str) with each new piece of text as it arrives
 Returns:
     response (str): The LLM response.
 Example:
     call_llm("Generate a new research idea about large language models.")
 ->  Title: Investigating the Impact of Multimodal Inputs on Large Language ....
 """
-def call_llm(prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True):
+@timed("llm")
+def call_llm(prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True, cache=True, stream=False, on_token=None):
 #   logger.debug(f"DEBUG: Calling model {model}...")
 #   if temperature > 0:
 #        logger.debug(f"DEBUG: call_llm with temperature = {temperature}\nprompt = {repr(prompt[:50])}...")
+
+    with llm_call(model) as row:			# one row in the usage ledger (see utils/ledger.py)
+        llm_override = get_llm_override()
+        overridden = llm_override(prompt, model=model, response_format=response_format, temperature=temperature) if llm_override else None
+        if overridden:
+            answer, row['answered_by'] = overridden
+            if stream and on_token:
+                on_token(answer)
+        else:
+            answer = ledgered_call_llm(row, prompt, response_format=response_format, model=model, temperature=temperature, quiet=quiet, cache=cache, stream=stream, on_token=on_token)
+        row['ok'] = bool(answer)
+
+# This is a bit of a sledgehammer that can remove some important characters. ChatGPT suggests unidecode instead which tries an ascii approximation.
+# https://chatgpt.com/share/68b086e0-ad2c-8001-bb07-6d5d60cc4c16
+#   return answer.encode("latin-1", errors="ignore").decode("utf-8", errors="ignore")    	# Remove encoding errors
+    return transliterate(answer)
+
+# An optional hook that answers LLM calls instead of the model, e.g., when replaying a recorded run (see panda_agent/replay.py).
+# llm_override(prompt, model=, response_format=, temperature=) returns (answer, answered_by), or None to call the model as usual.
+# It belongs to the run (see panda_agent/run_context.py), so replaying one run doesn't answer a concurrent run's calls.
+def get_llm_override():
+    return current_run().llm_override
+
+def set_llm_override(override):
+    current_run().llm_override = override
+
+def ledgered_call_llm(row, prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True, cache=True, stream=False, on_token=None):
+    def dispatch():
+        answer, row['answered_by'] = dispatch_with_fallback(prompt, response_format=response_format, model=model, temperature=temperature, quiet=quiet, stream=stream, on_token=on_token)
+        return answer
+
+    # Persistent cache, shared by all backends. Only deterministic (temperature 0) calls are cached, as callers
+    # use temperature > 0 precisely to get a *different* answer (e.g., call_llm_json retries). The offline mock is
+    # never cached: its injected latency and errors (and scripted answers) must happen on every call, and mangled
+    # answers mustn't end up in the shared cache file.
+    if not (cache and temperature == 0) or provider_of(model) == "mock":
+        return dispatch()
+
+    llm_cache = get_cache()
+    cache_key = make_cache_key(prompt, model, temperature, response_format)
+    if llm_cache:
+        answer = llm_cache.get(cache_key)
+        if answer is not None:
+            row['cache_hit'] = True
+            if stream and on_token:
+                on_token(answer)			# a cache hit arrives all at once
+            return answer
+
+    def compute_and_store():
+        answer = dispatch()
+        if llm_cache and answer and row['answered_by'] == model:	# don't cache failures ("" after all retries), unrecognized models, or fallback answers
+            if not answer.startswith("Unrecognized model:"):
+                llm_cache.put(cache_key, answer, model=model)
+        return answer
+
+    # Identical concurrent calls (e.g., from runs in threads, or MCP jobs) share one in-flight request
+    leader = []
+    answer = single_flight(cache_key, lambda: leader.append(True) or compute_and_store())
+    if not leader:
+        row['coalesced'] = True
+        if stream and on_token:
+            on_token(answer)				# we waited on another caller's request, so it arrives all at once
+    return answer
+
+# Try model, then its fallbacks (config.FALLBACK_MODELS), skipping providers whose circuit breaker is open (but always
+# trying the last model in the chain). Each call may be hedged (see utils/resilience.py). Returns (answer, model that answered).
+def dispatch_with_fallback(prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True, stream=False, on_token=None):
+    chain = get_fallback_chain(model)
+    answer = ""
+    for i, model1 in enumerate(chain):
+        breaker = get_breaker(provider_of(model1))
+        if not breaker.allow() and i < len(chain)-1:
+            logger.warning(f"{provider_of(model1)} is failing (circuit breaker open), skipping {model1} and using {chain[i+1]}...")
+            continue
+        call = lambda: dispatch_llm(prompt, response_format=response_format, model=model1, temperature=temperature, quiet=quiet, stream=stream, on_token=on_token)
+        answer = call() if stream else hedged_call(call, model1)		# a hedge would send duplicate tokens to on_token
+        if answer:
+            breaker.record_success()
+            return answer, model1
+        breaker.record_failure()
+        if i < len(chain)-1:
+            logger.warning(f"No answer from {model1}, falling back to {chain[i+1]}...")
+    return answer, model
+
+# Route the call to the right backend. Caching is done once, above, in call_llm(), so backends are called with cache=False
+def dispatch_llm(prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True, stream=False, on_token=None):
+    streaming = {'stream':stream, 'on_token':on_token}
     if model == "olmo":
-        answer =  call_olmo(prompt, temperature=temperature, quiet=quiet)
+        answer =  call_olmo(prompt, temperature=temperature, cache=False, quiet=quiet, on_token=on_token)	# OLMo always streams
+    elif model == "mock" or model.startswith("mock:"):						# offline, for tests and benchmarks
+        from .mock_llm import call_mock
+        answer =  call_mock(prompt, model=model, response_format=response_format, quiet=quiet, **streaming)
     elif model in ["gpt4",config.DEFAULT_GPT4_MODEL]:
-        answer =  call_gpt(prompt, response_format=response_format, temperature=temperature, model=config.DEFAULT_GPT4_MODEL, quiet=quiet)
+        answer =  call_gpt(prompt, response_format=response_format, temperature=temperature, cache=False, model=config.DEFAULT_GPT4_MODEL, quiet=quiet, **streaming)
     elif model in ["gpt4.5",config.DEFAULT_GPT45_MODEL]:
-        answer =  call_gpt(prompt, response_format=response_format, temperature=temperature, model=config.DEFAULT_GPT45_MODEL, quiet=quiet)
+        answer =  call_gpt(prompt, response_format=response_format, temperature=temperature, cache=False, model=config.DEFAULT_GPT45_MODEL, quiet=quiet, **streaming)
 #   elif model in ["o1-mini","o3-mini","o4-mini","gpt-4.1","gpt-4.1-nano","gpt-5","gpt-5-mini"]:        
     elif model.startswith(("o1", "o3", "o4", "gpt")):
-        answer =  call_gpt(prompt, response_format=response_format, temperature=temperature, model=model, quiet=quiet)
+        answer =  call_gpt(prompt, response_format=response_format, temperature=temperature, cache=False, model=model, quiet=quiet, **streaming)
     elif model == "llama":
-        answer =  call_litellm(prompt, config.LLAMA_MODEL, quiet=quiet)
+        answer =  call_litellm(prompt, config.LLAMA_MODEL, quiet=quiet, **streaming)
     elif model == "mistral":									# Need a MISTRAL_API_KEY for this
-        answer =  call_litellm(prompt, config.MISTRAL_MODEL, quiet=quiet)
+        answer =  call_litellm(prompt, config.MISTRAL_MODEL, quiet=quiet, **streaming)
     elif model == "claude":
-        answer =  call_litellm(prompt, config.DEFAULT_CLAUDE_MODEL, quiet=quiet)
+        answer =  call_litellm(prompt, config.DEFAULT_CLAUDE_MODEL, quiet=quiet, **streaming)
     elif model == "claude-3.5":
-        answer =  call_litellm(prompt, config.CLAUDE35_MODEL, quiet=quiet)
+        answer =  call_litellm(prompt, config.CLAUDE35_MODEL, quiet=quiet, **streaming)
     elif model.startswith(("claude", "llama", "meta", "mistral")):
-        answer =  call_litellm(prompt, model, quiet=quiet)        		# NEW: Allow any LiteLLM to be explicitly specified
+        answer =  call_litellm(prompt, model, quiet=quiet, **streaming)        		# NEW: Allow any LiteLLM to be explicitly specified
     else:
         logger.error(f"Unrecognized model: {model}")
         answer =  f"Unrecognized model: {model}"
-
-# This is a bit of a sledgehammer that can remove some important characters. ChatGPT suggests unidecode instead which tries an ascii approximation.
-# https://chatgpt.com/share/68b086e0-ad2c-8001-bb07-6d5d60cc4c16
-#   return answer.encode("latin-1", errors="ignore").decode("utf-8", errors="ignore")    	# Remove encoding errors
-    return unidecode(answer)
+    return answer
 
 ### ======================================================================
 
@@ -119,19 +268,24 @@ Example:
     -> (   {{'first_name': 'Barack', 'age': 61}},
            '{{"first_name":"Barack","age":61}}'    )
 """
-def call_llm_json(prompt, response_format={"type":"json_object"}, temperature=0, max_retries=3, model=agent_config.PANDA_LLM):
+def call_llm_json(prompt, response_format={"type":"json_object"}, temperature=0, max_retries=3, model=agent_config.PANDA_LLM, stream=False, on_token=None):
+    response_str = ""
     for attempt in range(0,max_retries):
         try:
             if attempt == 0:
-                response_str = call_llm(prompt, temperature=temperature, response_format=response_format, model=model)
+                response_str = call_llm(prompt, temperature=temperature, response_format=response_format, model=model, stream=stream, on_token=on_token)
             else:
+                if stream and on_token and response_str:
+                    on_token(STREAM_RESET)		# the streamed answer we couldn't use is being replaced
                 extra_advice = "\nPlease respond concisely (your previous answer was too long to process!)\n"
                 if isinstance(prompt, str):
                     prompt += extra_advice
                 elif isinstance(prompt, list):
-                    prompt[-1] += extra_advice
-                response_str = call_llm(prompt, response_format=response_format, temperature=0.7, model=model)	# make sure we get a different answer
-            return extract_json_from_string(response_str), response_str
+                    prompt = prompt[:-1] + [prompt[-1] + extra_advice]		# a copy: don't change the caller's dialog
+                response_str = call_llm(prompt, response_format=response_format, temperature=0.7, model=model, stream=stream, on_token=on_token)	# make sure we get a different answer
+            if attempt > 0:
+                count_json('requeried')
+            return extract_json(response_str)[0], response_str		# repairs near-JSON locally, so only re-query if that fails
         except Exception as e:
             logger.warning(f"{model} exception {e}. (invalid JSON structure?)....retrying...")
     else:
@@ -143,8 +297,20 @@ def call_llm_json(prompt, response_format={"type":"json_object"}, temperature=0,
 Example:
     print(call_llm_multiple_choice("I hit someone for fun. Was that wrong?", ["wrong","not_wrong"], model='olmo'))
 ->  wrong
+    print(call_llm_multiple_choice("Is water wet?", ["yes","no"], model='gpt-4.1', return_probability=True))
+->  ('yes', 0.9812)
+With single_call=True (default config.MULTIPLE_CHOICE_SINGLE_CALL), the model picks the option in one request (for GPT, constrained
+to the options by an enum JSON schema, with the option's probability from the logprobs). If that fails we fall back to the original
+two-step method (free-form answer, then GPT converts it to a choice). probability is None if the model doesn't give logprobs.
 """
-def call_llm_multiple_choice(prompt, options, max_retries=3, model=agent_config.PANDA_LLM, quiet=True):
+def call_llm_multiple_choice(prompt, options, max_retries=3, model=agent_config.PANDA_LLM, quiet=True, return_probability=False, single_call=None):
+
+    single_call = config.MULTIPLE_CHOICE_SINGLE_CALL if single_call is None else single_call
+    if single_call:
+        answer, probability = choose_in_one_call(prompt, options, model=model, max_retries=max_retries)
+        if answer is not None:
+            return (answer, probability) if return_probability else answer
+        logger.warning(f"Couldn't get a valid choice from {model} in one call, trying the two-step method...")
 
     prompt += f" (Your answer options are {options})"
 
@@ -169,7 +335,7 @@ def call_llm_multiple_choice(prompt, options, max_retries=3, model=agent_config.
             else:
                 answer = response['answer']
                 if answer in options:
-                    return answer
+                    return (answer, None) if return_probability else answer
                 else:
                     logger.warning(f"Yikes! GPT gave answer '{answer}' but that isn't one of the options {options}!. Trying again...")
         except Exception as e:
@@ -177,14 +343,120 @@ def call_llm_multiple_choice(prompt, options, max_retries=3, model=agent_config.
     else:
         raise MaxRetriesExceeded("Max retries reached...giving up...")
 
+# ----------
+# Single-call multiple choice. Returns (answer, probability), or (None, None) if no valid choice was returned.
+
+def choose_in_one_call(prompt, options, model=agent_config.PANDA_LLM, max_retries=3):
+    mc_prompt, model1, enum_type = one_call_setup(prompt, options, model)
+
+    if model1.startswith(("o1", "o3", "o4", "gpt")) and enum_type and not get_llm_override():	# (score_multiple_choice() bypasses call_llm(), and so any override)
+        for attempt in range(0,max_retries):
+            answer, probability = score_multiple_choice(mc_prompt, options, model1, enum_type, temperature=0 if attempt == 0 else 0.7)
+            if answer in options:
+                return answer, probability
+            logger.warning(f"Yikes! {model1} gave answer '{answer}' but that isn't one of the options {options}!. Trying again...")
+    else:
+        for attempt in range(0,max_retries):
+            try:
+                response,_ = call_llm_json(mc_prompt, model=model, temperature=0 if attempt == 0 else 0.7)
+                answer = response.get('answer') if isinstance(response, dict) else None
+                if answer in options:
+                    return answer, None
+                logger.warning(f"Yikes! {model} gave answer '{answer}' but that isn't one of the options {options}!. Trying again...")
+            except Exception as e:
+                logger.warning(f"{model} exception {e}. (invalid JSON structure?)....retrying...")
+    return None, None
+
+# The prompt, the model, and the JSON type of the options (None if they're mixed), for a single-call multiple choice
+# (shared with ask_llm_async.achoose_in_one_call())
+def one_call_setup(prompt, options, model):
+    mc_prompt = prompt + f'\nReturn your answer as a JSON object with the following structure {{"answer":CHOICE}}, where CHOICE is exactly one of {options}'
+    model1 = {"gpt4":config.DEFAULT_GPT4_MODEL, "gpt4.5":config.DEFAULT_GPT45_MODEL}.get(model, model)
+    enum_type = ("string" if all(isinstance(option, str) for option in options) else
+                 "number" if all(isinstance(option, (int, float)) and not isinstance(option, bool) for option in options) else None)
+    return mc_prompt, model1, enum_type
+
+def choice_response_format(options, enum_type="string"):
+    return {"type":"json_schema",
+            "json_schema":{"name":"choice", "strict":True,
+                           "schema":{"type":"object",
+                                     "properties":{"answer":{"type":enum_type, "enum":list(options)}},
+                                     "additionalProperties":False,
+                                     "required":["answer"]}}}
+
+# One GPT call, with the answer constrained to options by the schema. Cached (at temperature 0) like call_llm().
+def score_multiple_choice(prompt, options, model, enum_type="string", temperature=0):
+    response_format = choice_response_format(options, enum_type)
+
+    def compute():
+        content, logprobs = raw_call_gpt(prompt, response_format=response_format, temperature=temperature, model=model, logprobs=True)
+        try:
+            answer = extract_json(content)[0].get('answer')
+        except (ValueError, AttributeError):
+            return None, None
+        return answer, answer_probability(logprobs, answer)
+
+    llm_cache = get_cache() if temperature == 0 else None
+    if not llm_cache:
+        return compute()
+    cache_key = make_cache_key(prompt, model, temperature, dict(response_format, logprobs=True))
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        result = json.loads(cached)
+        return result['answer'], result['probability']
+    def compute_and_store():
+        answer, probability = compute()
+        if answer in options:
+            llm_cache.put(cache_key, json.dumps({'answer':answer, 'probability':probability}), model=model)
+        return answer, probability
+    return single_flight(cache_key, compute_and_store)
+
+# The probability of answer = exp(sum of the logprobs of the tokens spelling out its value in {"answer":VALUE})
+def answer_probability(logprobs, answer):
+    if not logprobs:
+        return None
+    text = ''.join(item['token'] for item in logprobs)
+    value = json.dumps(answer)
+    key_at = text.find('"answer"')
+    start = text.find(value, key_at + len('"answer"') if key_at >= 0 else 0)
+    if start < 0:
+        return None
+    end = start + len(value)
+    if isinstance(answer, str):
+        start, end = start + 1, end - 1		# the quotes aren't part of the choice
+    total = 0.0
+    position = 0
+    for item in logprobs:
+        token_end = position + len(item['token'])
+        if token_end > start and position < end:
+            total += item['logprob']
+        position = token_end
+    return round(math.exp(total), 4)
+
 ### ======================================================================
 ###		OLMO
 ### ======================================================================
 
-def raw_call_olmo(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, quiet=True):
+def raw_call_olmo(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, quiet=True, on_token=None):
     # quiet currently unused
-    url = config.OLMO_ENDPOINT
-    model_version_id = config.OLMO_VERSION_ID
+    url, headers, data = build_olmo_request(prompt, temperature=temperature, inferd_token=inferd_token)
+    body = json.dumps(data).encode("utf-8")		# serialize once, reuse across retries
+    logger.debug("DEBUG: OLMo data = %s", body)
+
+    for attempt in range(0,config.MAX_OLMO_ATTEMPTS):
+        wait_for_quota("olmo", len(prompt) // 4)
+        try:
+            response = transport.post(url, headers=headers, body=body, timeout=config.OLMO_TIMEOUT, stream=True)
+            raise_for_retryable_status(response)
+            return parse_olmo_stream(response.iter_lines(), on_token=on_token)
+        except Exception as e:
+            logger.warning(f"ERROR from OLMo: {e}. Trying again...")                
+            backoff("olmo", attempt, e, max_attempts=config.MAX_OLMO_ATTEMPTS)
+    logger.error(f"ERROR from OLMo: Giving up completely after {config.MAX_OLMO_ATTEMPTS} tries (returning NIL)")
+    return ""                    
+
+# Shared by raw_call_olmo() and raw_call_tulu() (and the async versions in ask_llm_async.py)
+def build_olmo_request(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, url=config.OLMO_ENDPOINT, model_version_id=config.OLMO_VERSION_ID):
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {inferd_token}'
@@ -203,36 +475,33 @@ def raw_call_olmo(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, quiet
             }
         }
     }
-
-    for attempt in range(0,config.MAX_OLMO_ATTEMPTS):
-        try:
-            logger.debug("DEBUG: OLMo data = %s", json.dumps(data))
-            response = requests.post(url, headers=headers, data=json.dumps(data), timeout=config.OLMO_TIMEOUT)
-            response_lines = response.text.strip().split('\n')
-            logger.debug("DEBUG: response_lines = %s", response_lines)
-            result_tokens = []
-            for line in response_lines:
-                line_json = json.loads(line)
-                token = line_json.get('result', {}).get('output', {}).get('text', '')
-                result_tokens.append(token)
-            return ''.join(result_tokens)
-        except Exception as e:
-            logger.warning(f"ERROR from OLMo: {e}. Trying again...")                
-    logger.error(f"ERROR from OLMo: Giving up completely after {config.MAX_OLMO_ATTEMPTS} tries (returning NIL)")
-    return ""                    
-
-def call_olmo(prompt, temperature=0, cache=True, inferd_token=config.INFERD_TOKEN, quiet=True):
+    return url, headers, data
+
+# OLMo returns one JSON object per line (NDJSON), each with one token of the answer
+def parse_olmo_response(response_text):
+    return parse_olmo_stream(response_text.strip().split('\n'))
+
+# Parse the NDJSON lines as they arrive (e.g., from response.iter_lines()), passing each token to on_token
+def parse_olmo_stream(lines, on_token=None):
+    result_tokens = []
+    with TokenRelay(on_token) as relay:
+        for line in lines:
+            if not line:
+                continue
+            line_json = json.loads(line)
+            token = line_json.get('result', {}).get('output', {}).get('text', '')
+            result_tokens.append(token)
+            relay(token)
+    return ''.join(result_tokens)
+
+def call_olmo(prompt, temperature=0, cache=True, inferd_token=config.INFERD_TOKEN, quiet=True, on_token=None):
 #    global olmo_calls    
 #    olmo_calls += 1        
     if cache:
-        return cached_call_olmo(prompt, temperature=temperature, inferd_token=inferd_token, quiet=quiet)
+        return cached_call(lambda: raw_call_olmo(prompt, temperature=temperature, inferd_token=inferd_token, quiet=quiet, on_token=on_token),
+                           prompt, model="olmo", temperature=temperature)
     else:
-        return raw_call_olmo(prompt, temperature=temperature, inferd_token=inferd_token, quiet=quiet)
-
-# Apply the lru_cache decorator
-@lru_cache() 
-def cached_call_olmo(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, quiet=True):
-    return raw_call_olmo(prompt, temperature=temperature, inferd_token=inferd_token, quiet=quiet)
+        return raw_call_olmo(prompt, temperature=temperature, inferd_token=inferd_token, quiet=quiet, on_token=on_token)
 
 # Example:
 # "The capital of England is London"
@@ -240,44 +509,23 @@ def cached_call_olmo(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, qu
 # ======================================================================
 
 # Tulu endpoint no longer available it seems....
-def raw_call_tulu(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, quiet=True):
+def raw_call_tulu(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, quiet=True, on_token=None):
     # quiet currently unused
-    url = config.TULU_ENDPOINT
-    model_version_id = config.TULU_VERSION_ID
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {inferd_token}'
-    }
-    data = {
-        'model_version_id': model_version_id,
-        'input': {
-            'messages': [{
-                'role': 'user',
-                'content': prompt
-            }],
-            'opts': {
-                'temperature': temperature,
-#                'max_tokens': 1000,	- don't need this?
-                'logprobs': 2
-            }
-        }
-    }
+    url, headers, data = build_olmo_request(prompt, temperature=temperature, inferd_token=inferd_token,
+                                            url=config.TULU_ENDPOINT, model_version_id=config.TULU_VERSION_ID)
+    body = json.dumps(data).encode("utf-8")		# serialize once, reuse across retries
+    logger.debug("DEBUG: headers = %s", headers)
+    logger.debug("DEBUG: data = %s", body)
 
     for attempt in range(0,config.MAX_OLMO_ATTEMPTS):
+        wait_for_quota("olmo", len(prompt) // 4)
         try:
-            logger.debug("DEBUG: headers = %s", headers)
-            logger.debug("DEBUG: data = %s", data)            
-            response = requests.post(url, headers=headers, data=json.dumps(data), timeout=config.OLMO_TIMEOUT)
-            response_lines = response.text.strip().split('\n')
-            logger.debug("DEBUG: response_lines = %s", response_lines)
-            result_tokens = []
-            for line in response_lines:
-                line_json = json.loads(line)
-                token = line_json.get('result', {}).get('output', {}).get('text', '')
-                result_tokens.append(token)
-            return ''.join(result_tokens)
+            response = transport.post(url, headers=headers, body=body, timeout=config.OLMO_TIMEOUT, stream=True)
+            raise_for_retryable_status(response)
+            return parse_olmo_stream(response.iter_lines(), on_token=on_token)
         except Exception as e:
             logger.warning(f"ERROR from OLMo: {e}. Trying again...")                
+            backoff("olmo", attempt, e, max_attempts=config.MAX_OLMO_ATTEMPTS)
     logger.error(f"ERROR from OLMo: Giving up completely after {config.MAX_OLMO_ATTEMPTS} tries (returning NIL)")
     return ""                    
 
@@ -288,11 +536,47 @@ def raw_call_tulu(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, quiet
 #            response_json = response.json()
 #            content = response_json['choices'][0]['message']['content']
 #     because the dot-notation is cleaner, safer, refactorable (https://chatgpt.com/share/688ac049-7f10-8001-8dd5-3cb4f5e96f91)
-def call_litellm(prompts0, model=config.DEFAULT_CLAUDE_MODEL, quiet=True):
+def call_litellm(prompts0, model=config.DEFAULT_CLAUDE_MODEL, quiet=True, stream=False, on_token=None):
+
+    prompts, messages = build_litellm_messages(prompts0, model)
 
-    def max_words(model):
-        return 80000		# default. claude-3-5-sonnet-20240620 I believe is 200k tokens (100k words was too many so reduced to 80k)
+    n_tokens = estimate_tokens(messages)
+    prompt_words = count_words(prompts)
+    for attempt in range(0,config.MAX_LITELLM_ATTEMPTS):
+        wait_for_quota(model, n_tokens)
+        with use_key(provider_of(model)) as api_key:		# one of a pool of keys (see utils/key_pool.py)
+            key_args = {'api_key': api_key} if api_key else {}
+            try:
+                if not quiet:
+                    logger.debug("DEBUG: prompts = %s", prompts)
+#           response = completion(model=model, messages=messages)
+                if stream:
+                    content = with_quiet_logging(lambda: parse_litellm_stream(		# chunks are pulled inside, so keep the logs quiet while iterating too
+                        get_litellm().completion(model=model, messages=messages, **key_args, stream=True, stream_options={"include_usage": True}), model, on_token=on_token, prompt_words=prompt_words))
+                else:
+                    response = with_quiet_logging(get_litellm().completion, model=model, messages=messages, **key_args)	# suppress LiteLLM logs which mess up MCP stream somehow
+                    content = parse_litellm_response(response, model, prompt_words=prompt_words)
+                if content:
+                    return content
+                else:
+                    logger.warning(f"Not getting the right response structure from {model}. Trying again...")               
+                    backoff(model, attempt, max_attempts=config.MAX_LITELLM_ATTEMPTS)
+            except Exception as e:
+                logger.warning(f"ERROR from {model}: {e}. Trying again...")
+                if is_context_overflow(e):				# our token estimate was too low: truncate harder and retry straight away
+                    note_context_overflow(model)
+                    prompts, messages = build_litellm_messages(prompts0, model)
+                    n_tokens, prompt_words = estimate_tokens(messages), count_words(prompts)
+                    continue
+                backoff(model, attempt, e, max_attempts=config.MAX_LITELLM_ATTEMPTS)	# honors LiteLLM's RateLimitError Retry-After
     
+    # If all attempts fail
+    logger.error(f"ERROR from {model}: Giving up completely after {config.MAX_LITELLM_ATTEMPTS} tries (returning '')")
+    return ""
+
+# Returns the (possibly truncated) prompts, and the messages to send
+def build_litellm_messages(prompts0, model):
+
     prompts1 = (
         prompts0 if isinstance(prompts0, list) else
         [prompts0] if isinstance(prompts0, str) else
@@ -300,47 +584,159 @@ def call_litellm(prompts0, model=config.DEFAULT_CLAUDE_MODEL, quiet=True):
     )            
 
 #   prompts = truncate_prompt(prompts1, truncate_from=8, max_words=max_words(model))
-    prompts = truncate_prompt(prompts1, max_words=max_words(model))    
+    prompts = truncate_prompt(prompts1, max_words=max_prompt_words(model))	# the model's context window, in calibrated words (see utils/models.py)
     messages = convert_to_messages(prompts, model=model, first_role="user")
+    if config.PROMPT_CACHING and is_anthropic_model(model):
+        messages = add_cache_breakpoints(messages)
+    return prompts, messages
+
+# Returns the content (and records the token usage), or None if the response isn't well-formed
+# prompt_words: the words we sent, to calibrate the model's tokens-per-word ratio against the prompt_tokens we were billed
+def parse_litellm_response(response, model, prompt_words=None):
+    if response and response.choices and response.choices[0].message and response.choices[0].message.content:
+        content = response.choices[0].message.content		# [1]                
+        prompt_tokens = response.usage.prompt_tokens
+        completion_tokens = response.usage.completion_tokens
+        total_tokens = response.usage.total_tokens                
+        add_token_counts(model, prompt_tokens, completion_tokens, total_tokens, cached_tokens=get_cached_tokens(response.usage))
+        record_prompt_tokens(model, prompt_words, prompt_tokens)
+        return content
+    return None
 
-    for attempt in range(0,config.MAX_LITELLM_ATTEMPTS):
-        try:
-            if not quiet:
-                logger.debug("DEBUG: prompts = %s", prompts)
-#           response = completion(model=model, messages=messages)
-            response = with_quiet_logging(completion, model=model, messages=messages)	# suppress LiteLLM logs which mess up MCP stream somehow
-            if response and response.choices and response.choices[0].message and response.choices[0].message.content:
-                content = response.choices[0].message.content		# [1]                
-                prompt_tokens = response.usage.prompt_tokens
-                completion_tokens = response.usage.completion_tokens
-                total_tokens = response.usage.total_tokens                
-                add_token_counts(model, prompt_tokens, completion_tokens, total_tokens)                
+# ----------
+# Provider prompt caching. panda_step0() re-sends the whole (ever-growing) dialog_so_far on every call, so the
+# provider can serve everything up to the previous turn from its prompt cache, if we let it.
+#  - Anthropic: caching is opt-in, by marking breakpoints with cache_control. We mark the end of the preamble (system prompt
+#    + task, which never change) and the last message. The next call's prompt extends this one, so Anthropic finds the
+#    previous call's breakpoint (it looks back up to 20 blocks) and only the two new messages are processed at full price.
+#  - OpenAI: prefixes of 1024+ tokens are cached automatically, as long as the request starts with exactly the same
+#    bytes. Our messages are built deterministically, and prompt_cache_key (see build_gpt_request) routes
+#    requests sharing a prefix to the same cache.
+# Note: once a dialog exceeds max_words, truncate_prompt() trims its start, which changes the prefix (a cache miss).
+# ----------
 
-                return content
-            else:
-                logger.warning(f"Not getting the right response structure from {model}. Trying again...")               
-        except Exception as e:
-            logger.warning(f"ERROR from {model}: {e}. Trying again...")
-    
-    # If all attempts fail
-    logger.error(f"ERROR from {model}: Giving up completely after {config.MAX_LITELLM_ATTEMPTS} tries (returning '')")
-    return ""
+def is_anthropic_model(model):
+    return model.startswith(("claude", "anthropic/"))
+
+def add_cache_breakpoints(messages):
+    if not messages:
+        return messages
+    messages = [dict(message) for message in messages]		# don't change the caller's messages
+    for i in sorted({min(1, len(messages)-1), len(messages)-1}):
+        content = messages[i]['content']
+        if isinstance(content, str):
+            messages[i]['content'] = [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+    return messages
+
+# A stable id for OpenAI's prompt_cache_key, from the first message (the system prompt), which all Panda calls share
+def get_prompt_cache_key(messages):
+    first = messages[0]['content'] if messages else ""
+    return hashlib.sha256(str(first).encode("utf-8")).hexdigest()[:32]
+
+# usage may be a dict (raw GPT JSON) or an object (LiteLLM/OpenAI client). LiteLLM reports Anthropic's
+# cache_read_input_tokens as prompt_tokens_details.cached_tokens, same as OpenAI.
+def get_cached_tokens(usage):
+    if not usage:
+        return 0
+    if isinstance(usage, dict):
+        details = usage.get('prompt_tokens_details') or {}
+        return details.get('cached_tokens') or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', None) if details else None
+    return cached_tokens or getattr(usage, 'cache_read_input_tokens', None) or 0
+
+# Streaming version: accumulate the delta chunks (passing each to on_token). With include_usage, the final chunk carries the usage.
+def parse_litellm_stream(chunks, model, on_token=None, prompt_words=None):
+    pieces = []
+    usage = None
+    with TokenRelay(on_token) as relay:
+        for chunk in chunks:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                token = chunk.choices[0].delta.content
+                pieces.append(token)
+                relay(token)
+    if usage:
+        add_token_counts(model, usage.prompt_tokens, usage.completion_tokens, usage.total_tokens, cached_tokens=get_cached_tokens(usage))
+        record_prompt_tokens(model, prompt_words, usage.prompt_tokens)
+    return ''.join(pieces) or None
 
 # ======================================================================
 
 # response_format = {"type":"text"}, {"type":"json_object"} [obsolete],
 # or <abbreviated-json-schema> that's expanded by build_gpt_response_format into {"type":"json_schema","json_schema":...}
-def raw_call_gpt(prompts0, response_format={"type":"text"}, temperature=0, openai_api_key=config.OPENAI_API_KEY, quiet=True, model=config.DEFAULT_GPT4_MODEL):
+# logprobs=True: return (content, logprobs), where logprobs is the list of {'token':..,'logprob':..} for the answer (None for reasoning models)
+def raw_call_gpt(prompts0, response_format={"type":"text"}, temperature=0, openai_api_key=None, quiet=True, model=config.DEFAULT_GPT4_MODEL, stream=False, on_token=None, logprobs=False):
 
 #   logger.debug(f"DEBUG: Calling GPT with temperature={temperature}, model={model}...")
 #   logger.debug("DEBUG: response_format =", response_format)
 #    input("pause...")
-    ### estimate max word length (given max token length)
-    def max_words(model=config.DEFAULT_GPT4_MODEL):
-        if model in ['gpt-4-1106-preview','gpt-4o']:
-            return 80000
-        else:
-            return 80000		# default
+    stream = stream and not isinstance(response_format, type) and not logprobs		# Pydantic structured output isn't streamed
+
+    def prepare_request():
+        request = build_gpt_request(prompts0, response_format=response_format, temperature=temperature, openai_api_key=openai_api_key, model=model0)
+        if stream:
+            request['data'] = dict(request['data'], stream=True, stream_options={"include_usage": True})	# include_usage: token counts in the final event
+        if logprobs and not request['is_reasoning_model']:			# reasoning models don't return logprobs
+            request['data'] = dict(request['data'], logprobs=True)
+        body = json.dumps(request['data']).encode("utf-8")		# serialize the (often huge) dialog once, reuse across retries
+        return request, body, estimate_tokens(request['messages'])
+
+    model0 = model
+    request, body, n_tokens = prepare_request()
+    model = request['model']
+        
+    for attempt in range(0,config.MAX_GPT_ATTEMPTS):
+        wait_for_quota(model, n_tokens)
+        with use_key("openai", openai_api_key) as api_key:		# one of a pool of keys (see utils/key_pool.py)
+            headers = dict(request['headers'], Authorization=f'Bearer {api_key}')
+            try:
+                if not quiet:
+                    logger.debug("DEBUG: prompts = %s", request['prompts'])
+
+                if isinstance(response_format, type):			# Pydantic class
+                    response=get_openai_client(api_key).beta.chat.completions.parse(		# Pydantic structure response
+                        model=model,
+                        messages=request['messages'],
+                        response_format=response_format,
+                        temperature=request['data']['temperature'],
+#                    max_completion_tokens=4000,				# <=== distinction max_completion_tokens vs. max_tokens - now obsolete?
+                        )
+                    response_json = response.dict()
+                elif stream:
+                    response = transport.post(request['url'], headers=headers, body=body, timeout=request['timeout'], stream=True)
+                    raise_for_retryable_status(response)
+                    if response.status_code != 200:					# error responses are plain JSON, not a stream
+                        return parse_gpt_response(response.json(), model, prompt_words=request['prompt_words'])
+                    return parse_gpt_stream(response.iter_lines(), model, on_token=on_token, prompt_words=request['prompt_words'])
+                else:
+                    response = transport.post(request['url'], headers=headers, body=body, timeout=request['timeout'])
+                    raise_for_retryable_status(response)		# 429/5xx -> back off (honoring Retry-After), rather than parse an error body
+                    response_json = response.json()
+                if not quiet:
+                    logger.debug("DEBUG: Response = %s", response_json)
+            
+                content = parse_gpt_response(response_json, model, prompt_words=request['prompt_words'])
+                if logprobs:
+                    return content, ((response_json['choices'][0].get('logprobs') or {}).get('content'))
+                return content
+
+            except Exception as e:
+                logger.warning(f"ERROR from {model}: {e}. Trying again...")
+                if is_context_overflow(e):				# our token estimate was too low: truncate harder and retry straight away
+                    note_context_overflow(model)
+                    request, body, n_tokens = prepare_request()
+                    continue
+                backoff(model, attempt, e, max_attempts=config.MAX_GPT_ATTEMPTS)
+    
+    # If all attempts fail
+    logger.error(f"ERROR from {model}: Giving up completely after {config.MAX_GPT_ATTEMPTS} tries (returning NIL)")
+    return ("", None) if logprobs else ""
+
+# Build everything needed for a GPT request: {prompts, messages, model, url, headers, data, timeout}
+# Shared by raw_call_gpt() and the async version in ask_llm_async.py
+def build_gpt_request(prompts0, response_format={"type":"text"}, temperature=0, openai_api_key=config.OPENAI_API_KEY, model=config.DEFAULT_GPT4_MODEL):
 
 #    if isinstance(prompts0, list):
 #        word_counts = [len(s.split()) for s in prompts0]
@@ -352,7 +748,7 @@ def raw_call_gpt(prompts0, response_format={"type":"text"}, temperature=0, opena
         (logger.debug(f"DEBUG: ERROR! Unrecognized prompt format {prompts0}") or None)
     )    
 #   prompts = truncate_prompt(prompts1, truncate_from=8, max_words=max_words(model))   # handle GPT4's 128k token limit
-    prompts = truncate_prompt(prompts1, max_words=max_words(model))   # handle GPT4's 128k token limit    
+    prompts = truncate_prompt(prompts1, max_words=max_prompt_words(model))   # the model's context window, in calibrated words (see utils/models.py)
     first_role = "system" if model in ['gpt4','config.DEFAULT_GPT4_MODEL'] else "assistant"
     messages = convert_to_messages(prompts, model=model, first_role=first_role)
     
@@ -379,82 +775,115 @@ def raw_call_gpt(prompts0, response_format={"type":"text"}, temperature=0, opena
         data['frequency_penalty'] = 0.5
         data['response_format'] = response_format
 
+    if config.PROMPT_CACHING:
+        data['prompt_cache_key'] = get_prompt_cache_key(messages)		# requests for the same dialog share a prompt cache
+
     if is_reasoning_model:
         timeout = config.GPT_REASONING_TIMEOUT
     elif model in ["gpt4.5",config.DEFAULT_GPT45_MODEL]:
         timeout = config.GPT45_TIMEOUT
     else:
         timeout = config.GPT_TIMEOUT
-        
-    for attempt in range(0,config.MAX_GPT_ATTEMPTS):
-        try:
-            if not quiet:
-                logger.debug("DEBUG: prompts = %s", prompts)
-
-            if isinstance(response_format, type):			# Pydantic class
-                if is_reasoning_model:
-                    response=client.beta.chat.completions.parse(		# Pydantic structure response
-                        model=model,
-                        messages=messages,
-                        response_format=response_format,
-                        temperature=temperature1,
-#                        max_completion_tokens=4000,				# <=== distinction max_completion_tokens vs. max_tokens - now obsolete?
-                        )
-                else:                    
-                    response=client.beta.chat.completions.parse(		# Pydantic structure response
-                        model=model,
-                        messages=messages,
-                        response_format=response_format,
-                        temperature=temperature1,
-#                        max_tokens=4000,					# <===
-                        )
-                response_json = response.dict()
-            else:
-                response = requests.post(url, headers=headers, json=data, timeout=timeout)
-                response_json = response.json()
-            if not quiet:
-                logger.debug("DEBUG: Response = %s", response_json)
-            
-            # Check if there's an error in the response
-            if 'error' in response_json:
-                raise ValueError(response_json['error']['message'])
-
-            content = response_json['choices'][0]['message']['content']
-            prompt_tokens = response_json['usage']['prompt_tokens']
-            completion_tokens = response_json['usage']['completion_tokens']
-            total_tokens = response_json['usage']['total_tokens']
-            add_token_counts(model, prompt_tokens, completion_tokens, total_tokens)
-
-            return content
 
-        except Exception as e:
-            logger.warning(f"ERROR from {model}: {e}. Trying again...")
-            time.sleep(1)            
-    
-    # If all attempts fail
-    logger.error(f"ERROR from {model}: Giving up completely after {config.MAX_GPT_ATTEMPTS} tries (returning NIL)")
-    return ""
+    return {'prompts':prompts, 'messages':messages, 'model':model, 'url':url, 'headers':headers, 'data':data, 'timeout':timeout,
+            'is_reasoning_model':is_reasoning_model, 'prompt_words':count_words(prompts)}
+
+# Extract the content from GPT's JSON response (and record the token usage). Raises an exception if it isn't there.
+def parse_gpt_response(response_json, model, prompt_words=None):
+    # Check if there's an error in the response
+    if 'error' in response_json:
+        raise ValueError(response_json['error']['message'])
+
+    content = response_json['choices'][0]['message']['content']
+    prompt_tokens = response_json['usage']['prompt_tokens']
+    completion_tokens = response_json['usage']['completion_tokens']
+    total_tokens = response_json['usage']['total_tokens']
+    add_token_counts(model, prompt_tokens, completion_tokens, total_tokens, cached_tokens=get_cached_tokens(response_json['usage']))
+    record_prompt_tokens(model, prompt_words, prompt_tokens)
+    return content
+
+# Parse GPT's server-sent events ("data: {...}" lines, ending with "data: [DONE]") as they arrive, passing each token to on_token
+def parse_gpt_stream(lines, model, on_token=None, prompt_words=None):
+    pieces = []
+    usage = None
+    with TokenRelay(on_token) as relay:
+        for line in lines:
+            line = line.decode("utf-8") if isinstance(line, bytes) else line		# decode per line, as a chunk boundary could split a UTF-8 character
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            event = json.loads(payload)
+            if 'error' in event:
+                raise ValueError(event['error']['message'])
+            if event.get('usage'):
+                usage = event['usage']
+            for choice in event.get('choices') or []:
+                token = (choice.get('delta') or {}).get('content')
+                if token:
+                    pieces.append(token)
+                    relay(token)
+    if usage:
+        add_token_counts(model, usage['prompt_tokens'], usage['completion_tokens'], usage['total_tokens'], cached_tokens=get_cached_tokens(usage))
+        record_prompt_tokens(model, prompt_words, usage['prompt_tokens'])
+    return ''.join(pieces)
+
+# A simple on_token callback: show the response live on stderr (stdout may be carrying the MCP protocol)
+def print_token(token):
+    sys.stderr.write(token)
+    sys.stderr.flush()
+
+# Passed to on_token when the tokens sent so far are void: the stream failed partway and will be retried (or fall back to
+# another model) from the start, or call_llm_json() is re-querying. It's a str, so printing it shows a notice instead.
+class StreamReset(str):
+    pass
+
+STREAM_RESET = StreamReset("\n[...restarting the answer...]\n")
+
+# The parse_*_stream() functions pass each token on to on_token through this, so that if the stream then fails (the with
+# block raises), on_token is sent STREAM_RESET
+class TokenRelay:
+    def __init__(self, on_token):
+        self.on_token = on_token
+        self.sent = False
+
+    def __call__(self, token):
+        if self.on_token and token:
+            self.sent = True
+            self.on_token(token)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.sent:
+            self.on_token(STREAM_RESET)
+        return False
 
 # ---------- utility ----------
 
-# Courtesy ChatGPT
-def add_token_counts(model, prompt_tokens, completion_tokens, total_tokens):
-    global token_counts  # Ensure we're modifying the global list
-    # Search for an existing entry for the model
-    for entry in token_counts:
-        if entry['model'] == model:
-            # Update existing token counts
-            entry['prompt_tokens'] += prompt_tokens
-            entry['completion_tokens'] += completion_tokens
-            entry['total_tokens'] += total_tokens
-            return
-    # If model not found, append a new entry
-    token_counts.append({
-        'model': model,
-        'prompt_tokens': prompt_tokens,
-        'completion_tokens': completion_tokens,
-        'total_tokens': total_tokens
-    })
+# Called by the parse_* functions with every response's usage (from any thread)
+def add_token_counts(model, prompt_tokens, completion_tokens, total_tokens, cached_tokens=0):
+    with token_counts_lock:
+        token_counts = current_token_counts()
+        entry = token_counts.get(model)
+        if entry is None:
+            entry = token_counts[model] = {'model': model, 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'cached_tokens': 0}
+        entry['prompt_tokens'] += prompt_tokens
+        entry['completion_tokens'] += completion_tokens
+        entry['total_tokens'] += total_tokens
+        entry['cached_tokens'] += cached_tokens
+    record_usage(model, prompt_tokens, completion_tokens, cached_tokens)
+
+# Add token counts from elsewhere (e.g., the execution worker's, see panda_agent/exec_worker.py), without new ledger rows
+def merge_token_counts(entries):
+    with token_counts_lock:
+        token_counts = current_token_counts()
+        for new in entries:
+            entry = token_counts.setdefault(new['model'], {'model': new['model'], 'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0, 'cached_tokens': 0})
+            for key in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'cached_tokens'):
+                entry[key] += new[key]
 
 # ======================================================================
 #      Utility to allow abbreviated response format to be specified
@@ -523,23 +952,40 @@ Example (response_format="json_object"):
 ->  response = '{"capital":"Phoenix", "state":"Arizona"}'                 # a string
     json.loads(response) = {"capital":"Phoenix", "state":"Arizona"}       # a JSON object
 """
-def call_gpt(prompts, response_format={"type":"text"}, temperature=0, cache=True, openai_api_key=config.OPENAI_API_KEY, quiet=True, model=config.DEFAULT_GPT4_MODEL):
+@timed("llm")
+def call_gpt(prompts, response_format={"type":"text"}, temperature=0, cache=True, openai_api_key=None, quiet=True, model=config.DEFAULT_GPT4_MODEL, stream=False, on_token=None):
     
 #   global gpt_calls
+    llm_override = get_llm_override()
+    overridden = llm_override(prompts, model=model, response_format=response_format, temperature=temperature) if llm_override else None
+    if overridden:
+        return overridden[0]
     if cache and temperature == 0:
-        response = cached_call_gpt(convert_to_hashable(prompts), response_format=convert_to_hashable(response_format),
-                                   temperature=temperature, openai_api_key=openai_api_key, quiet=quiet, model=model)	# Lists not directly hashable
+        response = cached_call(lambda: raw_call_gpt(prompts, response_format=response_format, temperature=temperature, openai_api_key=openai_api_key, quiet=quiet, model=model, stream=stream, on_token=on_token),
+                               prompts, model=model, temperature=temperature, response_format=response_format)
     else:
-        response = raw_call_gpt(prompts, response_format=response_format, temperature=temperature, openai_api_key=openai_api_key, quiet=quiet, model=model)
+        response = raw_call_gpt(prompts, response_format=response_format, temperature=temperature, openai_api_key=openai_api_key, quiet=quiet, model=model, stream=stream, on_token=on_token)
 #    gpt_calls += 1        
     return response        
 
-# Apply the lru_cache decorator
+# Look up the persistent cache (utils/llm_cache.py), otherwise compute the answer with raw_call_fn() and store it.
+# Used when a backend (call_gpt, call_olmo) is called directly, rather than via call_llm()
 # To clear the cache:
-#     research_utils.ask_llm.cached_call_gpt.cache_clear()
-@lru_cache() 
-def cached_call_gpt(prompts, response_format, temperature=0, openai_api_key=config.OPENAI_API_KEY, quiet=True, model=config.DEFAULT_GPT4_MODEL):
-    return raw_call_gpt(convert_from_hashable(prompts), response_format=convert_from_hashable(response_format), temperature=temperature, openai_api_key=openai_api_key, quiet=quiet, model=model)
+#     panda.utils.llm_cache.clear_cache()
+def cached_call(raw_call_fn, prompts, model, temperature=0, response_format=None):
+    llm_cache = get_cache()
+    if not llm_cache:
+        return raw_call_fn()
+    cache_key = make_cache_key(prompts, model, temperature, response_format)
+    response = llm_cache.get(cache_key)
+    if response is None:
+        def compute_and_store():
+            response = raw_call_fn()
+            if response:
+                llm_cache.put(cache_key, response, model=model)
+            return response
+        response = single_flight(cache_key, compute_and_store)
+    return response
 
 # ------------------------------
 # Can't hash dicts, only tuples so need to convert
@@ -595,10 +1041,10 @@ def convert_to_messages(input_data, model, first_role="system"):      # first_ro
     role = "assistant"				# just the FIRST message is "system" for GPT
     for i in range(0, len(input_data), 2):
         if i == 0:
-            json_data.append({'role': first_role, 'content': input_data[i]})	# first role may be "user" (LiteLLM) or "system" (GPT)
+            json_data.append(make_message(first_role, input_data[i]))	# first role may be "user" (LiteLLM) or "system" (GPT)
         else:
-            json_data.append({'role': role, 'content': input_data[i]})
-        json_data.append({'role': 'user', 'content': input_data[i+1]})
+            json_data.append(make_message(role, input_data[i]))		# memoized per turn (see utils/dialog.py)
+        json_data.append(make_message('user', input_data[i+1]))
         role = "assistant"    # anything after the first role is "assistant"
     return json_data
 
@@ -683,6 +1129,7 @@ truncate_prompt(list, max_words=4) -> ["...","...is another.","And another."]
 truncate_prompt(list, max_words=8) -> ["...a sentence.","And here is another.","And another."]
 truncate_prompt(list, max_words=12) -> ["Here is a sentence.","And here is another.","And another."]
 """
+@timed("truncate")
 def truncate_prompt(lst, max_words=2, ellipsis="..."):
     """
     Truncate a list of strings so the total number of words is <= max_words.
@@ -696,37 +1143,35 @@ def truncate_prompt(lst, max_words=2, ellipsis="..."):
     Returns:
         list[str]: Truncated list of strings.
     """
-    # Split each string into words
-    split_lines = [line.split() for line in lst]
-    all_words = [w for line in split_lines for w in line]
-
-    # If already within the limit, return unchanged
-    if len(all_words) <= max_words:
+    # If already within the limit, return unchanged (word counts are memoized per turn, so this is cheap)
+    word_counts = [word_count(line) for line in lst]
+    total_words = sum(word_counts)
+    if total_words <= max_words:
         return lst
 
     # Calculate how many words to drop
-    drop_count = len(all_words) - max_words
+    drop_count = total_words - max_words
 
-    # Rebuild lines while dropping from the start
+    # Rebuild lines while dropping from the start. Only the one partially-removed line needs splitting into words.
     result = []
     words_removed = 0
-    for line in split_lines:
-        if words_removed + len(line) <= drop_count:
+    for idx, (line0, n_words) in enumerate(zip(lst, word_counts)):
+        if words_removed + n_words <= drop_count:
             # Entire line is removed
             result.append(ellipsis)
-            words_removed += len(line)
+            words_removed += n_words
         else:
             # Partially remove this line
+            line = line0.split()
             keep_from = drop_count - words_removed
             new_line = " ".join(line[keep_from:])
             if keep_from > 0:
                 new_line = ellipsis + new_line[len(line[keep_from-1]):] if new_line else ellipsis
                 new_line = ellipsis + new_line if not new_line.startswith(ellipsis) else new_line
             result.append(new_line)
-            # Copy the rest of the lines unchanged
-            idx = split_lines.index(line)
-            for rest in split_lines[idx+1:]:
-                result.append(" ".join(rest))
+            # Copy the rest of the lines unchanged (apart from whitespace, as before)
+            for rest in lst[idx+1:]:
+                result.append(join_words(rest))
             break
 
     return result
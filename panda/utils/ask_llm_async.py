@@ -0,0 +1,352 @@
+"""
+Asyncio-native versions of call_llm, call_llm_json and call_llm_multiple_choice.
+These mirror the blocking versions in ask_llm.py (same arguments, same answers, same persistent cache), but
+many requests can be in flight on one event loop, and a host application can embed Panda without blocking its loop.
+
+TEST CASES:
+import asyncio
+from panda.utils.ask_llm_async import acall_llm, acall_llm_json
+asyncio.run(acall_llm("What is 1 + 1?"))
+asyncio.run(acall_llm("What is 1 + 1?", model="gpt-4.1", timeout=30))
+
+# 100 concurrent requests, one thread:
+async def main():
+    return await asyncio.gather(*[acall_llm(f"What is {i} + {i}?") for i in range(100)])
+asyncio.run(main())
+
+CANCELLATION: Cancelling the calling task (or exceeding timeout=) cancels the in-flight HTTP request/LiteLLM call
+immediately - asyncio.CancelledError and asyncio.TimeoutError are never swallowed by the retry loops below.
+"""
+
+import json
+import asyncio
+
+from .normalize import transliterate
+
+from . import config
+from .json_repair import extract_json, count_json
+from .logger import logger, awith_quiet_logging
+from .llm_cache import get_cache, make_cache_key, asingle_flight
+from .transport import get_async_client, aclose_client
+from .rate_limit import await_quota, abackoff, estimate_tokens, raise_for_retryable_status
+from . import ask_llm			# for ask_llm.get_llm_override()
+from .ask_llm import MaxRetriesExceeded, build_gpt_request, parse_gpt_response, build_olmo_request, parse_olmo_response
+from .ask_llm import build_litellm_messages, parse_litellm_response, get_openai_client, get_litellm
+from .ask_llm import one_call_setup, choice_response_format, answer_probability
+from .models import count_words, is_context_overflow, note_context_overflow
+from .ledger import llm_call
+from .key_pool import use_key
+from .resilience import ahedged_call, get_breaker, provider_of, get_fallback_chain
+from .timing import timed
+from panda.panda_agent import config as agent_config
+
+### ======================================================================
+###		ACALL LLM
+### ======================================================================
+
+"""
+async def acall_llm(prompt:str, model:str, temperature:float=0, timeout:float=None):
+Purpose:
+    Async version of call_llm(). timeout (seconds) bounds the whole call, including retries.
+Example:
+    await acall_llm("Generate a new research idea about large language models.")
+"""
+async def acall_llm(prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True, cache=True, timeout=None):
+    with timed("llm"), llm_call(model) as row:	# one row in the usage ledger (see utils/ledger.py)
+        row['answered_by'] = model
+        llm_override = ask_llm.get_llm_override()
+        overridden = llm_override(prompt, model=model, response_format=response_format, temperature=temperature) if llm_override else None
+        if overridden:
+            answer, row['answered_by'] = overridden
+        else:
+            answer = await aledgered_call_llm(row, prompt, response_format=response_format, model=model, temperature=temperature, quiet=quiet, cache=cache, timeout=timeout)
+        row['ok'] = bool(answer)
+    return transliterate(answer)
+
+async def aledgered_call_llm(row, prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True, cache=True, timeout=None):
+    async def dispatch():
+        answer, row['answered_by'] = await adispatch_with_fallback(prompt, response_format=response_format, model=model, temperature=temperature, quiet=quiet)
+        return answer
+
+    if not (cache and temperature == 0) or provider_of(model) == "mock":		# (the mock is never cached, see ask_llm.ledgered_call_llm())
+        return await asyncio.wait_for(dispatch(), timeout) if timeout else await dispatch()
+
+    llm_cache = get_cache()
+    cache_key = make_cache_key(prompt, model, temperature, response_format)
+    if llm_cache:
+        answer = llm_cache.get(cache_key)
+        if answer is not None:
+            row['cache_hit'] = True
+            return answer
+
+    leader = []
+    async def compute_and_store():
+        leader.append(True)
+        answer = await dispatch()
+        if llm_cache and answer and row['answered_by'] == model:	# don't cache failures, unrecognized models, or fallback answers
+            if not answer.startswith("Unrecognized model:"):
+                llm_cache.put(cache_key, answer, model=model)
+        return answer
+
+    coro = asingle_flight(cache_key, compute_and_store)		# identical concurrent calls share one request
+    answer = await asyncio.wait_for(coro, timeout) if timeout else await coro
+    row['coalesced'] = not leader
+    return answer
+
+# Async version of ask_llm.dispatch_with_fallback(): try model, then its fallbacks (config.FALLBACK_MODELS), skipping providers
+# whose circuit breaker is open. The breakers and latency history are shared with the blocking calls. Returns (answer, model that answered).
+async def adispatch_with_fallback(prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True):
+    chain = get_fallback_chain(model)
+    answer = ""
+    for i, model1 in enumerate(chain):
+        breaker = get_breaker(provider_of(model1))
+        if not breaker.allow() and i < len(chain)-1:
+            logger.warning(f"{provider_of(model1)} is failing (circuit breaker open), skipping {model1} and using {chain[i+1]}...")
+            continue
+        answer = await ahedged_call(lambda: adispatch_llm(prompt, response_format=response_format, model=model1, temperature=temperature, quiet=quiet), model1)
+        if answer:
+            breaker.record_success()
+            return answer, model1
+        breaker.record_failure()
+        if i < len(chain)-1:
+            logger.warning(f"No answer from {model1}, falling back to {chain[i+1]}...")
+    return answer, model
+
+# Same routing as ask_llm.dispatch_llm()
+async def adispatch_llm(prompt, response_format={"type":"text"}, model=agent_config.PANDA_LLM, temperature=0, quiet=True):
+    if model == "olmo":
+        answer = await araw_call_olmo(prompt, temperature=temperature, quiet=quiet)
+    elif model == "mock" or model.startswith("mock:"):
+        from .mock_llm import acall_mock
+        answer = await acall_mock(prompt, model=model, response_format=response_format, quiet=quiet)
+    elif model in ["gpt4",config.DEFAULT_GPT4_MODEL]:
+        answer = await araw_call_gpt(prompt, response_format=response_format, temperature=temperature, model=config.DEFAULT_GPT4_MODEL, quiet=quiet)
+    elif model in ["gpt4.5",config.DEFAULT_GPT45_MODEL]:
+        answer = await araw_call_gpt(prompt, response_format=response_format, temperature=temperature, model=config.DEFAULT_GPT45_MODEL, quiet=quiet)
+    elif model.startswith(("o1", "o3", "o4", "gpt")):
+        answer = await araw_call_gpt(prompt, response_format=response_format, temperature=temperature, model=model, quiet=quiet)
+    elif model == "llama":
+        answer = await acall_litellm(prompt, config.LLAMA_MODEL, quiet=quiet)
+    elif model == "mistral":
+        answer = await acall_litellm(prompt, config.MISTRAL_MODEL, quiet=quiet)
+    elif model == "claude":
+        answer = await acall_litellm(prompt, config.DEFAULT_CLAUDE_MODEL, quiet=quiet)
+    elif model == "claude-3.5":
+        answer = await acall_litellm(prompt, config.CLAUDE35_MODEL, quiet=quiet)
+    elif model.startswith(("claude", "llama", "meta", "mistral")):
+        answer = await acall_litellm(prompt, model, quiet=quiet)
+    else:
+        logger.error(f"Unrecognized model: {model}")
+        answer = f"Unrecognized model: {model}"
+    return answer
+
+### ======================================================================
+
+# Async version of call_llm_json()
+async def acall_llm_json(prompt, response_format={"type":"json_object"}, temperature=0, max_retries=3, model=agent_config.PANDA_LLM, timeout=None):
+    for attempt in range(0,max_retries):
+        try:
+            if attempt == 0:
+                response_str = await acall_llm(prompt, temperature=temperature, response_format=response_format, model=model, timeout=timeout)
+            else:
+                extra_advice = "\nPlease respond concisely (your previous answer was too long to process!)\n"
+                if isinstance(prompt, str):
+                    prompt += extra_advice
+                elif isinstance(prompt, list):
+                    prompt = prompt[:-1] + [prompt[-1] + extra_advice]		# a copy: don't change the caller's dialog
+                response_str = await acall_llm(prompt, response_format=response_format, temperature=0.7, model=model, timeout=timeout)	# make sure we get a different answer
+            if attempt > 0:
+                count_json('requeried')
+            return extract_json(response_str)[0], response_str		# repairs near-JSON locally, so only re-query if that fails
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            logger.warning(f"{model} exception {e}. (invalid JSON structure?)....retrying...")
+    else:
+        raise MaxRetriesExceeded("Max retries reached...giving up...")
+
+# Async version of call_llm_multiple_choice(): the single call (with the option's probability, for GPT), then if need be the two-step method
+async def acall_llm_multiple_choice(prompt, options, max_retries=3, model=agent_config.PANDA_LLM, quiet=True, timeout=None, return_probability=False, single_call=None):
+
+    single_call = config.MULTIPLE_CHOICE_SINGLE_CALL if single_call is None else single_call
+    if single_call:
+        answer, probability = await achoose_in_one_call(prompt, options, model=model, max_retries=max_retries, timeout=timeout)
+        if answer is not None:
+            return (answer, probability) if return_probability else answer
+        logger.warning(f"Couldn't get a valid choice from {model} in one call, trying the two-step method...")
+
+    prompt += f" (Your answer options are {options})"
+
+    if model not in ['gpt4',config.DEFAULT_GPT4_MODEL]:			# For non-GPT, we need to split QA and JSON building separately (see multiple_choice_issue.txt)
+        response = await acall_llm(prompt, model=model, timeout=timeout)
+        json_prompt = f'Now summarize the last response as a JSON object with the following stucture {{"answer":CHOICE}}, where CHOICE is exactly one of {options}'
+        dialog = [prompt, response, json_prompt]
+    else:
+        dialog = prompt + f'\nReturn your answer as a JSON object with the following stucture {{"answer":CHOICE}}, where CHOICE is exactly one of {options}'
+
+    for attempt in range(0,max_retries):
+        try:
+            if attempt == 0:
+                response,_ = await acall_llm_json(dialog, model='gpt4', timeout=timeout)
+            else:
+                response,_ = await acall_llm_json(dialog, temperature=0.7, model='gpt4', timeout=timeout)
+            if 'answer' not in response:
+                logger.warning(f"Yikes! No 'answer' field in GPT response {response}....Trying again...")
+            else:
+                answer = response['answer']
+                if answer in options:
+                    return (answer, None) if return_probability else answer
+                else:
+                    logger.warning(f"Yikes! GPT gave answer '{answer}' but that isn't one of the options {options}!. Trying again...")
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            logger.warning(f"GPT exception {e}. (invalid JSON structure?)....retrying...")
+    else:
+        raise MaxRetriesExceeded("Max retries reached...giving up...")
+
+# Async version of choose_in_one_call(). Returns (answer, probability), or (None, None) if no valid choice was returned.
+async def achoose_in_one_call(prompt, options, model=agent_config.PANDA_LLM, max_retries=3, timeout=None):
+    mc_prompt, model1, enum_type = one_call_setup(prompt, options, model)
+
+    if model1.startswith(("o1", "o3", "o4", "gpt")) and enum_type and not ask_llm.get_llm_override():	# (ascore_multiple_choice() bypasses acall_llm(), and so any override)
+        for attempt in range(0,max_retries):
+            answer, probability = await asyncio.wait_for(ascore_multiple_choice(mc_prompt, options, model1, enum_type, temperature=0 if attempt == 0 else 0.7), timeout)
+            if answer in options:
+                return answer, probability
+            logger.warning(f"Yikes! {model1} gave answer '{answer}' but that isn't one of the options {options}!. Trying again...")
+    else:
+        for attempt in range(0,max_retries):
+            try:
+                response,_ = await acall_llm_json(mc_prompt, model=model, temperature=0 if attempt == 0 else 0.7, timeout=timeout)
+                answer = response.get('answer') if isinstance(response, dict) else None
+                if answer in options:
+                    return answer, None
+                logger.warning(f"Yikes! {model} gave answer '{answer}' but that isn't one of the options {options}!. Trying again...")
+            except asyncio.TimeoutError:
+                raise
+            except Exception as e:
+                logger.warning(f"{model} exception {e}. (invalid JSON structure?)....retrying...")
+    return None, None
+
+# Async version of score_multiple_choice(): one GPT call, with the answer constrained to options. Same cache entries.
+async def ascore_multiple_choice(prompt, options, model, enum_type="string", temperature=0):
+    response_format = choice_response_format(options, enum_type)
+
+    async def compute():
+        content, logprobs = await araw_call_gpt(prompt, response_format=response_format, temperature=temperature, model=model, logprobs=True)
+        try:
+            answer = extract_json(content)[0].get('answer')
+        except (ValueError, AttributeError):
+            return None, None
+        return answer, answer_probability(logprobs, answer)
+
+    llm_cache = get_cache() if temperature == 0 else None
+    if not llm_cache:
+        return await compute()
+    cache_key = make_cache_key(prompt, model, temperature, dict(response_format, logprobs=True))
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        result = json.loads(cached)
+        return result['answer'], result['probability']
+    async def compute_and_store():
+        answer, probability = await compute()
+        if answer in options:
+            llm_cache.put(cache_key, json.dumps({'answer':answer, 'probability':probability}), model=model)
+        return answer, probability
+    return await asingle_flight(cache_key, compute_and_store)
+
+### ======================================================================
+###		BACKENDS
+### ======================================================================
+
+async def araw_call_olmo(prompt, temperature=0, inferd_token=config.INFERD_TOKEN, quiet=True):
+    url, headers, data = build_olmo_request(prompt, temperature=temperature, inferd_token=inferd_token)
+    body = json.dumps(data).encode("utf-8")
+    for attempt in range(0,config.MAX_OLMO_ATTEMPTS):
+        await await_quota("olmo", len(prompt) // 4)
+        try:
+            response = await get_async_client().post(url, headers=headers, content=body, timeout=config.OLMO_TIMEOUT)
+            raise_for_retryable_status(response)
+            return parse_olmo_response(response.text)
+        except Exception as e:
+            logger.warning(f"ERROR from OLMo: {e}. Trying again...")
+            await abackoff("olmo", attempt, e, max_attempts=config.MAX_OLMO_ATTEMPTS)
+    logger.error(f"ERROR from OLMo: Giving up completely after {config.MAX_OLMO_ATTEMPTS} tries (returning NIL)")
+    return ""
+
+# ----------
+
+async def acall_litellm(prompts0, model=config.DEFAULT_CLAUDE_MODEL, quiet=True):
+    prompts, messages = build_litellm_messages(prompts0, model)
+    n_tokens = estimate_tokens(messages)
+    prompt_words = count_words(prompts)
+    for attempt in range(0,config.MAX_LITELLM_ATTEMPTS):
+        await await_quota(model, n_tokens)
+        with use_key(provider_of(model)) as api_key:		# one of a pool of keys (see utils/key_pool.py)
+            key_args = {'api_key': api_key} if api_key else {}
+            try:
+                if not quiet:
+                    logger.debug("DEBUG: prompts = %s", prompts)
+                response = await awith_quiet_logging(get_litellm().acompletion, model=model, messages=messages, **key_args)
+                content = parse_litellm_response(response, model, prompt_words=prompt_words)
+                if content:
+                    return content
+                else:
+                    logger.warning(f"Not getting the right response structure from {model}. Trying again...")
+                    await abackoff(model, attempt, max_attempts=config.MAX_LITELLM_ATTEMPTS)
+            except Exception as e:
+                logger.warning(f"ERROR from {model}: {e}. Trying again...")
+                if is_context_overflow(e):				# truncate harder and retry straight away (see utils/models.py)
+                    note_context_overflow(model)
+                    prompts, messages = build_litellm_messages(prompts0, model)
+                    n_tokens, prompt_words = estimate_tokens(messages), count_words(prompts)
+                    continue
+                await abackoff(model, attempt, e, max_attempts=config.MAX_LITELLM_ATTEMPTS)
+    logger.error(f"ERROR from {model}: Giving up completely after {config.MAX_LITELLM_ATTEMPTS} tries (returning '')")
+    return ""
+
+# ----------
+
+# logprobs=True: return (content, logprobs), as raw_call_gpt() does
+async def araw_call_gpt(prompts0, response_format={"type":"text"}, temperature=0, openai_api_key=None, quiet=True, model=config.DEFAULT_GPT4_MODEL, logprobs=False):
+
+    def prepare_request():
+        request = build_gpt_request(prompts0, response_format=response_format, temperature=temperature, openai_api_key=openai_api_key, model=model0)
+        if logprobs and not request['is_reasoning_model']:			# reasoning models don't return logprobs
+            request['data'] = dict(request['data'], logprobs=True)
+        body = None if isinstance(response_format, type) else json.dumps(request['data']).encode("utf-8")
+        return request, body, estimate_tokens(request['messages'])
+
+    model0 = model
+    request, body, n_tokens = prepare_request()
+    model = request['model']
+
+    for attempt in range(0,config.MAX_GPT_ATTEMPTS):
+        await await_quota(model, n_tokens)
+        with use_key("openai", openai_api_key) as api_key:		# one of a pool of keys (see utils/key_pool.py)
+            headers = dict(request['headers'], Authorization=f'Bearer {api_key}')
+            try:
+                if isinstance(response_format, type):			# Pydantic class: no async structured-output parser, so run the blocking one in a worker thread
+                    response = await asyncio.get_running_loop().run_in_executor(None, lambda: get_openai_client(api_key).beta.chat.completions.parse(
+                        model=model, messages=request['messages'], response_format=response_format, temperature=request['data']['temperature']))
+                    response_json = response.dict()
+                else:
+                    response = await get_async_client().post(request['url'], headers=headers, content=body, timeout=request['timeout'])
+                    raise_for_retryable_status(response)
+                    response_json = response.json()
+                if not quiet:
+                    logger.debug("DEBUG: Response = %s", response_json)
+                content = parse_gpt_response(response_json, model, prompt_words=request['prompt_words'])
+                if logprobs:
+                    return content, ((response_json['choices'][0].get('logprobs') or {}).get('content'))
+                return content
+            except Exception as e:
+                logger.warning(f"ERROR from {model}: {e}. Trying again...")
+                if is_context_overflow(e):				# truncate harder and retry straight away (see utils/models.py)
+                    note_context_overflow(model)
+                    request, body, n_tokens = prepare_request()
+                    continue
+                await abackoff(model, attempt, e, max_attempts=config.MAX_GPT_ATTEMPTS)
+    logger.error(f"ERROR from {model}: Giving up completely after {config.MAX_GPT_ATTEMPTS} tries (returning NIL)")
+    return ("", None) if logprobs else ""
@@ -1,13 +1,19 @@
 
 import os
 import sys
+import json
 
 doc = {}
 
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# A single key, or the first of a pool of keys, e.g., OPENAI_API_KEYS="sk-a,sk-b,sk-c" (see utils/key_pool.py)
+def first_key(name):
+    return os.environ.get(name) or (os.environ.get(name + "S") or "").split(",")[0].strip() or None
+
+OPENAI_API_KEY = first_key("OPENAI_API_KEY")
 # for the below two, as we use LiteLLM, we only need the values to check they exist, but they're not used in the code directly
-TOGETHER_API_KEY = os.environ.get("TOGETHER_API_KEY")
-ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
+# (unless there's a pool of keys, which are passed to LiteLLM one per request)
+TOGETHER_API_KEY = first_key("TOGETHER_API_KEY")
+ANTHROPIC_API_KEY = first_key("ANTHROPIC_API_KEY")
 
 # Go to inferd.allen.ai to renew INFERD token
 INFERD_TOKEN = os.environ.get("INFERD_TOKEN")
@@ -25,7 +31,7 @@ if ANTHROPIC_API_KEY is None:
     print("Please set your ANTHROPIC_API_KEY environment varaiable if you want to use Clude!", file=sys.stderr)    
 
 # keys and models
-OAI_ENDPOINT = "https://api.openai.com/v1/chat/completions"
+OAI_ENDPOINT = os.environ.get("PANDA_OAI_ENDPOINT", "https://api.openai.com/v1/chat/completions")	# e.g., a local utils/mock_server.py
 
 #OLMO_ENDPOINT = 'https://ai2-reviz--olmoe-1b-7b-0924-instruct.modal.run/completion'  # updated 10/16/24
 #OLMO_ENDPOINT = "https://inferd.allen.ai/api/v1/infer"
@@ -57,6 +63,7 @@ MAX_GPT_ATTEMPTS = 3
 MAX_OLMO_ATTEMPTS = 3
 MAX_TOGETHER_ATTEMPTS = 6    # Llama can be a bit more flakey
 MAX_LITELLM_ATTEMPTS = 3
+MAX_MOCK_ATTEMPTS = 3
 
 TOGETHER_TIMEOUT = 30
 OLMO_TIMEOUT = 60
@@ -64,5 +71,72 @@ GPT_TIMEOUT = 300
 GPT45_TIMEOUT = 300
 GPT_REASONING_TIMEOUT = 600
 
+# Provider prompt caching of the (ever-growing) dialog prefix: Anthropic cache_control breakpoints, OpenAI prompt_cache_key
+# (see ask_llm.add_cache_breakpoints). Set PANDA_PROMPT_CACHING=0 for a provider/proxy that rejects these fields.
+PROMPT_CACHING = os.environ.get("PANDA_PROMPT_CACHING", "1") not in ["0", "false", "False", "no"]
+
+# Prompt truncation to each model's context window (see utils/models.py for the registry of context windows)
+DEFAULT_TOKENS_PER_WORD = 2.0		# until calibrated from real usage: Panda's code/JSON-heavy dialogs tokenize at ~1.5-2 tokens/word
+TOKEN_ESTIMATE_MARGIN = 0.1		# truncate to 10% below the estimated budget
+TOKEN_RATIO_EMA = 0.3			# weight of each new observation in the calibrated tokens-per-word ratio
+MIN_CALIBRATION_WORDS = 200		# don't calibrate from tiny prompts (dominated by per-message overhead)
+CONTEXT_OVERFLOW_BUMP = 1.25		# if a prompt is still too long, raise the model's ratio by this factor and retry
+OUTPUT_TOKEN_RESERVE = 16384		# leave room for the answer (or the model's max output, if smaller)
+PROMPT_TOKEN_CAP = int(os.environ.get("PANDA_PROMPT_TOKEN_CAP", 180000))	# even for 1M-token models: long prompts are slow and costly
+# Prices for models not in utils/models.py PRICES (USD per million tokens), e.g., '{"my-model": {"input": 1, "cached_input": 0.5, "output": 4}}'
+MODEL_PRICES = json.loads(os.environ.get("PANDA_MODEL_PRICES", "{}"))
+
+# The offline "mock" model family (see utils/mock_llm.py and utils/mock_server.py). Env vars take JSON, e.g.,
+#   PANDA_MOCK_LATENCY='{"dist": "lognormal", "median": 2.0, "sigma": 0.5}'  PANDA_MOCK_ERRORS='{"rate_limit": 0.05, "malformed_json": 0.1}'
+MOCK_LATENCY = json.loads(os.environ.get("PANDA_MOCK_LATENCY", '{"dist": "fixed", "seconds": 0}'))
+MOCK_ERRORS = json.loads(os.environ.get("PANDA_MOCK_ERRORS", "{}"))	# per-attempt probabilities of rate_limit, server_error, timeout, malformed_json
+MOCK_TIMEOUT = 1.0			# an injected timeout takes this long (seconds) to fail
+MOCK_RETRY_AFTER = 1.0			# the Retry-After of an injected 429
+MOCK_SCRIPT = os.environ.get("PANDA_MOCK_SCRIPT")	# scripted responses for model "mock" (see utils/mock_llm.py)
+MOCK_SEED = os.environ.get("PANDA_MOCK_SEED")		# for repeatable latencies and errors
+MOCK_PLAN_STEPS = int(os.environ.get("PANDA_MOCK_PLAN_STEPS", 2))	# steps in the rule-based agent's plan (2 iterations each, plus 3 to plan)
+MOCK_ACTION = os.environ.get("PANDA_MOCK_ACTION", 'print("Mock step {step} done")')	# the code the rule-based agent runs at each step
+
+# call_llm_multiple_choice(): pick the option in one LLM call (True), or the older free-form answer + GPT-to-JSON conversion (False)
+MULTIPLE_CHOICE_SINGLE_CALL = True
+
+# Rate limits and retries (see utils/rate_limit.py). RATE_LIMITS maps a model name to its quota, e.g.,
+#   {"gpt-4.1": {"rpm": 500, "tpm": 30000}, "claude-sonnet-4-5-20250929": {"rpm": 50, "tpm": 40000}}
+# Models not listed are not throttled. Override with PANDA_RATE_LIMITS='{"gpt-4.1": {"rpm": 500}}'
+RATE_LIMITS = json.loads(os.environ.get("PANDA_RATE_LIMITS", "{}"))
+RETRY_BASE_DELAY = 1.0			# seconds; exponential backoff with full jitter: random in [0, RETRY_BASE_DELAY * 2^attempt]
+RETRY_MAX_DELAY = 60.0			# never wait longer than this between retries, even if the server's Retry-After says so
+
+# Hedged requests, fallbacks and circuit breakers (see utils/resilience.py)
+HEDGE_REQUESTS = os.environ.get("PANDA_HEDGE_REQUESTS", "0") in ["1", "true", "True", "yes"]	# off by default: a hedge costs a second request
+HEDGE_MIN_SAMPLES = 20			# need this many past latencies for a model before hedging its calls
+HEDGE_LATENCY_WINDOW = 200		# p95 is computed over this many recent calls
+HEDGE_MIN_DELAY = 5.0			# never hedge sooner than this (seconds)
+HEDGE_MAX_WORKERS = 64
+# If a model fails completely, try these instead, e.g., {"claude-sonnet-4-6": ["gpt-4.1"]}. Override with PANDA_FALLBACK_MODELS='{...}'
+FALLBACK_MODELS = json.loads(os.environ.get("PANDA_FALLBACK_MODELS", "{}"))
+CIRCUIT_BREAKER_THRESHOLD = 3		# consecutive failed calls before a provider is skipped...
+CIRCUIT_BREAKER_COOLDOWN = 60.0		# ...for this many seconds
+
+# Pools of API keys per provider (see utils/key_pool.py): <PROVIDER>_API_KEYS="key1,key2,..." (e.g., OPENAI_API_KEYS,
+# ANTHROPIC_API_KEYS, TOGETHER_API_KEYS), or a JSON file {"openai": ["key1", "key2"], "anthropic": [...]} named by PANDA_API_KEYS_FILE
+API_KEYS_FILE = os.environ.get("PANDA_API_KEYS_FILE")
+KEY_SELECTION = os.environ.get("PANDA_KEY_SELECTION", "least_loaded")	# or "round_robin"
+KEY_COOLDOWN = 20.0			# after a 429 without a Retry-After, rest that key for this many seconds
+
+# Keep-alive connection pools for the raw backends (see utils/transport.py)
+HTTP_POOL_MAXSIZE = 32			# max connections per host
+HTTP_PREWARM = True			# open the LLM endpoint's connection in the background at the start of run_panda()
+
+# Connection pool for the async client (utils/ask_llm_async.py), shared by all requests on one event loop
+ASYNC_MAX_CONNECTIONS = 200
+ASYNC_MAX_KEEPALIVE_CONNECTIONS = 50
+
+# Persistent on-disk cache of LLM responses (see utils/llm_cache.py). Set PANDA_LLM_CACHE=0 to switch it off.
+LLM_CACHE_ENABLED = os.environ.get("PANDA_LLM_CACHE", "1") not in ["0", "false", "False", "no"]
+LLM_CACHE_FILE = os.environ.get("PANDA_LLM_CACHE_FILE", os.path.join(os.path.expanduser("~"), ".cache", "panda", "llm_cache.sqlite"))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("PANDA_LLM_CACHE_MAX_BYTES", 512 * 1024 * 1024))	# 512MB
+LLM_CACHE_TOUCH_AFTER = 600		# seconds: a hit only updates the entry's last access time (a write) if it's older than this
+
     
 
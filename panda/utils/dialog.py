@@ -0,0 +1,160 @@
+"""
+Dialog: the conversation with the LLM (e.g., my_globals.dialog_so_far), a list of strings [system+task, response, prompt, response, ...]
+
+A Dialog is a plain list (so all the existing list code - append, +=, +, indexing, json.dumps - still works), that also
+remembers things that are otherwise recomputed from scratch for the *whole* dialog on every LLM call:
+ - the word count of each turn (for truncate_prompt())
+ - the {'role':..,'content':..} message dict for each turn (for convert_to_messages())
+ - a rolling hash of every prefix of the dialog, so the cache key of a dialog that just grew by one turn
+   costs one small hash rather than re-serializing everything (for llm_cache.make_cache_key())
+So the per-call overhead no longer grows with the length of the run.
+
+The per-turn memos (word_count, make_message, text_hash) are keyed by the turn's text, so plain lists benefit from
+them too, and the hash of a Dialog is identical to the hash of a plain list with the same contents.
+
+USAGE:
+dialog = Dialog(["You are a helpful assistant.", "Hi"])
+dialog.append("Hello! How can I help?")
+dialog.total_words()   -> 10
+dialog.prefix_hash()   -> 'a3f1...'   (== dialog_hash(list(dialog)))
+"""
+
+import json
+import hashlib
+from functools import lru_cache
+
+MEMO_SIZE = 16384		# turns remembered by the per-turn memos (a 200-iteration run has ~400 turns)
+
+### ======================================================================
+###		PER-TURN MEMOS
+### ======================================================================
+
+@lru_cache(maxsize=MEMO_SIZE)
+def word_count(text):
+    return len(text.split())
+
+# " ".join(text.split()), i.e., text with all whitespace runs collapsed to one space
+@lru_cache(maxsize=MEMO_SIZE)
+def join_words(text):
+    return " ".join(text.split())
+
+# The message dicts are shared between calls, so don't change them (copy first, as add_cache_breakpoints() does)
+@lru_cache(maxsize=MEMO_SIZE)
+def make_message(role, content):
+    return {'role': role, 'content': content}
+
+# Windows vs. Unix newlines don't matter (same as llm_cache.normalize_prompt())
+@lru_cache(maxsize=MEMO_SIZE)
+def text_hash(text):
+    return hashlib.sha256(text.replace("\r\n", "\n").encode("utf-8")).digest()
+
+def item_hash(item):
+    if isinstance(item, str):
+        return text_hash(item)
+    return hashlib.sha256(json.dumps(item, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).digest()	# e.g., a message dict
+
+### ======================================================================
+###		ROLLING HASH
+### ======================================================================
+
+EMPTY_HASH = hashlib.sha256(b"").digest()
+
+def extend_hash(prefix_hash, item):
+    return hashlib.sha256(prefix_hash + item_hash(item)).digest()
+
+# Hash of a prompt (a string, a list, or a Dialog) - O(1) for a Dialog that was just extended
+def dialog_hash(prompt):
+    if isinstance(prompt, Dialog):
+        return prompt.prefix_hash()
+    if isinstance(prompt, str):
+        prompt = [prompt]
+    h = EMPTY_HASH
+    for item in prompt:
+        h = extend_hash(h, item)
+    return h.hex()
+
+### ======================================================================
+###		DIALOG
+### ======================================================================
+
+class Dialog(list):
+    """A list of dialog turns that keeps the rolling hashes of its prefixes (see module docstring)"""
+
+    def __init__(self, turns=()):
+        super().__init__(turns)
+        self._hashes = [EMPTY_HASH]		# _hashes[i] = hash of the first i turns (computed lazily)
+
+    def prefix_hash(self, n=None):
+        n = len(self) if n is None else n
+        while len(self._hashes) <= n:
+            self._hashes.append(extend_hash(self._hashes[-1], self[len(self._hashes)-1]))
+        return self._hashes[n].hex()
+
+    def word_counts(self):
+        return [word_count(turn) if isinstance(turn, str) else 0 for turn in self]
+
+    def total_words(self):
+        return sum(self.word_counts())
+
+    # ---------- copies keep the prefix hashes computed so far ----------
+
+    def copy(self):
+        new = Dialog(self)
+        new._hashes = self._hashes[:len(self)+1]
+        return new
+
+    def __add__(self, other):
+        new = self.copy()
+        new.extend(other)
+        return new
+
+    def __getitem__(self, index):
+        result = super().__getitem__(index)
+        if isinstance(index, slice):
+            result = Dialog(result)
+            if index.start in (None, 0) and index.step in (None, 1):		# a prefix: reuse its hashes
+                result._hashes = self._hashes[:len(result)+1]
+        return result
+
+    # ---------- appending keeps the prefix hashes valid, anything else invalidates them ----------
+
+    def _invalidate(self):
+        self._hashes = [EMPTY_HASH]
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._invalidate()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._invalidate()
+
+    def insert(self, index, value):
+        super().insert(index, value)
+        self._invalidate()
+
+    def pop(self, index=-1):
+        value = super().pop(index)
+        self._invalidate()
+        return value
+
+    def remove(self, value):
+        super().remove(value)
+        self._invalidate()
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._invalidate()
+
+    def reverse(self):
+        super().reverse()
+        self._invalidate()
+
+    def __imul__(self, n):
+        result = super().__imul__(n)
+        self._invalidate()
+        return result
@@ -0,0 +1,282 @@
+"""
+Fast JSON extraction from LLM responses, with a local repair stage, so that call_llm_json() only has to re-query
+the LLM when the response really is unusable.
+
+extract_json(text) tries, in order:
+  1. strict parsing of the likely candidates: a ```json fenced block, the whole response, then each balanced {...}/[...]
+     span (found in a single pass that skips over brackets inside strings)
+  2. repair_json() on the first JSON-looking part of the response, which fixes the usual LLM slips:
+       - trailing commas                          {"a": 1,}                 -> {"a": 1}
+       - raw newlines/tabs inside strings         "print(1)<newline>x = 2"  -> "print(1)\\nx = 2"
+       - unescaped quotes and bad escapes         "print("hi")", "\\d+"     -> "print(\\"hi\\")", "\\\\d+"
+       - Python literals and single quotes        {'ok': True, 'x': None}   -> {"ok": true, "x": null}
+       - a response that was cut off              {"action": "py(\\"x = [1,  -> {"action": "py(\\"x = [1,"}
+Uses orjson (pip install orjson) if it's installed, otherwise the standard json module.
+
+USAGE:
+panda.utils.json_repair.extract_json('Sure! {"a": 1, "b": [1,2,],}')  -> ({'a': 1, 'b': [1, 2]}, 'repaired')
+panda.utils.get_json_stats()   -> {'parsed': 120, 'repaired': 7, 'requeried': 1, 'failed': 1}
+"""
+
+import re
+import json
+import threading
+
+from .timing import timed
+
+try:
+    import orjson			# optional: several times faster than json on the large agent responses
+except ImportError:
+    orjson = None
+
+# Telemetry: how call_llm_json() responses got parsed. 'requeried' = we had to ask the LLM again.
+json_stats = {'parsed': 0, 'repaired': 0, 'requeried': 0, 'failed': 0}
+_json_stats_lock = threading.Lock()		# calls run concurrently (threaded runs, hedges, single-flight)
+
+def count_json(name):
+    with _json_stats_lock:
+        json_stats[name] += 1
+
+def get_json_stats():
+    with _json_stats_lock:
+        return dict(json_stats)
+
+def reset_json_stats():
+    with _json_stats_lock:
+        for key in json_stats:
+            json_stats[key] = 0
+
+def loads(text):
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass			# json.loads is a bit more lenient (e.g., NaN), so give it a go too
+    return json.loads(text)
+
+### ======================================================================
+###		EXTRACTION
+### ======================================================================
+
+FENCE_PATTERN = re.compile(r'```(?:json)?\s*\n(.*?)\n\s*```', re.DOTALL | re.IGNORECASE)
+OPEN_FENCE_PATTERN = re.compile(r'```(?:json)?\s*\n', re.IGNORECASE)
+MAX_SPANS = 20
+
+# Returns (json_object, how) where how is "parsed" or "repaired". Raises ValueError if there's no usable JSON.
+@timed("json")
+def extract_json(text):
+    if not text or not text.strip():
+        count_json('failed')
+        raise ValueError("Empty response")
+
+    for candidate in iter_candidates(text):
+        try:
+            result = loads(candidate)
+            count_json('parsed')
+            return result, "parsed"
+        except ValueError:
+            continue
+
+    fence = OPEN_FENCE_PATTERN.search(text)		# fenced block, possibly with no closing fence (truncated)
+    body = text[fence.end():] if fence else text
+    for opener in "{[":
+        start = body.find(opener)
+        if start == -1:
+            continue
+        try:
+            result = loads(repair_json(body[start:]))
+            count_json('repaired')
+            return result, "repaired"
+        except ValueError:
+            continue
+
+    count_json('failed')
+    raise ValueError(f"No valid JSON found in response: {text[:200]!r}")
+
+def iter_candidates(text):
+    for match in FENCE_PATTERN.findall(text):
+        yield match.strip()
+    yield text.strip()
+    for i, span in enumerate(balanced_spans(text)):
+        if i >= MAX_SPANS:
+            break
+        yield span
+
+# Yield each top-level {...} or [...] span, left to right, in one pass. Brackets inside "strings" are ignored.
+def balanced_spans(text):
+    n = len(text)
+    i = 0
+    while i < n:
+        ch = text[i]
+        if ch not in "{[":
+            i += 1
+            continue
+        start = i
+        depth = 0
+        in_string = False
+        while i < n:
+            ch = text[i]
+            if in_string:
+                if ch == '\\':
+                    i += 1			# skip the escaped character
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch in "{[":
+                depth += 1
+            elif ch in "}]":
+                depth -= 1
+                if depth == 0:
+                    yield text[start:i+1]
+                    break
+            i += 1
+        else:
+            return			# unbalanced to the end of the text (truncated?) - that's for repair_json()
+        i += 1
+
+### ======================================================================
+###		REPAIR
+### ======================================================================
+
+VALID_ESCAPES = '"\\/bfnrt'
+CLOSERS = {'{': '}', '[': ']'}
+PYTHON_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+VALUE_STARTS = '"\'{[]}-0123456789'
+HEX_DIGITS = set('0123456789abcdefABCDEF')
+
+# Rewrite almost-JSON (starting at its opening { or [) as valid JSON. Text after the closing bracket is dropped.
+def repair_json(text):
+    out = []
+    stack = []				# open brackets
+    quote = None			# the quote character of the string we're in (None = not in a string)
+    last_string_start = None		# index in out of the most recent string (to spot a key cut off before its value)
+    in_key = False			# is the current string an object key (rather than a value)?
+    last_was_string = False
+    n = len(text)
+    i = 0
+    while i < n:
+        ch = text[i]
+
+        if quote:								# ---- inside a string ----
+            if ch == '\\':
+                nxt = text[i+1] if i+1 < n else ''
+                if nxt and nxt in VALID_ESCAPES:
+                    out.append(ch + nxt)
+                    i += 2
+                elif nxt == 'u' and set(text[i+2:i+6]) <= HEX_DIGITS and len(text[i+2:i+6]) == 4:
+                    out.append(text[i:i+6])
+                    i += 6
+                elif nxt == "'":
+                    out.append("'")
+                    i += 2
+                else:
+                    out.append('\\\\')			# a lone backslash, e.g., a regex "\d+"
+                    i += 1
+                continue
+            if ch == quote:
+                if _is_string_end(text, i+1, in_key):
+                    out.append('"')
+                    quote = None
+                    last_was_string = True
+                else:
+                    out.append('\\"')
+            elif ch == '"':
+                out.append('\\"')				# a double quote inside a 'single-quoted' string
+            elif ch == '\n':
+                out.append('\\n')
+            elif ch == '\r':
+                out.append('\\r')
+            elif ch == '\t':
+                out.append('\\t')
+            elif ord(ch) < 0x20:
+                out.append('\\u%04x' % ord(ch))
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        # ---- outside a string ----
+        if ch in ' \t\r\n':
+            out.append(ch)
+            i += 1
+            continue
+        last_was_string = False
+        if ch in '"\'':
+            quote = ch
+            last_string_start = len(out)
+            in_key = bool(stack) and stack[-1] == '{' and _is_key(out, last_string_start)
+            out.append('"')
+        elif ch in '{[':
+            stack.append(ch)
+            out.append(ch)
+        elif ch in '}]':
+            _drop_trailing_comma(out)
+            if not stack:
+                break
+            out.append(CLOSERS[stack.pop()])		# trust the nesting over a mismatched closer
+            if not stack:
+                break				# done: ignore any text after the JSON
+        elif ch.isalpha() or ch == '_':
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == '_'):
+                j += 1
+            word = text[i:j]
+            out.append(PYTHON_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # ---- truncated? close whatever is still open ----
+    if quote:
+        out.append('"')
+        last_was_string = True
+    if stack:
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ':':
+            out.append(' null')					# {"a": <cut off>
+        elif last_was_string and stack[-1] == '{' and _is_key(out, last_string_start):
+            out.append(': null')					# {"a": 1, "b<cut off>
+        _drop_trailing_comma(out)
+        for opener in reversed(stack):
+            out.append(CLOSERS[opener])
+    return ''.join(out)
+
+# Is the quote just before text[i] really the end of the string, or an unescaped quote inside it (e.g., in code)?
+# A key is followed by ':'. A value is followed by ',' and then another value/key, or by } or ] and then , } ] or the end.
+def _is_string_end(text, i, in_key):
+    i = _skip_space(text, i)
+    if i >= len(text):
+        return True
+    if in_key:
+        return text[i] == ':'
+    if text[i] == ',':
+        j = _skip_space(text, i+1)
+        return j >= len(text) or text[j] in VALUE_STARTS or text.startswith(("true", "false", "null"), j)
+    if text[i] in '}]':
+        j = _skip_space(text, i+1)
+        return j >= len(text) or text[j] in ',}]`'
+    return False
+
+def _skip_space(text, i):
+    while i < len(text) and text[i] in ' \t\r\n':
+        i += 1
+    return i
+
+def _drop_trailing_comma(out):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+# Is the string starting at out[string_start] in a key position, i.e., straight after { or , ?
+def _is_key(out, string_start):
+    if string_start is None:
+        return False
+    k = string_start - 1
+    while k >= 0 and out[k].isspace():
+        k -= 1
+    return k >= 0 and out[k] in '{,'
@@ -0,0 +1,190 @@
+"""
+Pools of API keys per provider, so bulk calls (e.g., many runs in threads, or MCP jobs) aren't capped by one key's rate limit.
+
+Keys come from (first found, per provider):
+ - the JSON file config.API_KEYS_FILE (env PANDA_API_KEYS_FILE): {"openai": ["sk-a", "sk-b"], "anthropic": [...], "together": [...]}
+ - <PROVIDER>_API_KEYS, comma-separated, e.g., OPENAI_API_KEYS="sk-a,sk-b,sk-c"
+ - the single <PROVIDER>_API_KEY, e.g., OPENAI_API_KEY - a pool of one, which behaves just as before
+
+Each request takes a key from its provider's pool ("with use_key('openai') as key:"), either the key with the fewest
+requests in flight ("least_loaded") or the next one in turn ("round_robin"), see config.KEY_SELECTION. A 429 rests just
+that key (for the server's Retry-After, else config.KEY_COOLDOWN seconds) and the retry goes straight to another key;
+only when every key is resting does the model back off as a whole (see rate_limit.backoff). The per-model quotas in
+config.RATE_LIMITS are per key, so rate_limit.get_limiter() multiplies them by the size of the pool.
+
+Each key's usage (requests, 429s, tokens, cost) is in get_key_stats(), and the key used is in each usage ledger row
+('api_key'). Keys are only ever shown by their label, e.g., "openai#2 (...x7Qa)".
+
+USAGE:
+panda.utils.key_pool.get_key_stats()
+-> {'openai': [{'key': 'openai#1 (...x7Qa)', 'requests': 212, 'in_flight': 3, 'rate_limited': 2, 'resting': 0.0,
+                'prompt_tokens': 401233, 'completion_tokens': 30122, 'cached_tokens': 0, 'cost': 1.04}, ...]}
+"""
+
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from . import config
+from .logger import logger
+
+ENV_NAMES = {'openai': "OPENAI_API_KEY", 'anthropic': "ANTHROPIC_API_KEY", 'together': "TOGETHER_API_KEY"}
+
+_current_key = contextvars.ContextVar("panda_api_key", default=None)	# the ApiKey of the request we're making (if any)
+
+class ApiKey:
+    def __init__(self, provider, index, key):
+        self.provider = provider
+        self.key = key
+        self.label = f"{provider}#{index+1} (...{key[-4:]})"
+        self.in_flight = 0
+        self.resting_until = 0.0
+        self.stats = new_stats()
+
+def new_stats():
+    return {'requests': 0, 'rate_limited': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0, 'cost': 0.0}
+
+class KeyPool:
+    """The keys for one provider. acquire() picks a key (preferring keys that aren't resting after a 429), release() returns it."""
+    def __init__(self, provider, keys, selection="least_loaded"):
+        self.provider = provider
+        self.keys = [ApiKey(provider, i, key) for i, key in enumerate(keys)]
+        self.selection = selection
+        self.next = 0				# for round_robin
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            ready = [key for key in self.keys if key.resting_until <= now]
+            if not ready:					# all resting: take the one that's back soonest (the model is paused meanwhile)
+                ready = [min(self.keys, key=lambda key: key.resting_until)]
+            if self.selection == "round_robin":
+                n = len(self.keys)
+                key = next(self.keys[(self.next + i) % n] for i in range(n) if self.keys[(self.next + i) % n] in ready)
+                self.next = (self.keys.index(key) + 1) % n
+            else:
+                key = min(ready, key=lambda key: (key.in_flight, key.stats['requests']))
+            key.in_flight += 1
+            key.stats['requests'] += 1
+            return key
+
+    def release(self, key):
+        with self.lock:
+            key.in_flight -= 1
+
+    # Rest key after a 429. Returns True if another key is ready to take the retry.
+    def rest(self, key, seconds):
+        with self.lock:
+            now = time.monotonic()
+            key.resting_until = max(key.resting_until, now + seconds)
+            key.stats['rate_limited'] += 1
+            return any(other.resting_until <= now for other in self.keys)
+
+    def get_stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return [{'key': key.label, **key.stats, 'cost': round(key.stats['cost'], 4), 'in_flight': key.in_flight,
+                     'resting': round(max(0.0, key.resting_until - now), 1)} for key in self.keys]
+
+### ======================================================================
+###		THE POOLS
+### ======================================================================
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# The keys for provider, from config.API_KEYS_FILE, <PROVIDER>_API_KEYS or <PROVIDER>_API_KEY (in that order)
+def load_keys(provider):
+    if config.API_KEYS_FILE:
+        try:
+            with open(os.path.expanduser(config.API_KEYS_FILE), encoding="utf-8") as file:
+                keys = json.load(file).get(provider)
+            if keys:
+                return [keys] if isinstance(keys, str) else list(keys)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Couldn't read the API keys file {config.API_KEYS_FILE}: {e}")
+    env_name = ENV_NAMES.get(provider, provider.upper() + "_API_KEY")
+    keys = [key.strip() for key in os.environ.get(env_name + "S", "").split(",") if key.strip()]
+    if keys:
+        return keys
+    key = os.environ.get(env_name)
+    return [key] if key else []
+
+def get_pool(provider):
+    pool = _pools.get(provider)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(provider)
+            if pool is None:
+                pool = _pools[provider] = KeyPool(provider, load_keys(provider), selection=config.KEY_SELECTION)
+                if len(pool.keys) > 1:
+                    logger.info(f"Using a pool of {len(pool.keys)} {provider} API keys ({config.KEY_SELECTION})")
+    return pool
+
+def pool_size(provider):
+    return max(1, len(get_pool(provider).keys))
+
+"""
+with use_key("openai") as key:
+    ... make one request with key ...
+Yields the key (a str) to use for one request: api_key if given (an explicit key bypasses the pool), else one from
+provider's pool, else None (no key configured: the client library looks for one itself).
+"""
+@contextmanager
+def use_key(provider, api_key=None):
+    pool = None if api_key else get_pool(provider)
+    if not pool or not pool.keys:
+        yield api_key
+        return
+    key = pool.acquire()
+    token = _current_key.set(key)
+    try:
+        yield key.key
+    finally:
+        _current_key.reset(token)
+        pool.release(key)
+
+### ======================================================================
+###		429s AND USAGE
+### ======================================================================
+
+# Called by rate_limit.backoff() on a 429: rest the current request's key. Returns True if the retry can go to another
+# key straight away (so the model needn't back off), False if there's no pool (or every key is resting).
+def rest_current_key(seconds):
+    key = _current_key.get()
+    if key is None:
+        return False
+    pool = get_pool(key.provider)
+    another_ready = pool.rest(key, seconds)
+    if len(pool.keys) > 1:
+        logger.debug("DEBUG: 429 on %s: resting it for %.1fs", key.label, seconds)
+    return another_ready and len(pool.keys) > 1
+
+# Called by ledger.record_usage() with every response's usage. Returns the label of the key used (None if no pool).
+def record_key_usage(prompt_tokens, completion_tokens, cached_tokens=0, cost=None):
+    key = _current_key.get()
+    if key is None:
+        return None
+    with get_pool(key.provider).lock:
+        key.stats['prompt_tokens'] += prompt_tokens
+        key.stats['completion_tokens'] += completion_tokens
+        key.stats['cached_tokens'] += cached_tokens
+        key.stats['cost'] += cost or 0.0
+    return key.label
+
+def get_key_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.provider: pool.get_stats() for pool in pools if pool.keys}
+
+def reset_key_stats():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        with pool.lock:
+            for key in pool.keys:
+                key.stats = new_stats()
@@ -0,0 +1,149 @@
+"""
+Per-call usage ledger: one row for every call_llm() (and acall_llm()) call, so we can see where a run's seconds and dollars go.
+
+Each row: {'time', 'caller', 'model', 'answered_by', 'prompt_tokens', 'completion_tokens', 'cached_tokens',
+           'seconds', 'attempts', 'cache_hit', 'coalesced', 'cost', 'ok', 'api_key'}
+ - caller: what the call was for, e.g., the agent's mode ("act", "reflect", ...) - set with "with llm_caller('act'):"
+ - attempts: requests actually sent (retries, hedges and fallbacks included; 0 for a cache hit)
+ - coalesced: the answer came from an identical call already in flight (see llm_cache.single_flight)
+ - cost: estimated USD, from the price table in utils/models.py (None if the model's price isn't known)
+ - api_key: the label of the pooled API key that answered, e.g., "openai#2 (...x7Qa)" (see utils/key_pool.py)
+Token usage reported outside of call_llm() (e.g., a direct call_gpt()) gets a row of its own.
+
+run_panda() writes the ledger to experiment-llm-calls.jsonl, and puts summarize_calls() in its result. Each run has its own
+ledger (and per-model token counts, see ask_llm.get_token_counts()), set with use_run_usage(), so concurrent runs don't mix;
+outside a run, calls go to the process-wide ledger.
+
+USAGE:
+panda.utils.ledger.summarize_calls()
+-> {'calls': 42, 'cache_hits': 3, 'coalesced': 0, 'retries': 2, 'seconds': 431.2, 'cost': 1.23,
+    'by_caller': {'act': {'calls': 20, 'seconds': 250.1, 'cost': 0.71, ...}, ...}, 'by_model': {...}, 'by_key': {...}}
+"""
+
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from .models import estimate_cost
+from .key_pool import record_key_usage
+
+_calls = []			# the ledger rows, in order of completion (outside of any run)
+_token_counts = {}		# model -> token totals (outside of any run), see ask_llm.add_token_counts()
+_lock = threading.Lock()
+_run_usage = contextvars.ContextVar("panda_run_usage", default=None)		# (calls, token_counts) of the run we're in (if any)
+_current_call = contextvars.ContextVar("panda_llm_call", default=None)		# the row of the call_llm() we're inside (if any)
+_caller = contextvars.ContextVar("panda_llm_caller", default="other")
+
+@contextmanager
+def llm_caller(name):
+    token = _caller.set(name)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+def get_caller():
+    return _caller.get()
+
+# Make calls (in this context, and threads that copy it) go to a run's own ledger and token counts
+def use_run_usage(calls, token_counts):
+    _run_usage.set((calls, token_counts))
+
+def current_calls():
+    usage = _run_usage.get()
+    return _calls if usage is None else usage[0]
+
+def current_token_counts():
+    usage = _run_usage.get()
+    return _token_counts if usage is None else usage[1]
+
+def new_row(model):
+    return {'time': round(time.time(), 3), 'caller': _caller.get(), 'model': model, 'answered_by': None,
+            'prompt_tokens': 0, 'completion_tokens': 0, 'cached_tokens': 0,
+            'seconds': 0.0, 'attempts': 0, 'cache_hit': False, 'coalesced': False, 'cost': 0.0, 'ok': False, 'api_key': None}
+
+# Wrap one call_llm() call. The caller fills in row['ok'], row['cache_hit'], etc.; the token usage and attempts are
+# added by record_usage() and note_attempt() from the backends (also from hedge threads, which copy our context).
+@contextmanager
+def llm_call(model):
+    row = new_row(model)
+    token = _current_call.set(row)
+    start = time.monotonic()
+    try:
+        yield row
+    finally:
+        _current_call.reset(token)
+        row['seconds'] = round(time.monotonic() - start, 3)
+        with _lock:
+            current_calls().append(row)
+
+# Called from ask_llm.add_token_counts() with every response's usage
+def record_usage(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+    api_key = record_key_usage(prompt_tokens, completion_tokens, cached_tokens, cost)
+    row = _current_call.get()
+    with _lock:
+        if row is None:
+            row = new_row(model)
+            row.update(answered_by=model, attempts=1, ok=True)
+            current_calls().append(row)
+        row['prompt_tokens'] += prompt_tokens
+        row['completion_tokens'] += completion_tokens
+        row['cached_tokens'] += cached_tokens
+        row['cost'] = None if cost is None or row['cost'] is None else round(row['cost'] + cost, 6)
+        row['api_key'] = api_key or row['api_key']
+
+# Called (via rate_limit.wait_for_quota) before every request we send
+def note_attempt():
+    row = _current_call.get()
+    if row is not None:
+        with _lock:
+            row['attempts'] += 1
+
+# Rows recorded elsewhere, e.g., by the execution worker (see panda_agent/exec_worker.py), for the current ledger
+def add_calls(rows):
+    with _lock:
+        current_calls().extend(rows)
+
+def get_calls():
+    with _lock:
+        return [dict(row) for row in current_calls()]
+
+def reset_ledger():
+    with _lock:
+        current_calls().clear()
+
+def save_calls(path):
+    with open(path, "w", encoding="utf-8") as file:
+        for row in get_calls():
+            file.write(json.dumps(row) + "\n")
+
+### ======================================================================
+###		SUMMARY
+### ======================================================================
+
+def summarize_calls(rows=None):
+    rows = get_calls() if rows is None else rows
+    summary = totals(rows)
+    summary['by_caller'] = {caller: totals([row for row in rows if row['caller'] == caller]) for caller in sorted({row['caller'] for row in rows})}
+    summary['by_model'] = {model: totals([row for row in rows if (row['answered_by'] or row['model']) == model])
+                           for model in sorted({row['answered_by'] or row['model'] for row in rows})}
+    summary['by_key'] = {api_key: totals([row for row in rows if row.get('api_key') == api_key])
+                         for api_key in sorted({row.get('api_key') for row in rows} - {None})}
+    return summary
+
+def totals(rows):
+    costs = [row['cost'] for row in rows if row['cost'] is not None]
+    return {'calls': len(rows),
+            'failed': sum(1 for row in rows if not row['ok']),
+            'cache_hits': sum(1 for row in rows if row['cache_hit']),
+            'coalesced': sum(1 for row in rows if row['coalesced']),
+            'retries': sum(max(0, row['attempts'] - 1) for row in rows),
+            'seconds': round(sum(row['seconds'] for row in rows), 2),
+            'prompt_tokens': sum(row['prompt_tokens'] for row in rows),
+            'completion_tokens': sum(row['completion_tokens'] for row in rows),
+            'cached_tokens': sum(row['cached_tokens'] for row in rows),
+            'cost': round(sum(costs), 4),
+            'unpriced_calls': len(rows) - len(costs)}
@@ -0,0 +1,280 @@
+"""
+Persistent, on-disk cache of LLM responses, shared by every backend in ask_llm.call_llm().
+
+The cache is a single SQLite file (config.LLM_CACHE_FILE), so it survives across processes: re-running the
+same experiment, or a generated script that calls map_dataframe() over the same rows, is served from disk
+with zero API round-trips.
+
+USAGE:
+panda.utils.llm_cache.get_cache_stats()   -> {'hits': 12, 'misses': 3, 'entries': 15, 'bytes': 48213, 'max_bytes': 536870912}
+panda.utils.llm_cache.clear_cache()       # wipe the whole cache
+call_llm("What is 1 + 1?", cache=False)   # opt out for a single call
+
+Keys are a hash of the normalized messages (their rolling hash, see utils/dialog.py) + model + temperature + response_format.
+Entries are evicted least-recently-used first once the total size exceeds config.LLM_CACHE_MAX_BYTES. To keep reads
+read-only, a hit only records its access time if the last one is over config.LLM_CACHE_TOUCH_AFTER seconds old (so LRU is
+to within that), and the total size is kept as a running count, re-summed only when it looks over the limit.
+
+SINGLE-FLIGHT: the cache only helps once the first call has returned. If several threads (runs in threads, MCP jobs)
+or asyncio tasks ask for the same key at the same moment, single_flight() makes one of them (the "leader") do the
+call, and the others wait for and share its answer, rather than all hitting the API.
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import weakref
+import threading
+from concurrent.futures import Future
+
+from . import config
+from .logger import logger
+from .dialog import dialog_hash
+
+### ======================================================================
+###		CACHE KEYS
+### ======================================================================
+
+# "Normalize" = make two prompts that would produce the same API request hash identically:
+#   "What is 1 + 1?" == ["What is 1 + 1?"], and Windows vs. Unix newlines don't matter
+def normalize_prompt(prompt):
+    if isinstance(prompt, str):
+        prompt = [prompt]
+    normalized = []
+    for item in prompt:
+        if isinstance(item, str):
+            normalized.append(item.replace("\r\n", "\n"))
+        else:
+            normalized.append(item)			# already a {'role':..,'content':..} message
+    return normalized
+
+# response_format may be a dict, or a Pydantic class (see ask_llm.raw_call_gpt)
+def normalize_response_format(response_format):
+    if isinstance(response_format, type):
+        schema = response_format.model_json_schema() if hasattr(response_format, "model_json_schema") else response_format.__qualname__
+        return {"pydantic": schema}
+    return response_format
+
+# The messages are hashed turn by turn (dialog_hash), so a Dialog that just grew by a turn only hashes the new turn
+def make_cache_key(prompt, model, temperature=0, response_format=None):
+    key_data = {
+        "messages": dialog_hash(prompt),
+        "model": model,
+        "temperature": temperature,
+        "response_format": normalize_response_format(response_format),
+    }
+    key_str = json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+### ======================================================================
+###		THE CACHE ITSELF
+### ======================================================================
+
+EVICT_RESUM_PUTS = 1000		# re-sum the sizes at least this often (see _evict())
+
+class LLMCache:
+    """A byte-size-bounded LRU cache of LLM responses, stored in SQLite and safe to share across threads."""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")		# allow several Panda processes to share the file
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                model TEXT,
+                                response TEXT,
+                                size INTEGER,
+                                last_access REAL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self.conn.commit()
+        self.total = self._sum_sizes()		# running total of the entries' sizes (other processes' puts are picked up by _evict())
+        self.puts_since_sum = 0
+
+    def _sum_sizes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT response, last_access FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            now = time.time()
+            if now - (row[1] or 0) > config.LLM_CACHE_TOUCH_AFTER:		# (otherwise a hit is read-only: no write lock, no fsync)
+                self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self.conn.commit()
+            return row[0]
+
+    def put(self, key, response, model=None):
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, model, response, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                              (key, model, response, size, time.time()))
+            self.total += size - (old[0] if old else 0)
+            self.puts_since_sum += 1
+            self._evict()
+            self.conn.commit()
+
+    # Drop least-recently-used entries until the total size is back within max_bytes.
+    # We evict down to 90% of max_bytes so a full cache doesn't re-scan on every put. The running total only counts this
+    # process's puts, so it's re-summed before evicting (and every EVICT_RESUM_PUTS puts, to notice other processes' puts).
+    def _evict(self):
+        if self.total <= self.max_bytes and self.puts_since_sum < EVICT_RESUM_PUTS:
+            return
+        total = self.total = self._sum_sizes()
+        self.puts_since_sum = 0
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self.total = total
+        logger.debug("DEBUG: LLM cache evicted %d entries", len(evicted))
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+            self.total = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            entries, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total, "max_bytes": self.max_bytes}
+
+### ======================================================================
+###		MODULE-LEVEL ACCESS
+### ======================================================================
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# The cache is opened on first use (not at import), so importing panda doesn't touch the disk
+def get_cache():
+    global _cache
+    if not config.LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = LLMCache(config.LLM_CACHE_FILE, config.LLM_CACHE_MAX_BYTES)
+                except Exception as e:
+                    logger.warning(f"Couldn't open the LLM cache {config.LLM_CACHE_FILE}: {e}. Continuing without a cache...")
+                    config.LLM_CACHE_ENABLED = False
+                    return None
+    return _cache
+
+def clear_cache():
+    cache = get_cache()
+    if cache:
+        cache.clear()
+
+def get_cache_stats():
+    cache = get_cache()
+    stats = cache.stats() if cache else {"hits": 0, "misses": 0, "entries": 0, "bytes": 0, "max_bytes": 0}
+    stats["coalesced"] = coalesced_count		# calls that shared another caller's in-flight request
+    return stats
+
+### ======================================================================
+###		SINGLE-FLIGHT
+### ======================================================================
+
+_inflight = {}			# key -> Future of the leader's call
+_inflight_lock = threading.Lock()
+coalesced_count = 0
+
+# Return fn(), unless a call with the same key is already in flight, in which case wait for and return its result
+# (or its exception). fn is called by the first caller ("leader") only.
+def single_flight(key, fn):
+    global coalesced_count
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+        else:
+            coalesced_count += 1
+    if not leader:
+        return future.result()
+    try:
+        result = fn()
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+# ----------
+# asyncio version: one shared task per key (per event loop). If every waiter is cancelled, the shared task is cancelled too.
+
+_async_inflight = weakref.WeakKeyDictionary()		# loop -> {key: [task, n_waiters]}
+
+async def asingle_flight(key, coro_fn):
+    global coalesced_count
+    inflight = _async_inflight.setdefault(asyncio.get_running_loop(), {})
+    entry = inflight.get(key)
+    if entry is None:
+        task = asyncio.ensure_future(coro_fn())
+        entry = inflight[key] = [task, 0]
+        task.add_done_callback(lambda t: inflight.pop(key, None) if inflight.get(key, [None])[0] is t else None)
+    else:
+        coalesced_count += 1
+    entry[1] += 1
+    try:
+        return await asyncio.shield(entry[0])
+    except asyncio.CancelledError:
+        if entry[1] == 1:					# last waiter gone: stop the request
+            entry[0].cancel()
+        raise
+    finally:
+        entry[1] -= 1
+
+### ======================================================================
+###		AFTER A FORK
+### ======================================================================
+
+# In a forked child (e.g., the execution worker, see panda_agent/exec_worker.py): a SQLite connection must never be used
+# across a fork, so the child opens its own on first use. The parent's is kept referenced, not closed, as closing it in
+# the child could checkpoint or remove the WAL file under the parent. Calls in flight belong to the parent's threads,
+# which don't exist in the child, so nothing would ever resolve them.
+_forked_caches = []
+
+def _reset_after_fork():
+    global _cache, _cache_lock, _inflight_lock, _async_inflight
+    if _cache is not None:
+        _forked_caches.append(_cache)
+    _cache = None
+    _cache_lock = threading.Lock()
+    _inflight.clear()
+    _inflight_lock = threading.Lock()
+    _async_inflight = weakref.WeakKeyDictionary()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -42,3 +42,23 @@ def with_quiet_logging(fn, *args, **kwargs):
         return fn(*args, **kwargs)
     finally:
         root.setLevel(old_level)
+
+# async version of with_quiet_logging, for the LiteLLM acompletion() call in utils/ask_llm_async.py
+# Many calls may be in flight on the same event loop at once, so we count them and only restore the old
+# level when the last one finishes (otherwise overlapping calls could leave logging permanently switched off).
+_quiet_depth = 0
+_quiet_old_level = None
+
+async def awith_quiet_logging(fn, *args, **kwargs):
+    global _quiet_depth, _quiet_old_level
+    root = logging.getLogger()
+    if _quiet_depth == 0:
+        _quiet_old_level = root.level
+        root.setLevel(logging.ERROR)
+    _quiet_depth += 1
+    try:
+        return await fn(*args, **kwargs)
+    finally:
+        _quiet_depth -= 1
+        if _quiet_depth == 0:
+            root.setLevel(_quiet_old_level)
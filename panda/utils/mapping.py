@@ -157,7 +157,7 @@ def map_dataframe(dataframe:pd.DataFrame, prompt_template:str, output_col:str, m
 ### ----------------------------------------------------------------------
 
 """
-def map_datafram_multiple_choice(dataframe:pd.DataFrame, prompt_template:str, options, output_col:str, model=agent_config.PANDA_LLM):
+def map_dataframe_multiple_choice(dataframe:pd.DataFrame, prompt_template:str, options, output_col:str, model=agent_config.PANDA_LLM, return_probability=False):
 Purpose:
     Same as map_dataframe, except the responses are constained to be one of options.
     For every row in dataframe, query the model with the instantiated prompt_template, and put answers in the DataFrame column called output_col.
@@ -167,6 +167,7 @@ Args:
     options (list(str)): The allowed answer options
     output_col (str): The DataFrame column to place the answers in
     model (str): The model to query.
+    return_probability (bool): (optional) Also add a column output_col + "_probability" with the model's probability for its choice (GPT only, else None)
 Returns:
     DataFrame: The input dataframe updated with the answers. (Note: the input dataframe is destructively updated)
 Notes:
@@ -180,18 +181,23 @@ Example:
 
 [1] Can't have this function call map_dataframe_json internally as we need to allow non-JSON answers from model='llama'
 """
-def map_dataframe_multiple_choice(dataframe:pd.DataFrame, prompt_template:str, options, output_col:str, model=agent_config.PANDA_LLM, quiet=True):
+def map_dataframe_multiple_choice(dataframe:pd.DataFrame, prompt_template:str, options, output_col:str, model=agent_config.PANDA_LLM, quiet=True, return_probability=False):
 
     responses = []
+    probabilities = []
     for row_dict in dataframe.to_dict('records'):
         print_progress()
         try:
             prompt = prompt_template.format(**row_dict)
         except Exception as e:
             raise KeyError(f"GPT exception {e}. prompt_template might be referring to a column that's not in the dataframe?")
-        responses.append(call_llm_multiple_choice(prompt, options, model=model, quiet=quiet))    # [1]        
+        answer, probability = call_llm_multiple_choice(prompt, options, model=model, quiet=quiet, return_probability=True)    # [1]
+        responses.append(answer)
+        probabilities.append(probability)
 
     dataframe[output_col] = responses
+    if return_probability:
+        dataframe[output_col + "_probability"] = probabilities
     return dataframe        
 
 ### ======================================================================
@@ -0,0 +1,322 @@
+"""
+Offline mock LLM: the "mock" model family, for running run_panda(), map_dataframe() or the MCP server without API keys
+or network, and for load-testing/benchmarking Panda's own overhead.
+
+Models:
+    "mock" or "mock:agent"	rule-based: valid strategize/plan/reflect_on_plan/act/reflect JSON for the agent (a 2-step plan,
+                                each step a print() statement, then "done"), a choice for multiple-choice prompts, an instance of
+                                the schema for json_schema response formats, and a short canned text otherwise.
+                                (The plan's length and each step's code are config.MOCK_PLAN_STEPS and MOCK_ACTION.)
+    "mock:echo"			return the last prompt
+    "mock:<file>"		scripted responses from <file> (also config.MOCK_SCRIPT for plain "mock"): a JSON list (or JSONL) of
+                                {"match": REGEX, "response": STRING_OR_JSON}. Entries with a "match" answer any prompt whose last
+                                message matches; entries without one are used once each, in order. Anything else falls back to the rules.
+Behavior (see config.py):
+    MOCK_LATENCY	latency distribution, e.g., {"dist": "lognormal", "median": 2.0, "sigma": 0.5}, {"dist": "uniform", "low": 0.1,
+                        "high": 0.5}, {"dist": "exponential", "mean": 1.0}, {"dist": "fixed", "seconds": 0}
+    MOCK_ERRORS		injected failure probabilities per attempt: {"rate_limit": 0.05, "server_error": 0.01, "timeout": 0.01, "malformed_json": 0.1}
+Responses go through the same retry, rate-limit, token-count and ledger code as the real backends, but are never put in the
+persistent LLM cache (utils/llm_cache.py), so every call pays its latency and may fail.
+A local OpenAI-compatible HTTP server with the same behavior is in utils/mock_server.py.
+
+USAGE:
+panda.utils.call_llm("What is 1 + 1?", model="mock")
+panda.run_panda(task="Test the agent loop", model="mock")
+panda --task "Test the agent loop" --model mock			(or PANDA_LLM=mock for the MCP server)
+"""
+
+import os
+import re
+import ast
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+
+from . import config
+from .logger import logger
+from .models import count_words, estimate_prompt_tokens
+from .rate_limit import RetryableError, wait_for_quota, await_quota, backoff, abackoff
+
+_random = random.Random(config.MOCK_SEED)
+
+def is_mock_model(model):
+    return model == "mock" or model.startswith("mock:")
+
+### ======================================================================
+###		LATENCY AND ERROR INJECTION
+### ======================================================================
+
+def sample_latency(latency=None):
+    latency = latency or config.MOCK_LATENCY
+    dist = latency.get("dist", "fixed")
+    if dist == "fixed":
+        return latency.get("seconds", 0)
+    elif dist == "uniform":
+        return _random.uniform(latency.get("low", 0), latency.get("high", 1))
+    elif dist == "lognormal":			# median * e^N(0,sigma): a long right tail, like real LLM latencies
+        return latency.get("median", 1.0) * _random.lognormvariate(0, latency.get("sigma", 0.5))
+    elif dist == "exponential":
+        return _random.expovariate(1.0 / latency.get("mean", 1.0))
+    raise ValueError(f"Unrecognized mock latency distribution '{dist}' (should be fixed, uniform, lognormal or exponential)")
+
+# Returns the failure to inject on this attempt ("rate_limit", "server_error", "timeout", "malformed_json"), or None
+def pick_error(errors=None):
+    errors = config.MOCK_ERRORS if errors is None else errors
+    roll = _random.random()
+    for error, probability in errors.items():
+        if roll < probability:
+            return error
+        roll -= probability
+    return None
+
+def raise_error(error):
+    if error == "rate_limit":
+        raise RetryableError("Mock rate limit exceeded (429)", status_code=429, retry_after=config.MOCK_RETRY_AFTER)
+    elif error == "server_error":
+        raise RetryableError("Mock server overloaded (503)", status_code=503)
+    elif error == "timeout":
+        raise TimeoutError(f"Mock request timed out after {config.MOCK_TIMEOUT}s")
+
+# The usual LLM slips (json_repair.py should fix most of these without a re-query)
+def mangle_json(text):
+    kind = _random.choice(["truncate", "trailing_comma", "prose", "python"])
+    if kind == "truncate":
+        return text[:max(1, int(len(text) * 0.8))]
+    elif kind == "trailing_comma":
+        return re.sub(r'\s*([}\]])\s*$', r',\1', text)
+    elif kind == "prose":
+        return "Sure! Here is the JSON you asked for:\n" + text
+    return text.replace("true", "True").replace("false", "False").replace("null", "None")
+
+### ======================================================================
+###		RESPONSES
+### ======================================================================
+
+def as_prompts(prompt):
+    return [prompt] if isinstance(prompt, str) else list(prompt)
+
+def stable_index(text, n):
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % n if n else 0
+
+# The mock's answer (a string) to prompt, for model "mock" or "mock:<behavior>"
+def mock_response(prompt, model="mock", response_format=None):
+    prompts = as_prompts(prompt)
+    last = prompts[-1] if prompts else ""
+    if not isinstance(last, str):
+        last = json.dumps(last)
+    behavior = model.split(":", 1)[1] if ":" in model else ""
+    if behavior == "echo":
+        return last
+    script = behavior if behavior not in ["", "agent"] else config.MOCK_SCRIPT
+    if script:
+        scripted = scripted_response(script, last)
+        if scripted is not None:
+            return scripted
+    return rule_based_response(prompts, last, response_format)
+
+def rule_based_response(prompts, last, response_format=None):
+    schema = response_schema(response_format)
+    if schema:
+        return json.dumps(instance_from_schema(schema, last))
+
+    # ---------- the agent's dialog compaction (see panda_agent/compaction.py): a summary that keeps the current plan ----------
+    if COMPACTION_MARKER in last:
+        return mock_summary(prompts[:-1])
+
+    # ---------- the agent's modes: the mode's JSON template closest to the end of the prompt (see panda_agent_subprompts.py) ----------
+    positions = {mode: last.rfind(marker) for mode, marker in AGENT_MARKERS.items()}
+    mode = max(positions, key=positions.get)
+    if positions[mode] >= 0:
+        return json.dumps(agent_response(mode, prompts, last))
+
+    # ---------- multiple choice (call_llm_multiple_choice) ----------
+    match = re.search(r'CHOICE is exactly one of (\[.*\])', last)
+    if match:
+        try:
+            options = ast.literal_eval(match.group(1))
+            return json.dumps({"answer": options[stable_index(last, len(options))]})
+        except (ValueError, SyntaxError, IndexError):
+            pass
+
+    # ---------- any other JSON request: fill in the keys of the last {...} template in the prompt ----------
+    wants_json = isinstance(response_format, dict) and response_format.get("type") == "json_object"
+    if wants_json or "JSON" in last:
+        templates = re.findall(r'\{[^{}]*"\w+"\s*:[^{}]*\}', last)
+        keys = re.findall(r'"(\w+)"\s*:', templates[-1]) if templates else ["answer"]
+        return json.dumps({key: "mock" for key in keys})
+
+    return f"Mock response to: {' '.join(last.split()[:20])}"
+
+COMPACTION_MARKER = "which is too long to keep sending in full"
+
+AGENT_MARKERS = {"strategize": '{"strategy"', "plan_design_decisions": '{"design_decisions"', "plan": '{"plan": [{"step_number"',
+                 "reflect_on_plan": '{"doable"', "act": '{"thought":THOUGHT, "action":PYTHON_CODE}', "reflect": '"next_action":NEXT_ACTION'}
+
+def agent_response(mode, prompts, last):
+    if mode == "strategize":
+        return {"strategy": "plan", "explanation": "Mock: the task has a couple of distinct parts, so make a plan."}
+    elif mode == "plan_design_decisions":
+        return {"design_decisions": [{"number": 1, "design_decision": "Mock design decision", "recommendation": "Keep it simple"}]}
+    elif mode == "plan":
+        steps = ["Mock step: gather the data"] + [f"Mock step: analyze part {n}" for n in range(2, config.MOCK_PLAN_STEPS)] + ["Mock step: summarize the results"]
+        return {"plan": [{"step_number": n, "step": step} for n, step in enumerate(steps[-max(1, config.MOCK_PLAN_STEPS):], start=1)]}
+    elif mode == "reflect_on_plan":
+        return {"doable": "yes", "explanation": "Mock: each step is a simple Python action."}
+    elif mode == "act":
+        step = re.findall(r'Step (\d+)', last)
+        step_number = step[-1] if step else "1"
+        return {"thought": f"Mock: do step {step_number}.", "action": config.MOCK_ACTION.replace("{step}", step_number)}
+    return mock_reflection(prompts, last)
+
+# Next step if there is one in the latest plan, otherwise done
+def mock_reflection(prompts, last):
+    step = re.findall(r'Reflect on Step (\d+)', last)
+    step_number = int(step[-1]) if step else 1
+    n_steps = plan_length(prompts)
+    done = step_number >= n_steps
+    return {"thought": f"Mock: step {step_number} of {n_steps} ran without errors.", "task_complete": done, "current_step_complete": True,
+            "software_bug": False, "took_shortcuts": False, "next_action": "done" if done else "next_step"}
+
+# The number of steps in the current plan: the innermost plan of the latest task hierarchy in the prompts (see the agent's
+# format_task_hierarchy()), or the latest {"plan": ...} response if that's more recent. (The task hierarchy is in every
+# act prompt, so it's still there when the dialog has been compacted and the plan response folded into the summary.)
+TASK_HIERARCHY_PLAN = re.compile(r'Current (?:Sub)*Plan:\n((?:[ \t]*\d+\. .*\n)+)')
+
+def latest_plan_text(prompts):
+    for message in reversed(prompts):
+        if isinstance(message, str):
+            plans = TASK_HIERARCHY_PLAN.findall(message)
+            if plans:
+                return "Current Plan:\n" + plans[-1]
+    return ""
+
+def mock_summary(prompts):
+    return f"Mock summary of the earlier iterations: each step ran without errors.\n{latest_plan_text(prompts)}"
+
+def plan_length(prompts):
+    for message in reversed(prompts):
+        if not isinstance(message, str):
+            continue
+        plans = TASK_HIERARCHY_PLAN.findall(message)
+        if plans:
+            return len(plans[-1].splitlines())
+        if message.lstrip().startswith('{"plan"'):
+            try:
+                return len(json.loads(message)["plan"])
+            except (ValueError, KeyError, TypeError):
+                pass
+    return 1
+
+# The JSON schema of a json_schema response_format (or Pydantic class), if any
+def response_schema(response_format):
+    if isinstance(response_format, type) and hasattr(response_format, "model_json_schema"):
+        return response_format.model_json_schema()
+    if isinstance(response_format, dict) and response_format.get("type") == "json_schema":
+        return response_format.get("json_schema", {}).get("schema")
+    return None
+
+def instance_from_schema(schema, seed_text="", defs=None):
+    defs = schema.get("$defs", defs or {})
+    if "$ref" in schema:
+        return instance_from_schema(defs.get(schema["$ref"].split("/")[-1], {}), seed_text, defs)
+    if "enum" in schema:
+        return schema["enum"][stable_index(seed_text, len(schema["enum"]))]
+    kind = schema.get("type", "object")
+    kind = kind[0] if isinstance(kind, list) else kind
+    if kind == "object":
+        return {key: instance_from_schema(value, seed_text + key, defs) for key, value in schema.get("properties", {}).items()}
+    elif kind == "array":
+        return [instance_from_schema(schema.get("items", {"type": "string"}), seed_text, defs)]
+    elif kind in ["number", "integer"]:
+        return 0
+    elif kind == "boolean":
+        return False
+    elif kind == "null":
+        return None
+    return "mock"
+
+# ----------
+
+_scripts = {}			# path -> {'rules': [(regex, response)], 'queue': [response, ...]}
+_scripts_lock = threading.Lock()
+
+def load_script(path):
+    with open(path, encoding="utf-8") as file:
+        text = file.read()
+    entries = json.loads(text) if text.lstrip().startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+    as_text = lambda response: response if isinstance(response, str) else json.dumps(response)
+    return {'rules': [(re.compile(entry["match"], re.DOTALL), as_text(entry["response"])) for entry in entries if "match" in entry],
+            'queue': [as_text(entry["response"]) for entry in entries if "match" not in entry]}
+
+def scripted_response(path, last):
+    with _scripts_lock:
+        if path not in _scripts:
+            if not os.path.exists(path):
+                raise ValueError(f"Mock script file '{path}' not found (model should be mock, mock:agent, mock:echo, or mock:<script file>)")
+            _scripts[path] = load_script(path)
+        script = _scripts[path]
+        for pattern, response in script['rules']:
+            if pattern.search(last):
+                return response
+        if script['queue']:
+            return script['queue'].pop(0)
+    return None
+
+### ======================================================================
+###		THE BACKEND (called by ask_llm.dispatch_llm)
+### ======================================================================
+
+def mock_usage(model, prompt, answer):
+    prompt_tokens = estimate_prompt_tokens(model, count_words(as_prompts(prompt)))
+    completion_tokens = estimate_prompt_tokens(model, count_words(answer))
+    return prompt_tokens, completion_tokens
+
+# One attempt: the answer (possibly malformed), or raises the injected error. Latency is slept by the caller.
+def mock_attempt(prompt, model, response_format, error):
+    raise_error(error)
+    answer = mock_response(prompt, model, response_format)
+    if error == "malformed_json" and answer.lstrip().startswith(("{", "[")):
+        answer = mangle_json(answer)
+    return answer
+
+def call_mock(prompt, model="mock", response_format=None, quiet=True, stream=False, on_token=None):
+    from .ask_llm import add_token_counts		# (ask_llm imports this module)
+    for attempt in range(0, config.MAX_MOCK_ATTEMPTS):
+        wait_for_quota(model)
+        try:
+            error = pick_error()
+            time.sleep(config.MOCK_TIMEOUT if error == "timeout" else sample_latency())
+            answer = mock_attempt(prompt, model, response_format, error)
+            if not quiet:
+                logger.debug("DEBUG: mock response = %s", answer)
+            prompt_tokens, completion_tokens = mock_usage(model, prompt, answer)
+            add_token_counts(model, prompt_tokens, completion_tokens, prompt_tokens + completion_tokens)
+            if stream and on_token:
+                for token in re.findall(r'\S+\s*|\s+', answer):
+                    on_token(token)
+            return answer
+        except Exception as e:
+            logger.warning(f"ERROR from {model}: {e}. Trying again...")
+            backoff(model, attempt, e, max_attempts=config.MAX_MOCK_ATTEMPTS)
+    logger.error(f"ERROR from {model}: Giving up completely after {config.MAX_MOCK_ATTEMPTS} tries (returning '')")
+    return ""
+
+async def acall_mock(prompt, model="mock", response_format=None, quiet=True):
+    from .ask_llm import add_token_counts
+    for attempt in range(0, config.MAX_MOCK_ATTEMPTS):
+        await await_quota(model)
+        try:
+            error = pick_error()
+            await asyncio.sleep(config.MOCK_TIMEOUT if error == "timeout" else sample_latency())
+            answer = mock_attempt(prompt, model, response_format, error)
+            prompt_tokens, completion_tokens = mock_usage(model, prompt, answer)
+            add_token_counts(model, prompt_tokens, completion_tokens, prompt_tokens + completion_tokens)
+            return answer
+        except Exception as e:
+            logger.warning(f"ERROR from {model}: {e}. Trying again...")
+            await abackoff(model, attempt, e, max_attempts=config.MAX_MOCK_ATTEMPTS)
+    logger.error(f"ERROR from {model}: Giving up completely after {config.MAX_MOCK_ATTEMPTS} tries (returning '')")
+    return ""
@@ -0,0 +1,165 @@
+"""
+A local OpenAI-compatible stand-in server, answering /v1/chat/completions with the mock LLM's responses (utils/mock_llm.py),
+latencies and injected errors (real HTTP 429s with Retry-After, 503s, stalls, malformed JSON). Unlike model="mock", this
+exercises Panda's real HTTP path (transport.py connection pools, SSE streaming, status handling), or any other
+OpenAI-compatible client.
+
+Requests for a "mock..." model get that mock behavior; any other model name (e.g., gpt-4.1) gets the rule-based "mock".
+Streaming (stream=True, with stream_options include_usage) is supported; logprobs are not.
+
+USAGE:
+python -m panda.utils.mock_server --port 8765 --latency '{"dist": "lognormal", "median": 1.0, "sigma": 0.5}' --errors '{"rate_limit": 0.05}'
+PANDA_OAI_ENDPOINT=http://127.0.0.1:8765/v1/chat/completions panda --task "Test the agent loop" --model gpt-4.1
+
+or in-process (e.g., for a benchmark):
+server, url = panda.utils.mock_server.start_mock_server()	# port 0 = any free port
+panda.utils.config.OAI_ENDPOINT = url
+...
+server.shutdown()
+"""
+
+import re
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from . import config
+from . import mock_llm
+
+# The text of a message's content (a string, or a list of content blocks)
+def content_text(content):
+    if isinstance(content, list):
+        return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return content or ""
+
+def completion_json(model, answer, prompt_tokens, completion_tokens):
+    return {"id": "chatcmpl-mock-" + uuid.uuid4().hex[:12], "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop", "logprobs": None}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": 0}}}
+
+def error_json(message, error_type, code=None):
+    return {"error": {"message": message, "type": error_type, "code": code}}
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"		# keep-alive, like the real endpoints (so connection pooling is exercised)
+    server_version = "PandaMockLLM/1.0"
+    disable_nagle_algorithm = True		# headers and body are separate writes: without this each response waits ~40ms for a delayed ACK
+
+    def log_message(self, format, *args):	# quiet: a load test makes thousands of requests
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ["/v1/models", "/models"]:
+            self.send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "panda"}]})
+        else:
+            self.send_json(404, error_json(f"Unknown path {self.path}", "invalid_request_error"))
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ["/v1/chat/completions", "/chat/completions"]:
+            self.send_json(404, error_json(f"Unknown path {self.path}", "invalid_request_error"))
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompts = [content_text(message.get("content")) for message in request["messages"]]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_json(400, error_json(f"Malformed request: {e}", "invalid_request_error"))
+            return
+
+        model = request.get("model", "mock")
+        mock_model = model if mock_llm.is_mock_model(model) else "mock"
+        error = mock_llm.pick_error(self.server.errors)
+        time.sleep(self.server.stall if error == "timeout" else mock_llm.sample_latency(self.server.latency))
+        if error == "rate_limit":
+            self.send_json(429, error_json("Mock rate limit exceeded", "rate_limit_error", "rate_limit_exceeded"),
+                           headers={"Retry-After": str(config.MOCK_RETRY_AFTER)})
+            return
+        elif error in ["server_error", "timeout"]:
+            self.send_json(503 if error == "server_error" else 504, error_json(f"Mock {error}", "server_error"))
+            return
+
+        answer = mock_llm.mock_response(prompts, mock_model, request.get("response_format"))
+        if error == "malformed_json" and answer.lstrip().startswith(("{", "[")):
+            answer = mock_llm.mangle_json(answer)
+        prompt_tokens, completion_tokens = mock_llm.mock_usage(mock_model, prompts, answer)
+        if request.get("stream"):
+            self.stream_answer(model, answer, prompt_tokens, completion_tokens, include_usage=(request.get("stream_options") or {}).get("include_usage"))
+        else:
+            self.send_json(200, completion_json(model, answer, prompt_tokens, completion_tokens))
+
+    # Server-sent events, as OpenAI sends them: one delta per word, then (optionally) the usage, then [DONE]
+    def stream_answer(self, model, answer, prompt_tokens, completion_tokens, include_usage=False):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")		# no Content-Length, so the end of the stream is the end of the connection
+        self.end_headers()
+        self.close_connection = True
+        chunk_id = "chatcmpl-mock-" + uuid.uuid4().hex[:12]
+        def send_event(payload):
+            self.wfile.write(b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+        for token in re.findall(r'\S+\s*|\s+', answer):
+            send_event({"id": chunk_id, "object": "chat.completion.chunk", "model": model,
+                        "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+        if include_usage:
+            send_event({"id": chunk_id, "object": "chat.completion.chunk", "model": model, "choices": [],
+                        "usage": completion_json(model, "", prompt_tokens, completion_tokens)["usage"]})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=None, errors=None, stall=None, verbose=False):
+        super().__init__(address, MockHandler)
+        self.latency = latency or config.MOCK_LATENCY
+        self.errors = config.MOCK_ERRORS if errors is None else errors
+        self.stall = config.MOCK_TIMEOUT if stall is None else stall		# how long an injected "timeout" hangs before its 504
+        self.verbose = verbose
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):	# a client hanging up (e.g., after a 429) is normal
+            super().handle_error(request, client_address)
+
+# Start a server in a background thread. Returns (server, chat completions URL); stop it with server.shutdown()
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    server = MockServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="panda-mock-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1/chat/completions"
+
+def main():
+    parser = argparse.ArgumentParser(description="A local OpenAI-compatible mock LLM server, for testing and benchmarking Panda offline.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=json.loads, default=None, help='Latency distribution (JSON), e.g., \'{"dist": "lognormal", "median": 1.0, "sigma": 0.5}\'')
+    parser.add_argument("--errors", type=json.loads, default=None, help='Error probabilities (JSON), e.g., \'{"rate_limit": 0.05, "timeout": 0.01}\'')
+    parser.add_argument("--stall", type=float, default=None, help="Seconds an injected timeout hangs before failing.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), latency=args.latency, errors=args.errors, stall=args.stall, verbose=args.verbose)
+    print(f"Mock LLM server on http://{args.host}:{server.server_address[1]}/v1/chat/completions  (Ctrl-C to stop)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Model registry (context window, max output tokens, prices) and a calibrated, offline token estimator.
+
+Used by truncate_prompt() (via max_prompt_words()) so that each model's prompt is truncated to a real token budget,
+rather than a fixed 80000 words for every model.
+
+We count words (cheap, and memoized per dialog turn - see utils/dialog.py) and convert words to tokens with a
+per-model tokens-per-word ratio. The ratio starts at a conservative config.DEFAULT_TOKENS_PER_WORD (Panda's dialogs
+are full of code, JSON and tables, which tokenize much worse than prose), and is then calibrated from the actual
+usage.prompt_tokens reported by each call, as an exponential moving average. If a call is still rejected for being
+too long, the model's ratio is bumped (note_context_overflow()) so the retry is truncated harder, rather than failing
+the same way three times.
+
+USAGE:
+panda.utils.models.get_model_info("claude-sonnet-4-6")  -> {'context_window': 200000, 'max_output': 64000}
+panda.utils.models.max_prompt_words("gpt-4.1")          -> 81818
+panda.utils.models.get_token_ratios()                   -> {'gpt-4.1': 1.62}
+panda.utils.models.estimate_cost("gpt-4.1", prompt_tokens=100000, completion_tokens=2000, cached_tokens=80000)  -> 0.096
+"""
+
+import threading
+
+from . import config
+from .dialog import word_count
+
+### ======================================================================
+###		MODEL REGISTRY
+### ======================================================================
+
+# Keys are model name prefixes; the longest matching prefix wins.
+MODEL_INFO = {
+    "gpt-4.1":                  {"context_window": 1047576, "max_output": 32768},
+    "gpt-4o":                   {"context_window": 128000,  "max_output": 16384},
+    "gpt-4-1106-preview":       {"context_window": 128000,  "max_output": 4096},
+    "gpt-4.5":                  {"context_window": 128000,  "max_output": 16384},
+    "gpt-5":                    {"context_window": 400000,  "max_output": 128000},
+    "o1":                       {"context_window": 200000,  "max_output": 100000},
+    "o1-mini":                  {"context_window": 128000,  "max_output": 65536},
+    "o3":                       {"context_window": 200000,  "max_output": 100000},
+    "o4-mini":                  {"context_window": 200000,  "max_output": 100000},
+    "claude-3-5-sonnet":        {"context_window": 200000,  "max_output": 8192},
+    "claude-3-7-sonnet":        {"context_window": 200000,  "max_output": 64000},
+    "claude-sonnet-4":          {"context_window": 200000,  "max_output": 64000},
+    "claude-opus-4":            {"context_window": 200000,  "max_output": 32000},
+    "claude-haiku-4":           {"context_window": 200000,  "max_output": 64000},
+    "together_ai/meta-llama/Meta-Llama-3.1":   {"context_window": 131072, "max_output": 4096},
+    "together_ai/mistralai/Mistral-7B-Instruct-v0.2": {"context_window": 32768, "max_output": 4096},
+    "olmo":                     {"context_window": 4096,    "max_output": 1024},
+    "mock":                     {"context_window": 200000,  "max_output": 16384},
+}
+DEFAULT_MODEL_INFO = {"context_window": 128000, "max_output": 4096}
+
+# Panda's short names (as used by call_llm())
+def resolve_model(model):
+    return {"gpt4": config.DEFAULT_GPT4_MODEL, "gpt4.5": config.DEFAULT_GPT45_MODEL,
+            "claude": config.DEFAULT_CLAUDE_MODEL, "claude-3.5": config.CLAUDE35_MODEL,
+            "llama": config.LLAMA_MODEL, "mistral": config.MISTRAL_MODEL}.get(model, model)
+
+def lookup_model(table, model, default=None):
+    model = resolve_model(model)
+    matches = [prefix for prefix in table if model.startswith(prefix)]
+    return table[max(matches, key=len)] if matches else default
+
+def get_model_info(model):
+    return lookup_model(MODEL_INFO, model, DEFAULT_MODEL_INFO)
+
+# Tokens we can spend on the prompt: the context window, less room for the answer, capped by config.PROMPT_TOKEN_CAP
+# (a 1M-token window doesn't mean we want to pay for 1M-token prompts on every agent step)
+def prompt_token_budget(model):
+    info = get_model_info(model)
+    output_reserve = min(info["max_output"], config.OUTPUT_TOKEN_RESERVE)
+    return min(info["context_window"] - output_reserve, config.PROMPT_TOKEN_CAP)
+
+# The ratio is an average over whole prompts, so leave config.TOKEN_ESTIMATE_MARGIN for prompts that tokenize worse
+def max_prompt_words(model):
+    return int(prompt_token_budget(model) / (get_token_ratio(model) * (1 + config.TOKEN_ESTIMATE_MARGIN)))
+
+### ======================================================================
+###		PRICES
+### ======================================================================
+
+# USD per million tokens: input, cached input (read from the provider's prompt cache), output. Keys are prefixes, as above.
+# Extend/override with config.MODEL_PRICES (env PANDA_MODEL_PRICES).
+PRICES = {
+    "gpt-4.1":                  {"input": 2.00,  "cached_input": 0.50,  "output": 8.00},
+    "gpt-4.1-mini":             {"input": 0.40,  "cached_input": 0.10,  "output": 1.60},
+    "gpt-4.1-nano":             {"input": 0.10,  "cached_input": 0.025, "output": 0.40},
+    "gpt-4o":                   {"input": 2.50,  "cached_input": 1.25,  "output": 10.00},
+    "gpt-4.5":                  {"input": 75.00, "cached_input": 37.50, "output": 150.00},
+    "gpt-5":                    {"input": 1.25,  "cached_input": 0.125, "output": 10.00},
+    "gpt-5-mini":               {"input": 0.25,  "cached_input": 0.025, "output": 2.00},
+    "gpt-5-nano":               {"input": 0.05,  "cached_input": 0.005, "output": 0.40},
+    "o1":                       {"input": 15.00, "cached_input": 7.50,  "output": 60.00},
+    "o1-mini":                  {"input": 1.10,  "cached_input": 0.55,  "output": 4.40},
+    "o3":                       {"input": 2.00,  "cached_input": 0.50,  "output": 8.00},
+    "o3-mini":                  {"input": 1.10,  "cached_input": 0.55,  "output": 4.40},
+    "o4-mini":                  {"input": 1.10,  "cached_input": 0.275, "output": 4.40},
+    "claude-3-5-sonnet":        {"input": 3.00,  "cached_input": 0.30,  "output": 15.00},
+    "claude-3-7-sonnet":        {"input": 3.00,  "cached_input": 0.30,  "output": 15.00},
+    "claude-sonnet-4":          {"input": 3.00,  "cached_input": 0.30,  "output": 15.00},
+    "claude-opus-4":            {"input": 15.00, "cached_input": 1.50,  "output": 75.00},
+    "claude-haiku-4":           {"input": 1.00,  "cached_input": 0.10,  "output": 5.00},
+    "together_ai/meta-llama/Meta-Llama-3.1-8B":  {"input": 0.18, "cached_input": 0.18, "output": 0.18},
+    "together_ai/mistralai/Mistral-7B-Instruct": {"input": 0.20, "cached_input": 0.20, "output": 0.20},
+    "mock":                     {"input": 0.0,   "cached_input": 0.0,   "output": 0.0},
+}
+
+# Estimated cost (USD) of a call, or None if we don't know the model's price
+def estimate_cost(model, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+    price = lookup_model({**PRICES, **config.MODEL_PRICES}, model)
+    if price is None:
+        return None
+    uncached_tokens = max(0, prompt_tokens - cached_tokens)
+    return (uncached_tokens * price["input"] + cached_tokens * price["cached_input"] + completion_tokens * price["output"]) / 1e6
+
+### ======================================================================
+###		CALIBRATED TOKEN ESTIMATOR
+### ======================================================================
+
+_token_ratios = {}		# model -> tokens per word
+_ratios_lock = threading.Lock()
+
+def get_token_ratio(model):
+    return _token_ratios.get(resolve_model(model), config.DEFAULT_TOKENS_PER_WORD)
+
+# Words in a (truncated) prompt: a string or list of strings (word counts are memoized per turn)
+def count_words(prompts):
+    if isinstance(prompts, str):
+        return word_count(prompts)
+    return sum(word_count(prompt) for prompt in prompts or [] if isinstance(prompt, str))
+
+def estimate_prompt_tokens(model, n_words):
+    return int(n_words * get_token_ratio(model))
+
+# Called after each successful call, with the words we sent and the prompt_tokens the provider billed.
+# Tiny prompts are skipped, as the per-message overhead tokens would skew the ratio.
+def record_prompt_tokens(model, n_words, prompt_tokens):
+    if not n_words or not prompt_tokens or n_words < config.MIN_CALIBRATION_WORDS:
+        return
+    model = resolve_model(model)
+    observed = prompt_tokens / n_words
+    with _ratios_lock:
+        old = _token_ratios.get(model)
+        _token_ratios[model] = observed if old is None else (1 - config.TOKEN_RATIO_EMA) * old + config.TOKEN_RATIO_EMA * observed
+
+def get_token_ratios():
+    with _ratios_lock:
+        return {model: round(ratio, 3) for model, ratio in _token_ratios.items()}
+
+# ----------
+# The provider still said the prompt was too long: our ratio is too low for this model (or this dialog), so raise it
+# ----------
+
+CONTEXT_OVERFLOW_MESSAGES = ["context length", "context_length_exceeded", "context window", "ContextWindowExceeded",
+                             "prompt is too long", "too many tokens", "maximum context"]
+
+def is_context_overflow(error):
+    message = f"{type(error).__name__}: {error}"
+    return any(text.lower() in message.lower() for text in CONTEXT_OVERFLOW_MESSAGES)
+
+def note_context_overflow(model):
+    model = resolve_model(model)
+    with _ratios_lock:
+        _token_ratios[model] = _token_ratios.get(model, config.DEFAULT_TOKENS_PER_WORD) * config.CONTEXT_OVERFLOW_BUMP
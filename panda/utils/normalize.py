@@ -0,0 +1,106 @@
+"""
+Fast text normalization to ASCII, for LLM responses (call_llm()) and report text (replace_special_chars_with_ascii()).
+
+Both used to walk the text one character at a time in Python (unidecode, and unicodedata.normalize() + encode() per
+character), i.e., milliseconds per KB, although nearly all of Panda's text is plain ASCII. Now:
+ 1. str.isascii() fast path: ASCII text is returned as is (nanoseconds per KB)
+ 2. otherwise text.encode("ascii", errors=<our handler>): the ASCII stretches are copied in C, and the handler is called
+    once per run of non-ASCII characters, which it folds with str.translate()
+ 3. the translate tables are precomputed for the common code points (Latin-1, Latin Extended-A/B, General Punctuation,
+    and CUSTOM_REPLACEMENTS); any other code point is folded on demand and remembered in a bounded LRU
+The results are identical to the per-character versions, as each character is folded independently.
+
+ascii_fold(text)	Panda's rules: CUSTOM_REPLACEMENTS, else the NFKD decomposition's ASCII characters (accents dropped, é -> e)
+transliterate(text)	identical to unidecode(text) (e.g., "Ελλάδα" -> "Ellada")
+
+USAGE:
+panda.utils.normalize.ascii_fold("Claude’s answer — “mostly” right…")    -> 'Claude\'s answer - "mostly" right...'
+panda.utils.normalize.transliterate("Ελλάδα")                          -> 'Ellada'
+"""
+
+import codecs
+import unicodedata
+from functools import lru_cache
+
+RARE_CODE_POINTS = 4096		# folded code points remembered outside the precomputed ranges (per table)
+PRECOMPUTED_RANGES = [(0x80, 0x250), (0x2000, 0x2070)]	# Latin-1 Supplement, Latin Extended-A/B; General Punctuation
+
+# Replacements that NFKD doesn't give us (it would drop these characters altogether)
+CUSTOM_REPLACEMENTS = {
+    8212: ' - ',   # Em dash
+    8211: '-',     # En dash
+    8220: '"',     # Left double quotation mark
+    8221: '"',     # Right double quotation mark
+    8216: "'",     # Left single quotation mark
+    8217: "'",     # Right single quotation mark
+    8230: '...'    # Ellipsis
+    # Add more replacements as needed
+}
+
+### ======================================================================
+###		FOLDING ONE CHARACTER
+### ======================================================================
+
+def fold_ascii_char(char):
+    replacement = CUSTOM_REPLACEMENTS.get(ord(char))
+    if replacement is not None:
+        return replacement
+    return unicodedata.normalize('NFKD', char).encode('ascii', 'ignore').decode('ascii')
+
+def fold_unidecode_char(char):
+    from unidecode import unidecode		# (only needed for non-ASCII responses)
+    return unidecode(char)
+
+### ======================================================================
+###		TRANSLATE TABLES
+### ======================================================================
+
+class FoldTable(dict):
+    """A str.translate() table: code point -> ASCII replacement. Precomputed for the common code points; other code points
+    are folded on demand (__missing__) and kept in a bounded LRU rather than in the table, so it can't grow without limit."""
+
+    def __init__(self, fold):
+        super().__init__()
+        self.fold = fold
+        self.fold_rare = lru_cache(maxsize=RARE_CODE_POINTS)(fold)
+        self.built = False
+
+    def build(self):
+        code_points = [cp for start, end in PRECOMPUTED_RANGES for cp in range(start, end)] + list(CUSTOM_REPLACEMENTS)
+        self.update({cp: self.fold(chr(cp)) for cp in code_points})
+        self.built = True			# (two threads building at once just do the same work twice)
+
+    def __missing__(self, code_point):
+        return self.fold_rare(chr(code_point))
+
+    def translate(self, text):
+        if not self.built:
+            self.build()
+        return text.translate(self)
+
+ASCII_TABLE = FoldTable(fold_ascii_char)
+UNIDECODE_TABLE = FoldTable(fold_unidecode_char)
+
+# The codec error handlers: called by str.encode("ascii") with each run of non-ASCII characters
+def fold_ascii_run(error):
+    return ASCII_TABLE.translate(error.object[error.start:error.end]), error.end
+
+def fold_unidecode_run(error):
+    return UNIDECODE_TABLE.translate(error.object[error.start:error.end]), error.end
+
+codecs.register_error("panda_ascii_fold", fold_ascii_run)
+codecs.register_error("panda_transliterate", fold_unidecode_run)
+
+### ======================================================================
+###		NORMALIZING TEXT
+### ======================================================================
+
+def ascii_fold(text):
+    if text.isascii():
+        return text
+    return text.encode("ascii", "panda_ascii_fold").decode("ascii")
+
+def transliterate(text):
+    if text.isascii():
+        return text
+    return text.encode("ascii", "panda_transliterate").decode("ascii")
@@ -0,0 +1,198 @@
+"""
+Central retry and rate-limiting layer for the LLM backends in ask_llm.py / ask_llm_async.py.
+
+ - wait_for_quota(model, tokens): block until model's requests-per-minute and tokens-per-minute token buckets allow
+   another request. The buckets are shared by all threads (e.g., runs in threads, MCP jobs), so together they
+   run at, but not over, the provider's quota. Limits come from config.RATE_LIMITS (no limit if a model isn't listed),
+   and are per API key: with a pool of keys (see utils/key_pool.py) they're multiplied by the number of keys.
+ - backoff(model, attempt, error): sleep before the next retry, using exponential backoff with full jitter, or the
+   server's Retry-After header if there was one. A 429 also pauses *every* thread using that model until Retry-After,
+   unless there's a pool of keys: then just the key that got the 429 rests, and the retry goes to another key at once.
+
+Typical use in a backend:
+    for attempt in range(0, config.MAX_GPT_ATTEMPTS):
+        wait_for_quota(model, estimate_tokens(messages))
+        try:
+            response = transport.post(...)
+            raise_for_retryable_status(response)
+            ...
+            return content
+        except Exception as e:
+            logger.warning(...)
+            backoff(model, attempt, e, max_attempts=config.MAX_GPT_ATTEMPTS)
+"""
+
+import time
+import random
+import asyncio
+import threading
+import email.utils
+
+from . import config
+from .logger import logger
+from .ledger import note_attempt
+from .key_pool import pool_size, rest_current_key
+from .resilience import provider_of
+
+class RetryableError(Exception):
+    """A transient error from an LLM endpoint (429 rate limit, 5xx overload). retry_after is in seconds, if the server said."""
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+### ======================================================================
+###		RETRY-AFTER
+### ======================================================================
+
+# headers: any dict-like. Handles "Retry-After: 12", "Retry-After: <HTTP-date>", and OpenAI's "retry-after-ms: 1200"
+def parse_retry_after(headers):
+    if not headers:
+        return None
+    try:
+        value = headers.get("retry-after-ms") or headers.get("Retry-After-Ms")
+        if value is not None:
+            return max(0.0, float(value) / 1000)
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            retry_date = email.utils.parsedate_to_datetime(value)
+            return max(0.0, retry_date.timestamp() - time.time())
+    except Exception:
+        return None
+
+# Raise a RetryableError for a requests/httpx response with a 429 or 5xx status
+def raise_for_retryable_status(response):
+    status_code = getattr(response, "status_code", None)
+    if status_code == 429 or (status_code is not None and status_code >= 500):
+        raise RetryableError(f"HTTP {status_code} from {getattr(response, 'url', 'endpoint')}", status_code=status_code,
+                             retry_after=parse_retry_after(getattr(response, "headers", None)))
+
+# Pull (status_code, retry_after) out of any exception: ours, or LiteLLM's/OpenAI's (which carry .status_code and .response)
+def error_retry_info(error):
+    if isinstance(error, RetryableError):
+        return error.status_code, error.retry_after
+    status_code = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    retry_after = parse_retry_after(getattr(response, "headers", None)) if response is not None else None
+    return status_code, retry_after
+
+### ======================================================================
+###		TOKEN BUCKETS
+### ======================================================================
+
+class TokenBucket:
+    """
+    capacity tokens, refilled continuously at capacity/period per second.
+    reserve(n) takes n tokens immediately (the balance may go negative) and returns how long the caller must wait
+    for that debt to be repaid - so concurrent callers queue up fairly without holding the lock while they sleep.
+    """
+    def __init__(self, capacity, period=60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        amount = min(float(amount), self.capacity)		# a single huge request can't wait forever
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class ModelLimiter:
+    """The requests-per-minute and tokens-per-minute buckets for one model, plus a shared 'paused until' time after a 429."""
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.paused_until = 0.0
+
+    def reserve(self, tokens=0):
+        delay = max(0.0, self.paused_until - time.monotonic())
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens and tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(model):
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(model)
+            if limiter is None:
+                limits = config.RATE_LIMITS.get(model, {})
+                n_keys = pool_size(provider_of(model))		# the quotas are per key
+                limiter = ModelLimiter(rpm=limits.get("rpm") and limits["rpm"] * n_keys, tpm=limits.get("tpm") and limits["tpm"] * n_keys)
+                _limiters[model] = limiter
+    return limiter
+
+# Rough token count for the TPM bucket (about 4 characters per token)
+def estimate_tokens(messages):
+    if isinstance(messages, str):
+        return len(messages) // 4
+    total = 0
+    for message in messages or []:
+        content = message.get("content", "") if isinstance(message, dict) else message
+        if isinstance(content, list):				# content blocks, e.g., with Anthropic cache_control
+            content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+        total += len(content) // 4 if isinstance(content, str) else 0
+    return total
+
+### ======================================================================
+###		WAITING AND BACKING OFF
+### ======================================================================
+
+# Called before every attempt, so it also counts the attempts for the usage ledger
+def wait_for_quota(model, tokens=0):
+    note_attempt()
+    delay = get_limiter(model).reserve(tokens)
+    if delay > 0:
+        logger.debug("DEBUG: rate limit for %s: waiting %.1fs", model, delay)
+        time.sleep(delay)
+
+async def await_quota(model, tokens=0):
+    note_attempt()
+    delay = get_limiter(model).reserve(tokens)
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+# Exponential backoff with full jitter (random in [0, base * 2^attempt], capped), unless the server gave a Retry-After.
+def backoff_delay(attempt, retry_after=None):
+    if retry_after is not None:
+        return min(retry_after, config.RETRY_MAX_DELAY) + random.uniform(0, config.RETRY_BASE_DELAY)
+    return random.uniform(0, min(config.RETRY_MAX_DELAY, config.RETRY_BASE_DELAY * (2 ** attempt)))
+
+# Returns the delay before the next attempt (0 after the last attempt), pausing all users of model on a 429 (or, with a pool
+# of keys, resting just the key that got the 429 and retrying at once with another key)
+def _retry_delay(model, attempt, error, max_attempts):
+    status_code, retry_after = error_retry_info(error) if error is not None else (None, None)
+    another_key = status_code == 429 and rest_current_key(config.KEY_COOLDOWN if retry_after is None else retry_after)
+    if another_key or (max_attempts is not None and attempt >= max_attempts - 1):
+        return 0.0
+    delay = backoff_delay(attempt, retry_after)
+    if status_code == 429:
+        get_limiter(model).pause(delay)
+    return delay
+
+def backoff(model, attempt, error=None, max_attempts=None):
+    delay = _retry_delay(model, attempt, error, max_attempts)
+    if delay > 0:
+        time.sleep(delay)
+
+async def abackoff(model, attempt, error=None, max_attempts=None):
+    delay = _retry_delay(model, attempt, error, max_attempts)
+    if delay > 0:
+        await asyncio.sleep(delay)
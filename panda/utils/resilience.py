@@ -0,0 +1,248 @@
+"""
+Tail-latency and outage protection for call_llm() (see ask_llm.dispatch_with_fallback).
+
+ - Hedged requests: if a call to a model is still running after that model's recent p95 latency, fire a duplicate
+   request and take whichever answers first. Straggling requests (a stalled Claude call can sit for minutes) then
+   cost roughly one p95 latency rather than a full timeout. Off by default (config.HEDGE_REQUESTS), as a hedge
+   costs a second request's tokens. The losing request can't be cancelled mid-flight, it just finishes in the background.
+ - Fallback chain: config.FALLBACK_MODELS, e.g., {"claude-sonnet-4-6": ["gpt-4.1"]}. If a model fails (all retries
+   exhausted), the next model in its chain is tried, rather than returning "" to the agent.
+ - The async versions (ahedged_call(), used by ask_llm_async.adispatch_with_fallback) share the latencies, breakers and
+   fallback chains with the blocking ones. There the losing request of a hedge is cancelled.
+ - Circuit breaker per provider: after config.CIRCUIT_BREAKER_THRESHOLD consecutive failures, a provider is skipped
+   (straight to the fallback) for config.CIRCUIT_BREAKER_COOLDOWN seconds, then one trial call is let through.
+
+USAGE:
+panda.utils.resilience.get_resilience_stats()
+-> {'latency_p95': {'claude-sonnet-4-6': 14.2}, 'hedges': 3, 'hedge_wins': 2, 'breakers': {'anthropic': 'closed'}}
+"""
+
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+
+from . import config
+from .logger import logger
+
+### ======================================================================
+###		PROVIDERS
+### ======================================================================
+
+# Same model families as ask_llm.dispatch_llm()
+def provider_of(model):
+    if model == "olmo":
+        return "olmo"
+    elif model == "mock" or model.startswith("mock:"):
+        return "mock"
+    elif model.startswith(("o1", "o3", "o4", "gpt")):
+        return "openai"
+    elif model.startswith(("claude", "anthropic/")):
+        return "anthropic"
+    elif model in ["llama", "mistral"] or model.startswith(("llama", "meta", "mistral", "together_ai/")):
+        return "together"
+    else:
+        return model
+
+### ======================================================================
+###		LATENCY TRACKING AND HEDGING
+### ======================================================================
+
+_latencies = {}			# model -> deque of recent successful call latencies (seconds)
+_latencies_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+hedge_counts = {'hedges': 0, 'hedge_wins': 0}
+_hedge_counts_lock = threading.Lock()
+
+def count_hedge(name):
+    with _hedge_counts_lock:
+        hedge_counts[name] += 1
+
+def record_latency(model, seconds):
+    with _latencies_lock:
+        if model not in _latencies:
+            _latencies[model] = deque(maxlen=config.HEDGE_LATENCY_WINDOW)
+        _latencies[model].append(seconds)
+
+# The delay after which to hedge a call to model, or None if we don't have enough history to know what's slow
+def hedge_threshold(model):
+    with _latencies_lock:
+        samples = sorted(_latencies.get(model, ()))
+    if len(samples) < config.HEDGE_MIN_SAMPLES:
+        return None
+    p95 = samples[min(len(samples)-1, int(0.95 * len(samples)))]
+    return max(p95, config.HEDGE_MIN_DELAY)
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=config.HEDGE_MAX_WORKERS, thread_name_prefix="panda-hedge")
+    return _executor
+
+# In a forked child (e.g., the execution worker, see panda_agent/exec_worker.py), the parent's executor threads don't
+# exist, so calls submitted to it would never run: the child makes its own
+def _reset_executor_after_fork():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor_after_fork)
+
+def timed_call(fn, model):
+    start = time.monotonic()
+    answer = fn()
+    if answer:
+        record_latency(model, time.monotonic() - start)
+    return answer
+
+# Call fn() (which returns an answer string, "" on failure). If it is still running after the p95 threshold, also
+# start a duplicate, and return the first non-empty answer.
+def hedged_call(fn, model):
+    threshold = hedge_threshold(model) if config.HEDGE_REQUESTS else None
+    if threshold is None:
+        return timed_call(fn, model)
+
+    executor = get_executor()
+    submit = lambda: executor.submit(contextvars.copy_context().run, timed_call, fn, model)	# keep the caller's context vars
+    first = submit()
+    try:
+        return first.result(timeout=threshold)
+    except FutureTimeoutError:
+        pass
+
+    logger.debug("DEBUG: %s call still running after %.1fs (p95): sending a hedge request", model, threshold)
+    second = submit()
+    count_hedge('hedges')
+    pending = {first, second}
+    answer = ""
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                answer = future.result()
+            except Exception as e:
+                logger.warning(f"ERROR from {model} (hedged call): {e}")
+                answer = ""
+            if answer:
+                if future is second:
+                    count_hedge('hedge_wins')
+                return answer
+    return answer
+
+async def atimed_call(afn, model):
+    start = time.monotonic()
+    answer = await afn()
+    if answer:
+        record_latency(model, time.monotonic() - start)
+    return answer
+
+# Async version of hedged_call(): afn() returns a new coroutine for each request. The loser (or both, if we're cancelled) is cancelled.
+async def ahedged_call(afn, model):
+    threshold = hedge_threshold(model) if config.HEDGE_REQUESTS else None
+    if threshold is None:
+        return await atimed_call(afn, model)
+
+    first = asyncio.ensure_future(atimed_call(afn, model))		# (a task runs in a copy of the caller's context vars)
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=threshold)
+        if done:
+            return first.result()
+
+        logger.debug("DEBUG: %s call still running after %.1fs (p95): sending a hedge request", model, threshold)
+        second = asyncio.ensure_future(atimed_call(afn, model))
+        count_hedge('hedges')
+        pending = {first, second}
+        answer = ""
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    answer = task.result()
+                except Exception as e:
+                    logger.warning(f"ERROR from {model} (hedged call): {e}")
+                    answer = ""
+                if answer:
+                    if task is second:
+                        count_hedge('hedge_wins')
+                    return answer
+        return answer
+    finally:
+        for task in pending:
+            task.cancel()
+
+### ======================================================================
+###		CIRCUIT BREAKERS
+### ======================================================================
+
+class CircuitBreaker:
+    """closed (normal) -> open after threshold consecutive failures -> half-open (one trial call) after cooldown seconds"""
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False		# half-open: the one trial call has been let through, and hasn't finished
+        self.trial_started_at = None
+        self.lock = threading.Lock()
+
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    # Half-open lets through one caller (the trial), and the others are refused until it succeeds or fails. (A trial that
+    # never reported back, e.g., it raised, is given up on after another cooldown.)
+    def allow(self):
+        with self.lock:
+            state = self.state()
+            if state != "half-open":
+                return state == "closed"
+            if self.trial_in_flight and time.monotonic() - self.trial_started_at < self.cooldown:
+                return False
+            self.trial_in_flight, self.trial_started_at = True, time.monotonic()
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.trial_in_flight = False
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()		# (re)open: also after a failed half-open trial
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(provider):
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(config.CIRCUIT_BREAKER_THRESHOLD, config.CIRCUIT_BREAKER_COOLDOWN)
+        return _breakers[provider]
+
+def get_fallback_chain(model):
+    return [model] + [fallback for fallback in config.FALLBACK_MODELS.get(model, []) if fallback != model]
+
+### ======================================================================
+
+def get_resilience_stats():
+    with _latencies_lock:
+        models = {model: sorted(samples) for model, samples in _latencies.items()}
+    latency_p95 = {model: round(samples[min(len(samples)-1, int(0.95 * len(samples)))], 2) for model, samples in models.items() if samples}
+    with _breakers_lock:
+        breakers = {provider: breaker.state() for provider, breaker in _breakers.items()}
+    with _hedge_counts_lock:
+        hedges = dict(hedge_counts)
+    return {'latency_p95': latency_p95, **hedges, 'breakers': breakers}
@@ -0,0 +1,89 @@
+"""
+Where a run's time goes, by phase: cheap always-on timers around the agent loop's parts, so the controller's own
+overhead (prompt building, truncation, JSON extraction, code execution, save_dialog, write_report) can be measured
+separately from the LLM's wall time. Used by the benchmarks (panda/benchmarks/).
+
+Times are exclusive: a phase nested inside another (e.g., "llm" inside "exec", when the generated code calls call_llm(),
+or "truncate" inside "llm") is subtracted from the outer one, so the phases add up to (at most) the wall time.
+A phase nested directly in the same phase (e.g., call_gpt() inside call_llm(), both "llm") is the same call, so isn't counted again.
+The current phase is a context variable, so concurrent asyncio tasks (and threads) each keep track of their own.
+
+Also the process's current and peak resident set size (RSS), in bytes.
+
+USAGE:
+with timed("exec"):
+    ...
+@timed("save_dialog")
+def save_dialog(...):
+
+panda.utils.timing.get_timings()  -> {'llm': {'seconds': 12.31, 'calls': 24}, 'exec': {'seconds': 1.52, 'calls': 6}, ...}
+panda.utils.timing.reset_timings()
+"""
+
+import os
+import sys
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+_timings = {}			# phase -> {'seconds':.., 'calls':..}
+_lock = threading.Lock()
+_current = contextvars.ContextVar("panda_timed_phase", default=None)	# the innermost phase we're in: [phase, seconds in nested phases, parent]
+
+# A context manager, or a decorator (of a plain function; in a coroutine, use "with timed(..):" in its body)
+@contextmanager
+def timed(phase):
+    parent = _current.get()
+    frame = [phase, 0.0, parent]
+    token = _current.set(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _current.reset(token)
+        if parent is not None:
+            parent[1] += elapsed		# don't count it again in the enclosing phase
+        with _lock:
+            totals = _timings.setdefault(phase, {'seconds': 0.0, 'calls': 0})
+            totals['seconds'] += elapsed - frame[1]
+            if parent is None or parent[0] != phase:
+                totals['calls'] += 1
+
+def get_timings():
+    with _lock:
+        return {phase: {'seconds': round(totals['seconds'], 4), 'calls': totals['calls']} for phase, totals in _timings.items()}
+
+def reset_timings():
+    with _lock:
+        _timings.clear()
+
+### ======================================================================
+###		MEMORY
+### ======================================================================
+
+# Peak RSS of this process so far (bytes), or None if we can't tell on this platform
+def peak_rss():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024		# bytes on macOS, KB on Linux
+    except ImportError:		# Windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+
+# Current RSS (bytes), or None
+def current_rss():
+    try:
+        with open("/proc/self/statm") as file:		# Linux
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            return None
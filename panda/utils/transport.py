@@ -0,0 +1,119 @@
+"""
+Shared, pooled HTTP transport for the raw LLM backends in ask_llm.py (raw_call_gpt, raw_call_olmo, raw_call_tulu)
+and ask_llm_async.py.
+
+Rather than opening a fresh TLS connection with every requests.post(), we keep one keep-alive requests.Session
+per endpoint (scheme + host), with at most config.HTTP_POOL_MAXSIZE connections per host. Connections can be
+pre-warmed (TLS handshake done in the background) at the start of run_panda(), so the first short call doesn't pay for it.
+
+USAGE:
+body = json.dumps(data).encode("utf-8")			# serialize ONCE, reuse across retries
+response = transport.post(url, headers=headers, body=body, timeout=60)
+transport.prewarm_for_model("gpt-4.1")			# non-blocking
+"""
+
+import os
+import asyncio
+import weakref
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import config
+from .logger import logger
+
+### ======================================================================
+###		SYNC (requests) SESSIONS, ONE PER ENDPOINT
+### ======================================================================
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def endpoint_of(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+def get_session(url):
+    endpoint = endpoint_of(url)
+    session = _sessions.get(endpoint)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(endpoint)
+            if session is None:
+                session = requests.Session()
+                # pool_block=True: never open more than HTTP_POOL_MAXSIZE connections to one host, wait for a free one instead
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.HTTP_POOL_MAXSIZE, pool_block=True)
+                session.mount(endpoint, adapter)
+                _sessions[endpoint] = session
+    return session
+
+# body should already be serialized (bytes or str), so retries don't re-serialize a large dialog
+def post(url, headers=None, body=None, timeout=None, stream=False):
+    return get_session(url).post(url, headers=headers, data=body, timeout=timeout, stream=stream)
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+# In a forked child (e.g., the execution worker, see panda_agent/exec_worker.py), the pooled connections are the parent's
+# (the same TLS sessions), so the child starts with none and opens its own
+def _reset_after_fork():
+    global _sessions, _sessions_lock, _async_clients
+    _sessions = {}
+    _sessions_lock = threading.Lock()
+    _async_clients = weakref.WeakKeyDictionary()
+
+### ======================================================================
+###		PRE-WARMING
+### ======================================================================
+
+# Open (and TLS-handshake) a connection to each url in a background thread. The response itself is irrelevant
+# (a HEAD on a POST-only endpoint is typically a 404/405), we just want a live connection left in the pool.
+def prewarm(urls):
+    if not config.HTTP_PREWARM:
+        return
+    def _warm(url):
+        try:
+            get_session(url).head(url, timeout=10)
+        except Exception as e:
+            logger.debug("DEBUG: pre-warming %s failed: %s", url, e)
+    for url in urls:
+        threading.Thread(target=_warm, args=(url,), daemon=True).start()
+
+# Pre-warm the endpoint(s) that model will use. LiteLLM models (Claude, Llama, ...) manage their own connections.
+def prewarm_for_model(model):
+    if model == "olmo":
+        prewarm([config.OLMO_ENDPOINT])
+    elif model.startswith(("o1", "o3", "o4", "gpt")):
+        prewarm([config.OAI_ENDPOINT])
+
+### ======================================================================
+###		ASYNC (httpx) CLIENT, ONE PER EVENT LOOP
+### ======================================================================
+
+# An httpx.AsyncClient is bound to the event loop it was created in, so keep one (pooled, keep-alive) client per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_client():
+    import httpx		# only needed for the async API
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(max_connections=config.ASYNC_MAX_CONNECTIONS, max_keepalive_connections=config.ASYNC_MAX_KEEPALIVE_CONNECTIONS)
+        client = httpx.AsyncClient(limits=limits)
+        _async_clients[loop] = client
+    return client
+
+# Call this before the event loop is closed, e.g., await aclose_client() at the end of your main()
+async def aclose_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -2,10 +2,11 @@
 import json
 import re
 from html.parser import HTMLParser
-import unicodedata
 from .logger import logger
+from .json_repair import extract_json
+from .normalize import ascii_fold, CUSTOM_REPLACEMENTS
 
-# New version, courtesy of Claude
+# New version, courtesy of Claude. Now a wrapper around json_repair.extract_json(), which also repairs near-JSON
 def extract_json_from_string(text: str) -> any:
     """
     Robustly parse JSON from a Claude API response string.
@@ -14,41 +15,9 @@ def extract_json_from_string(text: str) -> any:
       - JSON wrapped in ```json ... ``` code fences
       - JSON wrapped in ``` ... ``` code fences (no language tag)
       - Surrounding text before/after the fenced block
+      - Near-JSON: trailing commas, raw newlines in strings, truncated responses, etc. (see json_repair.py)
     """
-    if not text or not text.strip():
-        raise ValueError("Empty response")
-
-    # 1. Try to extract from a code fence (```json or ``` with optional language tag)
-    fence_pattern = re.compile(
-        r'```(?:json)?\s*\n(.*?)\n\s*```',
-        re.DOTALL | re.IGNORECASE
-    )
-    matches = fence_pattern.findall(text)
-    for match in matches:
-        candidate = match.strip()
-        try:
-            return json.loads(candidate)
-        except json.JSONDecodeError:
-            continue  # try next match if multiple fences
-
-    # 2. Try parsing the whole string as-is
-    try:
-        return json.loads(text.strip())
-    except json.JSONDecodeError:
-        pass
-
-    # 3. Heuristic: find the first { or [ and try to parse from there
-    for start_char, end_char in [('{', '}'), ('[', ']')]:
-        start = text.find(start_char)
-        end = text.rfind(end_char)
-        if start != -1 and end != -1 and end > start:
-            candidate = text[start:end + 1]
-            try:
-                return json.loads(candidate)
-            except json.JSONDecodeError:
-                continue
-
-    raise ValueError(f"No valid JSON found in response: {text[:200]!r}")    
+    return extract_json(text)[0]
 
 # ----------    
 
@@ -170,34 +139,10 @@ def multiline_input(prompt="Enter your text (end with a blank line): "):
 #	GET RID OF SPECIAL CHARACTERS
 # ======================================================================
     
-# o1 version
-
-CUSTOM_REPLACEMENTS = {
-    8212: ' - ',   # Em dash
-    8211: '-',     # En dash
-    8220: '"',     # Left double quotation mark
-    8221: '"',     # Right double quotation mark
-    8216: "'",     # Left single quotation mark
-    8217: "'",     # Right single quotation mark
-    8230: '...'    # Ellipsis
-    # Add more replacements as needed
-}
-
+# o1 version, now with a fast path for ASCII text and a precomputed translate table (see normalize.py, which also
+# has CUSTOM_REPLACEMENTS, the characters we replace specially)
 def replace_special_chars_with_ascii(text):
-    global CUSTOM_REPLACEMENTS
-    result = []
-
-    for char in text:
-        code_point = ord(char)
-        if code_point in CUSTOM_REPLACEMENTS:
-            result.append(CUSTOM_REPLACEMENTS[code_point])
-        else:
-            normalized_char = unicodedata.normalize('NFKD', char)
-            ascii_bytes = normalized_char.encode('ascii', 'ignore')
-            ascii_char = ascii_bytes.decode('ascii')
-            result.append(ascii_char)
-    ascii_text = ''.join(result)
-    return ascii_text
+    return ascii_fold(text)
 
 ### ======================================================================
 
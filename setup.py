@@ -7,6 +7,7 @@ setup(
     packages=find_packages(),  # Automatically finds all packages like panda_agent, utils
     install_requires=[
         "requests",
+        "httpx",           # pooled async HTTP client for utils/ask_llm_async.py
         "openai",
         "pandas",
         "func_timeout",    # timeout control for exec()
@@ -15,11 +16,14 @@ setup(
         "unidecode",	   # for utils.ask_llm.call_llm to replace non-standard characters
         "mcp"
     ],
+    extras_require={
+        "fast": ["orjson"],	   # faster JSON parsing of LLM responses in utils/json_repair.py
+    },
     author='Peter Clark',
     description='An AI tool for autonomous scientific research',
     python_requires='>=3.7',
     package_data={
-        "panda": ["panda_agent/*.txt","panda_agent/*.html"]
+        "panda": ["panda_agent/*.txt","panda_agent/*.html","benchmarks/*.json"]
         },
     include_package_data=True,	# when setting up a *tool*, include the package_data files ALSO
     entry_points={
@@ -0,0 +1,5 @@
+# The tests run offline: model "mock" (see panda/utils/mock_llm.py) or replayed traces, and no persistent LLM cache
+import os
+
+os.environ.setdefault("PANDA_LLM_CACHE", "0")
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
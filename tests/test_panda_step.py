@@ -0,0 +1,23 @@
+from panda.panda_agent.panda_agent import run_panda
+
+# A step hook that raises the first time it sees mode (then never again)
+def failing_hook(mode):
+    failed = []
+    def hook(mode1, planinfo, planstack, state):
+        if mode1 == mode and not failed:
+            failed.append(planstack)
+            raise RuntimeError(f"hook failed at {mode1}")
+    return hook, failed
+
+def test_hook_exception_aborts_the_plan(tmp_path):
+    hook, failed = failing_hook("reflect")
+    result = run_panda(task="Test something", model="mock", outputs_dir=str(tmp_path), step_hooks=[hook])
+    assert failed and failed[0] != []			# it failed inside the subplan...
+    assert result["result_flag"] == "abort_python_error"	# ...which was aborted, and the failure passed up to the task
+    assert "Top-level run_panda() failed" not in result["summary"]	# (not escaping the step loop)
+
+def test_hook_that_always_raises_ends_the_run(tmp_path):
+    def hook(mode, planinfo, planstack, state):
+        raise RuntimeError("hook always fails")
+    result = run_panda(task="Test something", model="mock", outputs_dir=str(tmp_path), step_hooks=[hook])
+    assert result["result_flag"] == "abort_python_error"
@@ -0,0 +1,23 @@
+import os
+import re
+
+from panda.panda_agent import config as agent_config
+from panda.panda_agent.panda_agent import run_panda
+
+TRACE = os.path.join(os.path.dirname(__file__), "..", "output_demo", "experiment-20260210-143138", "experiment-trace-long.txt")
+
+# A copy of TRACE with only its first n agent turns (cut just before the (n+1)th prompt)
+def truncated_trace(tmp_path, n):
+    with open(TRACE, encoding="utf-8") as file:
+        text = file.read()
+    prompts = list(re.finditer("^" + re.escape(agent_config.PANDA_HEADER) + "\n", text, re.M))
+    path = tmp_path / "experiment-trace-long.txt"
+    path.write_text(text[:prompts[n].start()], encoding="utf-8")
+    return str(path)
+
+def test_replay_exhausted(tmp_path):
+    result = run_panda(replay_from=truncated_trace(tmp_path, 4), outputs_dir=str(tmp_path / "experiments"))
+    assert result["replay"]["exhausted"]
+    assert result["replay"]["turns_replayed"] == 4
+    assert result["result_flag"] == "abort_replay_exhausted"
+    assert result["llm_usage"]["failed"] == 1		# the call that ran out, not retried by call_llm_json()